@@ -4,6 +4,28 @@ import warnings
 
 # Import from package
 from .mirai import *
+from .batch import *
+from .query import *
+from .ephem import *
+from .tracks import *
+from .records import *
+from .barycentric import *
+from .nights import *
+from .shared import *
+from .metrics import *
+from .moon import *
+from .pipeline import *
+from .adaptive import *
+from .prune import *
+from .catalog import *
+from .cache import *
+from .journal import *
+from .shard import *
+from .systems import *
+from .study import *
+from .accuracy import *
+from .schedule import *
+from .intervals import *
 from .config import *
 
 warnings.simplefilter("ignore")
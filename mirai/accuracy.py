@@ -0,0 +1,510 @@
+# -*- coding: utf-8 -*-
+r"""
+Differential accuracy of the fast paths against the astroplan reference
+
+A fixed sample of the bundled TOI table is predicted from every site in
+SITES with the reference path and with each accelerated path, offline:
+
+* event_times: `get_event_times` (interpolated Earth positions) vs astropy
+  `Time.light_travel_time` at the site, in seconds
+* events: `get_event_windows` vs `astroplan.is_event_observable` at
+  ingress, midtransit and egress of every epoch
+* months: `observable_months` vs `astroplan.months_observable`
+* prune: `prune_targets` must not reject a target with observable months
+* study: transit counts of `study_sites` vs the reference events
+* windows: `get_observable_windows` (as in visible_months) vs
+  `is_event_observable` on a fine time grid
+* moon_phase, sky_brightness: `MoonPhaseConstraint` and
+  `SkyBrightnessConstraint` (cached Moon ephemeris) vs the same models
+  with astropy Moon positions and astroplan illumination on the fine grid
+
+Fast paths get coordinates from the catalogs as in `mirai`, the reference
+from the catalog RA/Dec. Targets a fast path fails on or leaves out count
+as disagreements. The sample always includes a TOI without a catalog
+distance.
+
+Each path reports the number of comparisons, largest time difference,
+disagreements and speedup over the reference, and fails if a tolerance in
+TOLERANCES is exceeded, so optimizations cannot silently change predictions.
+
+>>> report, diffs = run_accuracy(n_targets=8)
+>>> check_accuracy(report)
+"""
+import time
+
+import numpy as np
+import pandas as pd
+import astropy.units as u
+from astropy.time import Time
+from astropy.coordinates import SkyCoord
+from astroplan import (
+    FixedTarget,
+    is_event_observable,
+    months_observable,
+    moon_illumination,
+)
+
+from mirai.mirai import (
+    SITES,
+    get_obs_site,
+    get_constraints,
+    get_event_windows,
+    get_event_times,
+    parse_target_coord,
+)
+from mirai.batch import parse_window
+from mirai.records import FULL, PARTIAL
+from mirai.pipeline import observable_months
+from mirai.prune import prune_targets
+from mirai.shared import get_catalog
+from mirai.study import study_sites
+from mirai.nights import in_windows
+from mirai.adaptive import get_observable_windows
+from mirai.moon import (
+    MoonPhaseConstraint,
+    SkyBrightnessConstraint,
+    sky_brightness,
+)
+
+__all__ = ["TOLERANCES", "sample_targets", "run_accuracy", "check_accuracy"]
+
+# largest time difference [s] and fraction of disagreeing comparisons
+TOLERANCES = {
+    "event_times": dict(max_time_diff=1.0, max_disagreement=0),
+    "events": dict(max_time_diff=1.0, max_disagreement=0),
+    "months": dict(max_time_diff=0, max_disagreement=0),
+    "prune": dict(max_time_diff=0, max_disagreement=0),
+    # analytic altitudes are within 0.02 deg so events grazing a limit
+    # may differ
+    "study": dict(max_time_diff=0, max_disagreement=0.02),
+    # grid times within the edge tolerance of a window may differ
+    "windows": dict(max_time_diff=0, max_disagreement=0.005),
+    # times close to the thresholds may differ
+    "moon_phase": dict(max_time_diff=0, max_disagreement=0.005),
+    "sky_brightness": dict(max_time_diff=0, max_disagreement=0.005),
+}
+# spacing of the grid comparing windows and Moon constraints [min]
+GRID_RESOLUTION = 10
+# Moon constraints of faint targets; see `get_constraints`
+MAX_MOON_ILLUMINATION = 0.5
+MIN_SKY_BRIGHTNESS = 20.5
+
+
+def sample_targets(n_targets=8, seed=42):
+    """fixed sample of TOIs with a valid ephemeris from the bundled table
+
+    One of them is the first TOI without a catalog distance.
+
+    Returns
+    -------
+    sample : numpy.ndarray
+        CATALOG_DTYPE records sorted by TOI id
+    """
+    assert n_targets >= 1, "n_targets must be >= 1"
+    catalog = np.asarray(get_catalog("toi"))
+    ok = (
+        ~catalog["fp"]
+        & (catalog["per"] > 0)
+        & (catalog["dur"] > 0)
+        & np.isfinite(catalog["t0"])
+    )
+    pinned = np.flatnonzero(ok & ~np.isfinite(catalog["distance"]))[:1]
+    ok[pinned] = False
+    rng = np.random.default_rng(seed)
+    idx = rng.choice(
+        np.flatnonzero(ok), size=n_targets - len(pinned), replace=False
+    )
+    return catalog[np.sort(np.r_[idx, pinned])]
+
+
+def _reference_times(t0, per, obs_start, obs_end, target_coord, obs_site):
+    """epochs and utc JD of transits with astropy's light travel time"""
+    start, end = obs_start.tdb.jd, obs_end.tdb.jd
+    n1 = np.floor((start - t0) / per) - 1
+    n2 = np.ceil((end - t0) / per) + 1
+    epochs = np.arange(n1, n2 + 1).astype(int)
+    bjd = Time(t0 + epochs * per, format="jd", scale="tdb")
+    kwargs = dict(kind="barycentric", location=obs_site.location)
+    # the correction is evaluated at the arrival time, so iterate
+    arrival = bjd - bjd.light_travel_time(target_coord, **kwargs)
+    arrival = bjd - arrival.light_travel_time(target_coord, **kwargs)
+    jd = arrival.utc.jd
+    idx = (jd > obs_start.utc.jd) & (jd < obs_end.utc.jd)
+    return epochs[idx], jd[idx]
+
+
+def _reference_flags(mid, dur, obs_start, obs_end, coord, site, constraints):
+    """FULL and PARTIAL flags of every transit with is_event_observable"""
+    ing, egr = mid - dur / 2, mid + dur / 2
+    if len(mid) == 0:
+        return np.zeros(0, dtype=np.uint8)
+    times = Time(np.r_[ing, mid, egr], format="jd", scale="utc")
+    ok = is_event_observable(
+        constraints, site, FixedTarget(coord), times=times
+    ).reshape(3, -1)
+    full = ok[0] & ok[2] & (egr < obs_end.utc.jd)
+    return np.where(full, FULL, 0) | np.where(ok[1], PARTIAL, 0)
+
+
+def _reference_moon(obs_site, times):
+    """Moon altitude, azimuth, illumination and illumination at the local
+    mean midnight of each time with astropy and astroplan"""
+    altaz = obs_site.moon_altaz(times)
+    jd = times.utc.jd
+    offset = obs_site.location.lon.deg / 360
+    midnight = np.round(jd - 0.5 + offset) + 0.5 - offset
+    return dict(
+        altaz=altaz,
+        illumination=moon_illumination(times),
+        night_illumination=moon_illumination(Time(midnight, format="jd")),
+    )
+
+
+def _reference_moon_flags(moon, obs_site, coord, times):
+    """`MoonPhaseConstraint` and `SkyBrightnessConstraint` with moon"""
+    altaz = obs_site.altaz(times, coord)
+    moon_alt = moon["altaz"].alt.deg
+    phase = (moon["night_illumination"] <= MAX_MOON_ILLUMINATION) | (
+        moon_alt < 0
+    )
+    brightness = sky_brightness(
+        moon_alt,
+        altaz.alt.deg,
+        moon["altaz"].separation(altaz).deg,
+        moon["illumination"],
+    )
+    return phase, brightness >= MIN_SKY_BRIGHTNESS
+
+
+def _timed(func, *args, **kwargs):
+    t = time.perf_counter()
+    out = func(*args, **kwargs)
+    return out, time.perf_counter() - t
+
+
+def _fast(func, *args, default=None, **kwargs):
+    """output and run time of a fast path; default if it fails"""
+    t = time.perf_counter()
+    try:
+        out = func(*args, **kwargs)
+    except Exception as e:
+        name = getattr(func, "__name__", type(func).__name__)
+        print(f"{name}: {type(e).__name__} {e}")
+        out = default
+    return out, time.perf_counter() - t
+
+
+def _add(s, n, disagree, t_ref, t_fast, dt=0.0):
+    s["n"] += n
+    s["disagree"] += disagree
+    s["dt"] = max(s["dt"], dt)
+    s["ref"] += t_ref
+    s["fast"] += t_fast
+
+
+def run_accuracy(
+    n_targets=8,
+    sites=None,
+    window=("2026-06-01 12:00", "2026-07-01 12:00"),
+    seed=42,
+    time_grid_resolution=5,
+):
+    """compare every fast path with the astroplan reference
+
+    Parameters
+    ----------
+    n_targets : int
+        size of the fixed TOI sample; see `sample_targets`
+    sites : list
+        site names (default=all SITES)
+    window : tuple
+        (start, end) of transit predictions; see `parse_window`
+    time_grid_resolution : float
+        grid spacing of observable months [hr] as in `check_observable`
+
+    Returns
+    -------
+    report : pandas.DataFrame
+        one row per path: n_compared, max_time_diff [s], n_disagree,
+        disagreement (fraction), reference_time & path_time [s], speedup
+    diffs : pandas.DataFrame
+        one row per target, site and reference transit: time_diff [s],
+        reference_flags and path_flags (FULL | PARTIAL, 0 if not observable)
+    """
+    sites = list(SITES) if sites is None else sites
+    obs_start, obs_end = parse_window(window)
+    sample = sample_targets(n_targets, seed=seed)
+    targets = [f"toi{i:.2f}" for i in sample["id"]]
+    coords = SkyCoord(
+        ra=sample["ra"], dec=sample["dec"], unit=(u.deg, u.deg)
+    )
+    fast_coords = {}
+    for target in targets:
+        fast_coords[target], _ = _fast(parse_target_coord, target)
+    constraints = get_constraints()
+    moon_constraints = dict(
+        moon_phase=MoonPhaseConstraint(max=MAX_MOON_ILLUMINATION),
+        sky_brightness=SkyBrightnessConstraint(min=MIN_SKY_BRIGHTNESS),
+    )
+    grid = Time(
+        np.arange(obs_start.utc.jd, obs_end.utc.jd, GRID_RESOLUTION / 1440),
+        format="jd",
+    )
+    stats = {
+        path: dict(n=0, disagree=0, dt=0.0, ref=0.0, fast=0.0)
+        for path in TOLERANCES
+    }
+    rows = []
+    study_ref = {}
+    for site_name in sites:
+        obs_site = get_obs_site(site_name)
+        # Moon constraints are compared at night only
+        night = grid[obs_site.is_night(grid, horizon=-6 * u.deg)]
+        moon, t_moon = _timed(_reference_moon, obs_site, night)
+        for target, record, coord in zip(targets, sample, coords):
+            t0, per, dur = record["t0"], record["per"], record["dur"]
+            fast_coord = fast_coords[target]
+            # transit times
+            (ref_epochs, ref_mid), t_ref = _timed(
+                _reference_times, t0, per, obs_start, obs_end, coord, obs_site
+            )
+            (epochs, mid), t_fast = _fast(
+                get_event_times,
+                t0,
+                per,
+                obs_start,
+                obs_end,
+                fast_coord,
+                default=(np.zeros(0, dtype=int), np.zeros(0)),
+            )
+            common, i, j = np.intersect1d(
+                ref_epochs, epochs, return_indices=True
+            )
+            dt = np.full(len(ref_epochs), np.nan)
+            dt[i] = (mid[j] - ref_mid[i]) * 86400
+            # epochs found by only one path
+            _add(
+                stats["event_times"],
+                len(ref_epochs),
+                len(ref_epochs) + len(epochs) - 2 * len(common),
+                t_ref,
+                t_fast,
+                np.nanmax(np.abs(dt), initial=0),
+            )
+
+            # observability of each transit
+            ref_flags, t_ref = _timed(
+                _reference_flags,
+                ref_mid,
+                dur,
+                obs_start,
+                obs_end,
+                coord,
+                obs_site,
+                constraints,
+            )
+            events, t_fast = _fast(
+                get_event_windows,
+                t0,
+                per,
+                dur,
+                fast_coord,
+                obs_site,
+                obs_start,
+                obs_end,
+                constraints,
+            )
+            flags = np.zeros(len(ref_epochs), dtype=np.uint8)
+            time_diff = 0.0
+            if events is None:
+                # failed target disagrees even without transits
+                n_disagree = max(len(ref_epochs), 1)
+            else:
+                _, i, j = np.intersect1d(
+                    ref_epochs, events["epoch"], return_indices=True
+                )
+                flags[i] = events["flags"][j] & (FULL | PARTIAL)
+                n_disagree = np.sum(flags != ref_flags)
+                time_diff = np.nanmax(
+                    np.abs(events["midtransit"][j] - ref_mid[i]) * 86400,
+                    initial=0,
+                )
+            _add(
+                stats["events"],
+                len(ref_epochs),
+                n_disagree,
+                t_ref,
+                t_fast,
+                time_diff,
+            )
+            study_ref[(site_name, target)] = (
+                np.sum((ref_flags & FULL) > 0),
+                np.sum((ref_flags & PARTIAL) > 0),
+            )
+            rows.append(
+                pd.DataFrame(
+                    dict(
+                        site=site_name,
+                        target=target,
+                        epoch=ref_epochs,
+                        midtransit=ref_mid,
+                        time_diff=dt,
+                        reference_flags=ref_flags,
+                        path_flags=flags,
+                    )
+                )
+            )
+
+            # observable months on the same grid
+            ref_months, t_ref = _timed(
+                months_observable,
+                constraints,
+                obs_site,
+                [FixedTarget(coord)],
+                time_grid_resolution=time_grid_resolution * u.hour,
+            )
+            ref_months = ref_months[0]
+            months, t_fast = _fast(
+                observable_months,
+                constraints,
+                obs_site,
+                fast_coord,
+                time_grid_resolution=time_grid_resolution,
+            )
+            n_disagree = 12 if months is None else len(ref_months ^ months)
+            _add(stats["months"], 12, n_disagree, t_ref, t_fast)
+
+            # pruning must be conservative
+            keep, t_fast = _fast(
+                prune_targets, [fast_coord], obs_site, constraints
+            )
+            pruned = (keep is None) or (not keep[0])
+            n_disagree = int((len(ref_months) > 0) and pruned)
+            _add(stats["prune"], 1, n_disagree, t_ref, t_fast)
+
+            # observable windows on a fine grid
+            ref_ok, t_ref = _timed(
+                is_event_observable,
+                constraints,
+                obs_site,
+                FixedTarget(coord),
+                times=grid,
+            )
+            windows, t_fast = _fast(
+                get_observable_windows,
+                constraints,
+                obs_site,
+                fast_coord,
+                obs_start,
+                obs_end,
+            )
+            if windows is None:
+                n_disagree = len(grid)
+            else:
+                ok = in_windows(grid.utc.jd, windows)
+                n_disagree = np.sum(ok != ref_ok[0])
+            _add(stats["windows"], len(grid), n_disagree, t_ref, t_fast)
+
+            # Moon constraints at night
+            ref, t_ref = _timed(
+                _reference_moon_flags, moon, obs_site, coord, night
+            )
+            # the Moon is shared by all targets of a site
+            t_ref += t_moon / len(targets)
+            for path, ref_ok in zip(moon_constraints, ref):
+                ok, t_fast = _fast(
+                    moon_constraints[path],
+                    obs_site,
+                    fast_coord,
+                    times=night,
+                    grid_times_targets=True,
+                )
+                if ok is None:
+                    n_disagree = len(night)
+                else:
+                    n_disagree = np.sum(ok.reshape(-1) != ref_ok)
+                _add(stats[path], len(night), n_disagree, t_ref, t_fast)
+    diffs = pd.concat(rows, ignore_index=True)
+
+    # all sites and targets at once
+    study, t_fast = _fast(
+        study_sites,
+        targets,
+        [
+            dict(zip(["lat", "lon", "elev", "timezone"], SITES[s]))
+            for s in sites
+        ],
+        window=(obs_start, obs_end),
+        ephems={
+            t: (r["t0"], r["per"], r["dur"]) for t, r in zip(targets, sample)
+        },
+        n_workers=1,
+        default=pd.DataFrame(columns=["target", "n_full", "n_partial"]),
+    )
+    # one block of rows per site with the same targets found
+    site_names = np.repeat(sites, len(study) // len(sites))
+    found = {
+        (site, target): (n_full, n_partial)
+        for site, target, n_full, n_partial in zip(
+            site_names, study["target"], study["n_full"], study["n_partial"]
+        )
+    }
+    s = stats["study"]
+    s["fast"] = t_fast
+    s["ref"] = stats["events"]["ref"] + stats["event_times"]["ref"]
+    for k, (n_full, n_partial) in study_ref.items():
+        s["n"] += n_full + n_partial
+        if k in found:
+            s["disagree"] += abs(found[k][0] - n_full)
+            s["disagree"] += abs(found[k][1] - n_partial)
+        else:
+            # left out by the fast path
+            s["disagree"] += max(n_full + n_partial, 1)
+
+    report = pd.DataFrame(
+        [
+            dict(
+                path=path,
+                n_compared=int(s["n"]),
+                max_time_diff=s["dt"],
+                n_disagree=int(s["disagree"]),
+                disagreement=s["disagree"] / max(s["n"], 1),
+                reference_time=s["ref"],
+                path_time=s["fast"],
+                speedup=s["ref"] / s["fast"] if s["fast"] > 0 else np.inf,
+            )
+            for path, s in stats.items()
+        ]
+    )
+    return report, diffs
+
+
+def check_accuracy(report, tolerances=None, strict=True):
+    """whether each path of report is within its tolerances
+
+    Parameters
+    ----------
+    tolerances : dict
+        default=TOLERANCES
+    strict : bool
+        raise AssertionError if any path fails
+
+    Returns
+    -------
+    report : pandas.DataFrame
+        with a passed column
+    """
+    tolerances = TOLERANCES if tolerances is None else tolerances
+    passed = []
+    for _, row in report.iterrows():
+        tol = tolerances[row["path"]]
+        passed.append(
+            (row["max_time_diff"] <= tol["max_time_diff"])
+            and (row["disagreement"] <= tol["max_disagreement"])
+        )
+    report = report.assign(passed=passed)
+    failed = report.loc[~report["passed"], "path"].tolist()
+    errmsg = f"fast paths disagree with the reference: {failed}"
+    if strict:
+        assert len(failed) == 0, errmsg
+    return report
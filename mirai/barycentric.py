@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+r"""
+Barycentric to utc conversion of predicted event times
+
+Ephemerides of the TOI/CTOI tables are in BJD_TDB, i.e. times at the solar
+system barycenter. Light from the target reaches the Earth up to ~8.3 min
+earlier or later depending on the target direction and the time of year:
+
+    t_earth = BJD_TDB - r_earth . n / c
+
+with r_earth the barycentric Earth position and n the target direction.
+Earth positions are computed once per window on a 6 h grid and interpolated
+linearly (error < 1 ms), so the correction of all epochs of all targets is a
+few array operations. The offset of the site from the geocenter (< 21 ms)
+is neglected.
+
+>>> mid_utc = bjd_to_utc(t0 + per * epochs, target_coord)
+"""
+import numpy as np
+import astropy.units as u
+from astropy import constants
+from astropy.time import Time
+from astropy.coordinates import (
+    UnitSphericalRepresentation,
+    get_body_barycentric,
+)
+
+from mirai.shared import shared_array
+from mirai.tracks import _directions
+
+__all__ = ["get_earth_positions", "light_travel_time", "bjd_to_utc"]
+
+# earth position grid spacing [d]
+GRID_STEP = 0.25
+# earth positions keyed by grid start and end day
+_EARTH_CACHE = {}
+C_KM_S = constants.c.to(u.km / u.s).value
+
+
+def get_earth_positions(start, end):
+    """barycentric Earth positions covering start-end; shared per window
+
+    Parameters
+    ----------
+    start, end : float
+        tdb JD
+
+    Returns
+    -------
+    jd, xyz : numpy.ndarray
+        (n,) tdb JD grid and (3, n) positions [km]
+    """
+    # any cached grid covering the times is reused
+    for (first, last), grid in _EARTH_CACHE.items():
+        if (first <= start) and (end <= last):
+            return grid
+    # whole months so that runs with nearby windows share the grid file
+    key = (np.floor(start / 30) * 30 - 1, np.ceil(end / 30) * 30 + 1)
+    if key not in _EARTH_CACHE:
+        jd = np.arange(key[0], key[1] + GRID_STEP, GRID_STEP)
+
+        def compute():
+            times = Time(jd, format="jd", scale="tdb")
+            return get_body_barycentric("earth", times).xyz.to(u.km).value
+
+        # computed by the first process, memory-mapped by the others
+        xyz = shared_array(f"earth_{key[0]:.0f}_{key[1]:.0f}", compute)
+        _EARTH_CACHE[key] = (jd, xyz)
+    return _EARTH_CACHE[key]
+
+
+def _unit_vectors(coords):
+    """(3, n) unit vectors of SkyCoord (scalar or array)"""
+    # direction only; distances may be missing e.g. in the TOI table
+    unit = _directions(coords).represent_as(UnitSphericalRepresentation)
+    return unit.to_cartesian().xyz.value.reshape(3, -1)
+
+
+def light_travel_time(jd, coords):
+    """barycentric minus geocentric arrival time [d] at tdb JD
+
+    Parameters
+    ----------
+    jd : numpy.ndarray
+        tdb JD of events
+    coords : SkyCoord
+        one target for all events or one target per event
+
+    Returns
+    -------
+    ltt : numpy.ndarray
+        same shape as jd
+    """
+    jd = np.asarray(jd, dtype=float)
+    if jd.size == 0:
+        return np.zeros(jd.shape)
+    grid, xyz = get_earth_positions(jd.min(), jd.max())
+    flat = jd.reshape(-1)
+    r = np.stack([np.interp(flat, grid, x) for x in xyz])
+    n = _unit_vectors(coords)
+    ltt = np.sum(r * n, axis=0) / C_KM_S / 86400
+    return ltt.reshape(jd.shape)
+
+
+def bjd_to_utc(bjd, coords):
+    """utc JD at the Earth of events at BJD_TDB
+
+    Parameters
+    ----------
+    bjd : numpy.ndarray
+        BJD_TDB of events
+    coords : SkyCoord
+        one target for all events or one target per event
+
+    Returns
+    -------
+    jd : numpy.ndarray
+        utc JD with the shape of bjd
+    """
+    bjd = np.asarray(bjd, dtype=float)
+    # the correction changes by < 1 ms within 8 min so one iteration is
+    # enough
+    tdb = bjd - light_travel_time(bjd, coords)
+    tdb = bjd - light_travel_time(tdb, coords)
+    if tdb.size == 0:
+        return tdb
+    return Time(tdb, format="jd", scale="tdb").utc.jd
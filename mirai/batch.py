@@ -0,0 +1,684 @@
+# -*- coding: utf-8 -*-
+r"""
+Transit predictions for many targets using a pool of worker processes
+"""
+import io
+import time
+import traceback
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from astropy.time import Time, TimeDelta
+
+from mirai.config import DATA_PATH
+from mirai.mirai import (
+    DEFAULT_BASELINE,
+    get_tois,
+    get_ctois,
+    get_obs_site,
+    get_constraints,
+    check_observable,
+    get_event_windows,
+    get_t0_per_dur,
+    parse_target_coord,
+    get_remote_request,
+    coord_from_record,
+)
+from mirai.query import get_resolver
+from mirai.metrics import get_metrics
+from mirai.journal import classify_error
+from mirai.prune import prune_targets
+from mirai.shared import publish_catalogs
+from mirai.catalog import get_catalog_changes, catalog_name
+from mirai.cache import cache_key, missing_spans, get_transit_windows_cached
+from mirai.records import (
+    EVENT_DTYPE,
+    events_to_frame,
+    make_events,
+    select_events,
+)
+
+__all__ = [
+    "predict_transit",
+    "predict_transits",
+    "results_to_frame",
+    "parse_window",
+    "prefetch_coords",
+    "refresh_catalogs",
+    "patch_results",
+]
+
+
+def parse_window(window=None):
+    """convert window into a pair of astropy Time
+
+    Parameters
+    ----------
+    window : tuple
+        (start, end) as str, float [JD] or Time; end can be None
+        (default=(now, now+DEFAULT_BASELINE days))
+    """
+    start, end = (None, None) if window is None else window
+    obs_start = Time.now() if start is None else _to_time(start)
+    if end is None:
+        obs_end = obs_start + TimeDelta(DEFAULT_BASELINE, format="jd")
+    else:
+        obs_end = _to_time(end)
+    assert obs_end > obs_start, "window end must be after window start"
+    return obs_start, obs_end
+
+
+def _to_time(t):
+    if isinstance(t, Time):
+        return t
+    elif isinstance(t, (int, float)):
+        return Time(t, format="jd")
+    return Time(t)
+
+
+def _init_worker(site, clobber=False):
+    """load catalogs and site once per worker process
+
+    Without clobber, workers attach to the shared catalog records (see
+    `mirai.shared`) instead of reading the tables into DataFrames.
+    """
+    if clobber:
+        _ = get_tois(clobber=clobber)
+        _ = get_ctois(clobber=clobber)
+    else:
+        # stale versions are removed by the parent; see `predict_transits`
+        _ = publish_catalogs(clean=False)
+    _ = get_obs_site(**site)
+
+
+def _init_metrics_worker(site, clobber=False):
+    """`_init_worker` for workers which return their metrics"""
+    # forked workers start with a copy of the metrics of the parent
+    get_metrics().reset()
+    _init_worker(site, clobber=clobber)
+
+
+def _normalize_target(target):
+    return target.lower().strip().replace("-", "")
+
+
+def prefetch_coords(targets, resolver=None):
+    """resolve coordinates of targets outside the TOI/CTOI tables concurrently
+
+    Parameters
+    ----------
+    targets : list
+        target names
+    resolver : mirai.query.RemoteResolver
+        default is the shared resolver of this process
+
+    Returns
+    -------
+    coords : dict
+        {target: SkyCoord or exception raised by the lookup}
+    """
+    resolver = get_resolver() if resolver is None else resolver
+    requests = {}
+    for target in map(_normalize_target, targets):
+        try:
+            request = get_remote_request(target)
+        except ValueError:
+            # malformed id; reported by predict_transit
+            continue
+        if request is not None:
+            requests[target] = request
+    values = resolver.resolve_many_sync(list(requests.values()))
+    coords = {}
+    for target, value in zip(requests, values):
+        if isinstance(value, Exception):
+            coords[target] = value
+        else:
+            coords[target] = coord_from_record(value)
+    return coords
+
+
+def _prune(targets, site, coords, alt_limit=30, min_moon_sep=10, **kwargs):
+    """targets which can never be observed from site (see `mirai.prune`)
+
+    Coordinates of TOI/CTOI targets are read from the catalogs and added
+    to coords so that workers do not look them up again.
+    """
+    obs_site = get_obs_site(**site)
+    constraints = get_constraints(
+        alt_limit=alt_limit, min_moon_sep=min_moon_sep
+    )
+    names = []
+    for target in map(_normalize_target, targets):
+        if target not in coords:
+            try:
+                coords[target] = parse_target_coord(
+                    target, clobber=kwargs.get("clobber", False)
+                )
+            except Exception:
+                # reported by predict_transit
+                continue
+        if not isinstance(coords[target], Exception):
+            names.append(target)
+    if len(names) == 0:
+        return set()
+    ok = prune_targets([coords[t] for t in names], obs_site, constraints)
+    return set(t for t, o in zip(names, ok) if not o)
+
+
+def _get_cache_key(target, ephem, coord, site, kwargs):
+    """cache key of target or None if its inputs cannot be found here"""
+    if (coord is None) or isinstance(coord, Exception):
+        return None
+    try:
+        if ephem is None:
+            # get_t0_per_dur prints which catalog is used
+            with redirect_stdout(io.StringIO()):
+                ephem = get_t0_per_dur(
+                    target, clobber=kwargs.get("clobber", False)
+                )
+        return cache_key(
+            *ephem,
+            coord,
+            get_obs_site(**site),
+            kwargs.get("alt_limit", 30),
+            kwargs.get("min_moon_sep", 10),
+            kwargs.get("max_moon_illumination"),
+            kwargs.get("min_sky_brightness"),
+        ), tuple(map(float, ephem))
+    except Exception:
+        # reported by predict_transit
+        return None
+
+
+def _parse_site(site):
+    """site can be a name in SITES or a dict of get_obs_site kwargs"""
+    if isinstance(site, dict):
+        return site
+    return dict(site_name=site)
+
+
+def predict_transit(
+    target,
+    site="OT",
+    window=None,
+    ephem=None,
+    coord=None,
+    alt_limit=30,
+    min_moon_sep=10,
+    max_moon_illumination=None,
+    min_sky_brightness=None,
+    clobber=False,
+    cache=None,
+    check=True,
+    kinds=("transit",),
+):
+    """predict observable transits of a single target
+
+    Parameters
+    ----------
+    target : str
+        target name as in `mirai` e.g. toi200.01
+    site : str or dict
+        site name in SITES or kwargs of `get_obs_site`
+    window : tuple
+        (start, end) of observation; see `parse_window`
+    ephem : tuple
+        (t0, per, dur) in (BJD, d, d); queried from TOI/CTOI if None
+    coord : SkyCoord
+        target coordinates; queried if None
+    max_moon_illumination, min_sky_brightness : float
+        optional Moon constraints; see `get_constraints`
+    cache : mirai.cache.ResultCache
+        reuse and store predictions; only nights not in cache are computed
+    check : bool
+        check if target is observable in any month (see `check_observable`);
+        skipped if already done e.g. for another candidate of the same host
+    kinds : tuple
+        event kinds e.g. ('transit', 'secondary', 'quadrature'); see
+        `get_event_windows`; the cache supports transits only
+
+    Returns
+    -------
+    result : dict
+        target, site, status ('ok' or 'error'), ephemeris, events (full
+        and partial transits; see `mirai.records.make_events`);
+        error_type and error message if status=='error';
+        the updated cache if given
+    """
+    target = _normalize_target(target)
+    start = time.perf_counter()
+    result = dict(
+        target=target,
+        site=None,
+        status="ok",
+        t0=None,
+        per=None,
+        dur=None,
+        events=None,
+        error_type=None,
+        error=None,
+    )
+    try:
+        obs_site = get_obs_site(**_parse_site(site))
+        result["site"] = obs_site.name
+        obs_start, obs_end = parse_window(window)
+        if coord is None:
+            target_coord = parse_target_coord(target, clobber=clobber)
+        elif isinstance(coord, Exception):
+            # failed remote lookup in prefetch_coords
+            raise coord
+        else:
+            target_coord = coord
+        constraints = get_constraints(
+            alt_limit=alt_limit,
+            min_moon_sep=min_moon_sep,
+            max_moon_illumination=max_moon_illumination,
+            min_sky_brightness=min_sky_brightness,
+        )
+        if ephem is None:
+            t0, per, dur = get_t0_per_dur(target, clobber=clobber)
+        else:
+            t0, per, dur = ephem
+        key = None
+        if cache is not None:
+            key = cache_key(
+                t0,
+                per,
+                dur,
+                target_coord,
+                obs_site,
+                alt_limit,
+                min_moon_sep,
+                max_moon_illumination,
+                min_sky_brightness,
+            )
+        # cached targets were found observable before
+        if check and ((cache is None) or (key not in cache)):
+            _ = check_observable(target_coord, obs_site, constraints)
+        result.update(t0=t0, per=per, dur=dur)
+        args = (t0, per, dur, target_coord, obs_site, obs_start, obs_end)
+        if cache is None:
+            result["events"] = get_event_windows(
+                *args, constraints, kinds=kinds
+            )
+        else:
+            full, partial = get_transit_windows_cached(
+                cache, key, *args, constraints, name=target
+            )
+            result["events"] = make_events(full, partial, t0, per, dur)
+            # returned to the parent process by predict_transits
+            result["cache"] = cache
+    except Exception as e:
+        result.update(
+            status="error",
+            error_type=type(e).__name__,
+            error=str(e) if str(e) else traceback.format_exc(limit=1),
+        )
+    get_metrics().observe(
+        "mirai_target_seconds",
+        time.perf_counter() - start,
+        status=result["status"],
+    )
+    return result
+
+
+def _predict_in_worker(target, **job):
+    """`predict_transit` returning the metrics of the worker process"""
+    result = predict_transit(target, **job)
+    # sent once; the parent adds them to its registry
+    result["metrics"] = get_metrics().collect(reset=True)
+    return result
+
+
+def predict_transits(
+    targets,
+    site="OT",
+    window=None,
+    n_workers=None,
+    ephems=None,
+    prune=True,
+    cache=None,
+    journal=None,
+    retry=("transient", "resource"),
+    metrics_fp=None,
+    metrics_interval=60,
+    **kwargs,
+):
+    """predict observable transits of many targets in parallel
+
+    Catalogs and observing site are loaded once per worker process.
+    Coordinates of targets outside the TOI/CTOI tables are queried
+    concurrently beforehand (see `prefetch_coords`).
+
+    Parameters
+    ----------
+    targets : list
+        target names
+    site : str or dict
+        site name in SITES or kwargs of `get_obs_site`
+    window : tuple
+        (start, end) of observation shared by all targets
+    n_workers : int
+        number of processes (default=os.cpu_count()); 1 runs serially
+    ephems : dict
+        optional {target: (t0, per, dur)} e.g. from
+        `mirai.ephem.EphemerisTable.to_dict`
+    prune : bool
+        skip targets which can never clear the altitude limit at night
+        using a sky grid lookup before any constraint evaluation
+    cache : mirai.cache.ResultCache
+        targets with the window fully cached are not recomputed and only
+        new nights of the others are; updated in place
+    journal : mirai.journal.Journal
+        finished targets are recorded and skipped when resuming
+    retry : tuple
+        error classes of journaled targets to run again;
+        see `mirai.journal.classify_error`
+    metrics_fp : str
+        save the metrics of the run (see `mirai.metrics`) every
+        metrics_interval [s] and at the end; JSON if it ends with .json,
+        else Prometheus text
+    kwargs : dict
+        passed to `predict_transit` e.g. alt_limit, min_moon_sep
+
+    Returns
+    -------
+    results : list
+        one dict per target in the same order as targets;
+        see `predict_transit`
+    """
+    ephems = {} if ephems is None else ephems
+    ephems = {_normalize_target(k): v for k, v in ephems.items()}
+    site = _parse_site(site)
+    if cache is not None:
+        errmsg = "cache supports kinds=('transit',) only"
+        assert tuple(kwargs.get("kinds", ("transit",))) == ("transit",), errmsg
+    # resolve window once so that all targets share the same Time.now()
+    window = parse_window(window)
+    clobber = kwargs.get("clobber", False)
+
+    metrics = get_metrics()
+
+    def count(result, source):
+        metrics.inc(
+            "mirai_targets_total", status=result["status"], source=source
+        )
+        if result["status"] == "error":
+            error_class = classify_error(
+                result.get("error_type"), result.get("error")
+            )
+            metrics.inc("mirai_target_errors_total", error_class=error_class)
+
+    results = [None] * len(targets)
+    todo = []
+    for i, t in enumerate(targets):
+        name = _normalize_target(t)
+        if (journal is not None) and journal.is_done(name, retry=retry):
+            results[i] = journal.get_result(name)
+            count(results[i], "journal")
+        else:
+            todo.append(i)
+    if (journal is not None) and (len(todo) < len(targets)):
+        print(f"Resuming {journal.fp}: {len(todo)} targets left")
+
+    def finish(i, result, source="computed"):
+        worker_cache = result.pop("cache", None)
+        if (cache is not None) and (worker_cache is not None):
+            if worker_cache is not cache:
+                cache.merge(worker_cache)
+        worker_metrics = result.pop("metrics", None)
+        if worker_metrics is not None:
+            metrics.merge(worker_metrics)
+        count(result, source)
+        if metrics_fp is not None:
+            metrics.write(metrics_fp, interval=metrics_interval)
+        if journal is not None:
+            journal.add(result)
+        results[i] = result
+
+    coords = prefetch_coords([targets[i] for i in todo])
+    hopeless = set()
+    if prune:
+        hopeless = _prune([targets[i] for i in todo], site, coords, **kwargs)
+
+    jobs = []
+    for i in todo:
+        t = targets[i]
+        name = _normalize_target(t)
+        if name in hopeless:
+            obs_site = get_obs_site(**site)
+            finish(
+                i,
+                dict(
+                    target=name,
+                    site=obs_site.name,
+                    status="error",
+                    error_type="ValueError",
+                    error=f"Target is not observable from {obs_site.name}",
+                ),
+                source="pruned",
+            )
+            continue
+        job = dict(
+            site=site,
+            window=window,
+            ephem=ephems.get(name),
+            coord=coords.get(name),
+            **kwargs,
+        )
+        if cache is not None:
+            key = _get_cache_key(
+                name, job["ephem"], job["coord"], site, kwargs
+            )
+            if key is not None:
+                key, job["ephem"] = key
+                if _is_cached(cache, key, window):
+                    finish(
+                        i,
+                        _cached_result(
+                            cache, key, name, job["ephem"], site, window
+                        ),
+                        source="cached",
+                    )
+                    continue
+            # only this entry is sent to the worker
+            job["cache"] = cache.subset([] if key is None else [key])
+        jobs.append((i, t, job))
+
+    if not clobber:
+        # once, before workers attach to the shared catalogs
+        _ = publish_catalogs()
+    if n_workers == 1:
+        _init_worker(site, clobber=clobber)
+        for i, t, job in jobs:
+            finish(i, predict_transit(t, **job))
+    else:
+        _predict_pool(jobs, site, clobber, n_workers, finish)
+    if metrics_fp is not None:
+        metrics.write(metrics_fp)
+    return results
+
+
+def _predict_pool(jobs, site, clobber, n_workers, finish):
+    """run jobs in worker processes; finish is called as they complete"""
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        initializer=_init_metrics_worker,
+        initargs=(site, clobber),
+    ) as executor:
+        futures = {
+            executor.submit(_predict_in_worker, t, **job): (i, t)
+            for i, t, job in jobs
+        }
+        # journal results as soon as they finish
+        for future in as_completed(futures):
+            i, target = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # e.g. worker process died
+                result = dict(
+                    target=_normalize_target(target),
+                    status="error",
+                    error_type=type(e).__name__,
+                    error=str(e),
+                )
+            finish(i, result)
+
+
+def _is_cached(cache, key, window):
+    start, end = [t.utc.jd for t in window]
+    return (key in cache) and (
+        len(missing_spans(cache.entries[key]["spans"], start, end)) == 0
+    )
+
+
+def _cached_result(cache, key, target, ephem, site, window):
+    start, end = [t.utc.jd for t in window]
+    # counts as a hit
+    _ = cache.missing(key, start, end)
+    full, partial = cache.query(key, start, end)
+    t0, per, dur = ephem
+    return dict(
+        target=target,
+        site=get_obs_site(**site).name,
+        status="ok",
+        t0=t0,
+        per=per,
+        dur=dur,
+        events=make_events(full, partial, t0, per, dur),
+        error_type=None,
+        error=None,
+    )
+
+
+def results_to_frame(results, iso=True, scale="utc"):
+    """one row per observable event; targets without events keep one row
+
+    Partial events are listed only for targets without full events of the
+    same kind.
+
+    Parameters
+    ----------
+    results : list
+        see `predict_transits`
+    iso : bool
+        times as iso strings in scale if True, else as utc JD
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        columns: target, site, status, event ('full' or 'partial'),
+        ingress, midtransit, egress, epoch, error_type, error
+    """
+    bases, parts = [], []
+    for r in results:
+        events = r.get("events")
+        if events is None:
+            events = np.zeros(0, dtype=EVENT_DTYPE)
+        events = select_events(events)
+        base = dict(
+            target=r["target"],
+            site=r.get("site"),
+            status=r["status"],
+            error_type=r.get("error_type"),
+            error=r.get("error"),
+        )
+        # targets without events keep one row without times
+        bases += [base] * max(len(events), 1)
+        parts.append(events)
+        if len(events) == 0:
+            parts.append(np.zeros(1, dtype=EVENT_DTYPE))
+    columns = [
+        "target",
+        "site",
+        "status",
+        "event",
+        "ingress",
+        "midtransit",
+        "egress",
+        "epoch",
+        "error_type",
+        "error",
+    ]
+    if len(bases) == 0:
+        return pd.DataFrame(columns=columns)
+    events = np.concatenate(parts)
+    df = pd.DataFrame(bases)
+    # times of all events are converted at once
+    times = events_to_frame(events, iso=iso, scale=scale)
+    empty = events["flags"] == 0
+    times = times.where(~np.broadcast_to(empty[:, np.newaxis], times.shape))
+    times["epoch"] = times["epoch"].astype("Int64")
+    df = pd.concat([df, times], axis=1)
+    return df[columns]
+
+
+def refresh_catalogs(kinds=("toi", "ctoi"), outdir=DATA_PATH):
+    """download TOI/CTOI tables again and return changes of this refresh
+
+    Returns
+    -------
+    changes : pandas.DataFrame
+        see `mirai.catalog.diff_catalogs`
+    """
+    since = Time.now()
+    getters = dict(toi=get_tois, ctoi=get_ctois)
+    changes = []
+    for kind in kinds:
+        _ = getters[kind](clobber=True, outdir=outdir)
+        changes.append(get_catalog_changes(kind, since=since, outdir=outdir))
+    return pd.concat(changes, ignore_index=True)
+
+
+def patch_results(df, changes, include_added=False, **kwargs):
+    """re-predict only targets affected by catalog changes
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        stored predictions; see `results_to_frame`
+    changes : pandas.DataFrame
+        see `refresh_catalogs` or `mirai.catalog.get_catalog_changes`
+    include_added : bool
+        also predict candidates added to the catalogs
+    kwargs : dict
+        passed to `predict_transits` e.g. site, window; use the same as
+        those of the stored predictions
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        rows of removed targets dropped, rows of re-ephemerised targets
+        replaced in place and added targets appended
+    """
+    names = df["target"].map(catalog_name)
+    change = dict(zip(changes["target"], changes["change"]))
+    stored = set(names)
+    redo = [t for t in names.unique() if change.get(t) == "ephemeris"]
+    if include_added:
+        redo += [
+            t
+            for t, c in change.items()
+            if (c == "added") and (t not in stored)
+        ]
+    new = results_to_frame(predict_transits(redo, **kwargs)) if redo else None
+
+    parts = []
+    for target in names.unique():
+        if change.get(target) == "removed":
+            continue
+        elif target in redo:
+            parts.append(new[new["target"].map(catalog_name) == target])
+        else:
+            parts.append(df[names == target])
+    if new is not None:
+        parts.append(new[~new["target"].map(catalog_name).isin(stored)])
+    columns = list(df.columns)
+    if new is not None:
+        columns += [c for c in new.columns if c not in columns]
+    if len(parts) == 0:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(parts, ignore_index=True)[columns]
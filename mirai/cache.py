@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+r"""
+Content-addressed cache of transit predictions
+
+Predictions are keyed by everything they depend on except the observation
+window: ephemeris, coordinates, site and constraint parameters. Each entry
+stores the time spans already computed and the observable events found in
+them, so a shifted window only computes the nights not covered yet.
+
+Events are assigned to spans by midtransit, so a full transit is stored
+even if its egress falls beyond the span and the result for any covered
+window is the same as computing that window at once.
+
+>>> cache = ResultCache("predictions.json", max_entries=10000)
+>>> predict_transits(targets, window=window, cache=cache)
+>>> cache.save()
+>>> print(cache.report())
+"""
+import os
+import json
+import hashlib
+from os.path import exists
+from collections import OrderedDict
+
+import numpy as np
+from astropy.time import Time
+
+from mirai.mirai import get_transit_windows
+from mirai.metrics import get_metrics
+
+__all__ = ["ResultCache", "cache_key", "get_transit_windows_cached"]
+
+# bump when the prediction algorithm changes to invalidate old entries
+CACHE_VERSION = 2
+
+
+def cache_key(
+    t0,
+    per,
+    dur,
+    target_coord,
+    obs_site,
+    alt_limit,
+    min_moon_sep,
+    max_moon_illumination=None,
+    min_sky_brightness=None,
+):
+    """hash of all inputs of a prediction except the window"""
+    loc = obs_site.location
+    inputs = dict(
+        version=CACHE_VERSION,
+        ephem=[float(t0), float(per), float(dur)],
+        coord=[
+            round(float(target_coord.ra.deg), 7),
+            round(float(target_coord.dec.deg), 7),
+        ],
+        site=[
+            obs_site.name,
+            round(float(loc.lat.deg), 6),
+            round(float(loc.lon.deg), 6),
+            round(float(loc.height.value), 2),
+        ],
+        constraints=[float(alt_limit), float(min_moon_sep)],
+    )
+    # optional constraints are left out when unset so old keys stay valid
+    if max_moon_illumination is not None:
+        inputs["max_moon_illumination"] = float(max_moon_illumination)
+    if min_sky_brightness is not None:
+        inputs["min_sky_brightness"] = float(min_sky_brightness)
+    text = json.dumps(inputs, sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def _merge_spans(spans):
+    """union of [start, end) spans as a sorted list"""
+    merged = []
+    for start, end in sorted(spans):
+        if merged and (start <= merged[-1][1]):
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def missing_spans(spans, start, end):
+    """parts of [start, end) not covered by spans"""
+    missing = []
+    for s, e in _merge_spans(spans):
+        if e <= start:
+            continue
+        if s >= end:
+            break
+        if s > start:
+            missing.append([start, s])
+        start = max(start, e)
+    if start < end:
+        missing.append([start, end])
+    return missing
+
+
+class ResultCache:
+    """Least recently used cache of transit predictions
+
+    Parameters
+    ----------
+    fp : str
+        json file to load from and save to (default: memory only)
+    max_entries : int
+        number of (target, site, constraints) entries kept; the least
+        recently used are evicted first
+    """
+
+    def __init__(self, fp=None, max_entries=10000):
+        self.fp = fp
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.stats = dict(
+            hits=0,
+            partial_hits=0,
+            misses=0,
+            evictions=0,
+            days_reused=0.0,
+            days_computed=0.0,
+        )
+        if (fp is not None) and exists(fp):
+            with open(fp) as f:
+                self.entries = OrderedDict(json.load(f))
+            self._evict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def missing(self, key, start, end):
+        """spans [JD] of window start-end which have to be computed"""
+        entry = self.entries.get(key)
+        spans = [] if entry is None else entry["spans"]
+        missing = missing_spans(spans, start, end)
+        computed = sum(e - s for s, e in missing)
+        self.stats["days_computed"] += computed
+        self.stats["days_reused"] += (end - start) - computed
+        if entry is None:
+            result = "miss"
+            self.stats["misses"] += 1
+        elif len(missing) == 0:
+            result = "hit"
+            self.stats["hits"] += 1
+        else:
+            result = "partial"
+            self.stats["partial_hits"] += 1
+        get_metrics().inc("mirai_result_cache_total", result=result)
+        return missing
+
+    def update(self, key, spans, full, partial):
+        """add events [JD] computed in spans [JD]
+
+        full : (N,2) ingress and egress of transits with midtransit in spans
+        partial : (N,) midtransit of transits in spans observable at midpoint
+        """
+        entry = self.entries.pop(key, dict(spans=[], full=[], partial=[]))
+        entry["spans"] = _merge_spans(
+            entry["spans"] + [list(s) for s in spans]
+        )
+        full = sorted(set(map(tuple, entry["full"])) | set(map(tuple, full)))
+        entry["full"] = [list(f) for f in full]
+        entry["partial"] = sorted(set(entry["partial"]) | set(partial))
+        self.entries[key] = entry
+        self._evict()
+
+    def query(self, key, start, end):
+        """events of window start-end [JD] as in `get_transit_windows`
+
+        Returns
+        -------
+        full : astropy.time.Time
+            (N,2) ingress & egress times
+        partial : astropy.time.Time
+            midtransit times
+        """
+        entry = self.entries[key]
+        self.entries.move_to_end(key)
+        full = np.array(entry["full"], dtype=float).reshape(-1, 2)
+        mid = full.mean(axis=1)
+        full = full[(mid >= start) & (mid < end) & (full[:, 1] < end)]
+        partial = np.array(entry["partial"], dtype=float)
+        partial = partial[(partial >= start) & (partial < end)]
+        return (
+            Time(full, format="jd", scale="utc"),
+            Time(partial, format="jd", scale="utc"),
+        )
+
+    def subset(self, keys):
+        """new in-memory cache with only keys e.g. to send to a worker"""
+        cache = ResultCache(max_entries=self.max_entries)
+        for key in keys:
+            if key in self.entries:
+                cache.entries[key] = self.entries[key]
+        return cache
+
+    def merge(self, other):
+        """add entries and stats of another cache e.g. from a worker"""
+        for key, entry in other.entries.items():
+            self.update(key, entry["spans"], entry["full"], entry["partial"])
+        for k, v in other.stats.items():
+            self.stats[k] += v
+
+    def _evict(self):
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def save(self, fp=None):
+        fp = self.fp if fp is None else fp
+        assert fp is not None, "provide fp"
+        # write then rename so that an interrupted save keeps the old file
+        tmp = fp + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, fp)
+
+    def report(self):
+        """one-line summary of cache usage"""
+        s = self.stats
+        n = s["hits"] + s["partial_hits"] + s["misses"]
+        total = s["days_reused"] + s["days_computed"]
+        frac = s["days_reused"] / total if total > 0 else 0
+        return (
+            f"cache: {len(self)}/{self.max_entries} entries, {n} lookups "
+            f"({s['hits']} hits, {s['partial_hits']} partial, "
+            f"{s['misses']} misses), {s['evictions']} evictions, "
+            f"{frac:.0%} of {total:.1f} target-days reused"
+        )
+
+
+def get_transit_windows_cached(
+    cache,
+    key,
+    t0,
+    per,
+    dur,
+    target_coord,
+    obs_site,
+    obs_start,
+    obs_end,
+    constraints,
+    name=None,
+):
+    """`get_transit_windows` computing only spans not found in cache
+
+    key is `cache_key` of the other arguments; cache is updated in place
+    """
+    start, end = obs_start.utc.jd, obs_end.utc.jd
+    for s, e in cache.missing(key, start, end):
+        # extend by the duration so that egress of the last transit is found
+        full, partial = get_transit_windows(
+            t0,
+            per,
+            dur,
+            target_coord,
+            obs_site,
+            Time(s, format="jd", scale="utc"),
+            Time(e + dur, format="jd", scale="utc"),
+            constraints,
+            name=name,
+        )
+        full = full.utc.jd.reshape(-1, 2)
+        partial = partial.utc.jd.reshape(-1)
+        cache.update(
+            key,
+            [[s, e]],
+            full[full.mean(axis=1) < e].tolist(),
+            partial[partial < e].tolist(),
+        )
+    return cache.query(key, start, end)
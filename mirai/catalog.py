@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+r"""
+Changes between two versions of the TOI or CTOI table
+
+Each refresh of `get_tois`/`get_ctois` compares the downloaded table with
+the previous csv and appends added, removed and re-ephemerised candidates
+to a change log next to it (e.g. TOIs_changes.csv). Re-prediction of only
+the affected targets is done by `mirai.batch.patch_results`.
+"""
+from os.path import join, exists
+
+import numpy as np
+import pandas as pd
+from astropy.time import Time
+
+from mirai.config import DATA_PATH
+
+__all__ = ["diff_catalogs", "get_catalog_changes", "catalog_name"]
+
+# id column, (t0, per, dur) columns and duration unit in hours of each table
+CATALOG_COLUMNS = {
+    "toi": (
+        "TOI",
+        ["Epoch (BJD)", "Period (days)", "Duration (hours)"],
+    ),
+    "ctoi": (
+        "CTOI",
+        ["Midpoint (BJD)", "Period (days)", "Duration (hrs)"],
+    ),
+}
+CATALOG_FILES = {"toi": "TOIs", "ctoi": "CTOIs"}
+CHANGE_COLUMNS = [
+    "refreshed",
+    "target",
+    "change",
+    "t0_old",
+    "per_old",
+    "dur_old",
+    "t0",
+    "per",
+    "dur",
+]
+
+
+def catalog_name(target):
+    """name of a TOI/CTOI as in the change log e.g. toi200 -> toi200.01"""
+    target = str(target).lower().strip().replace("-", "")
+    for kind in ["ctoi", "toi"]:
+        if target.startswith(kind):
+            number = target[len(kind) :]
+            if "." not in number:
+                number += ".01"
+            try:
+                return f"{kind}{float(number):.2f}"
+            except ValueError:
+                break
+    return target
+
+
+def _ephem_table(d, kind):
+    """table of target, t0 [BJD], per [d], dur [d] indexed by target"""
+    id_column, columns = CATALOG_COLUMNS[kind]
+    d = d.drop_duplicates(subset=id_column, keep="last")
+    df = pd.DataFrame(
+        {
+            "target": [f"{kind}{x:.2f}" for x in d[id_column].astype(float)],
+            "t0": d[columns[0]].values.astype(float),
+            "per": d[columns[1]].values.astype(float),
+            "dur": d[columns[2]].values.astype(float) / 24,
+        }
+    )
+    return df.set_index("target")
+
+
+def diff_catalogs(old, new, kind="toi"):
+    """added, removed and re-ephemerised candidates between two tables
+
+    Parameters
+    ----------
+    old, new : pandas.DataFrame
+        TOI or CTOI tables as returned by `get_tois`/`get_ctois`
+    kind : str
+        'toi' or 'ctoi'
+
+    Returns
+    -------
+    diff : pandas.DataFrame
+        target, change ('added', 'removed' or 'ephemeris'), old and new
+        t0 [BJD], per [d], dur [d]
+    """
+    errmsg = f"kind={kind} not in {list(CATALOG_COLUMNS)}"
+    assert kind in CATALOG_COLUMNS, errmsg
+    old = _ephem_table(old, kind)
+    new = _ephem_table(new, kind)
+    df = old.join(new, how="outer", lsuffix="_old")
+    is_old = df.index.isin(old.index)
+    is_new = df.index.isin(new.index)
+    changed = np.zeros(len(df), dtype=bool)
+    for col in ["t0", "per", "dur"]:
+        a, b = df[col + "_old"].values, df[col].values
+        changed |= ~((a == b) | (np.isnan(a) & np.isnan(b)))
+    change = np.select(
+        [~is_old, ~is_new, changed], ["added", "removed", "ephemeris"], ""
+    )
+    df.insert(0, "change", change)
+    df = df[df.change != ""].reset_index()
+    return df[CHANGE_COLUMNS[1:]]
+
+
+def log_catalog_changes(old, new, kind, fp):
+    """append diff of old and new tables to the change log fp"""
+    diff = diff_catalogs(old, new, kind=kind)
+    diff.insert(0, "refreshed", Time.now().isot)
+    diff.to_csv(fp, mode="a", header=not exists(fp), index=False)
+    return diff
+
+
+def get_catalog_changes(kind="toi", since=None, outdir=DATA_PATH):
+    """changes logged by refreshes of the TOI or CTOI table
+
+    Parameters
+    ----------
+    kind : str
+        'toi' or 'ctoi'
+    since : str or astropy.time.Time
+        only changes of refreshes at or after since [UTC]
+
+    Returns
+    -------
+    diff : pandas.DataFrame
+        see `diff_catalogs`; latest change of each target
+    """
+    fp = join(outdir, f"{CATALOG_FILES[kind]}_changes.csv")
+    if not exists(fp):
+        return pd.DataFrame(columns=CHANGE_COLUMNS)
+    df = pd.read_csv(fp)
+    if (since is not None) and (len(df) > 0):
+        refreshed = Time(list(df["refreshed"]), format="isot")
+        df = df[refreshed >= Time(since)]
+    return df.drop_duplicates(subset="target", keep="last").reset_index(
+        drop=True
+    )
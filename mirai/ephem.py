@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+r"""
+Ephemeris tables read from csv, parquet or hdf5 files
+
+A table has one row per target with columns
+target_name, midtransit [BJD], period [d], duration [d] and optionally site
+(same as the csv used by `mirai -fp`). Only these columns are read, and
+columns of parquet and hdf5 files are read lazily when first needed.
+Target names are indexed once so that each lookup is a dict access.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+__all__ = ["EphemerisTable", "read_ephem_table", "read_tql_h5"]
+
+NAME_COLUMN = "target_name"
+EPHEM_COLUMNS = ["midtransit", "period", "duration"]
+OPTIONAL_COLUMNS = ["site"]
+# tables keyed by file path; re-read when the file changes
+_TABLE_CACHE = {}
+
+
+def _normalize_target(target):
+    return str(target).lower().strip().replace("-", "")
+
+
+def _import_h5py():
+    try:
+        import h5py
+    except Exception:
+        raise ModuleNotFoundError("pip install h5py")
+    return h5py
+
+
+class EphemerisTable:
+    """Ephemerides of many targets indexed by target name
+
+    Parameters
+    ----------
+    fp : str
+        csv, parquet (.parquet/.pq) or hdf5 (.h5/.hdf5) file
+    key : str
+        hdf5 group or pandas key containing the columns (default: root)
+    """
+
+    def __init__(self, fp, key=None):
+        self.fp = fp
+        self.key = key
+        ext = fp.split(".")[-1].lower()
+        if ext in ["csv", "txt"]:
+            self.format = "csv"
+        elif ext in ["parquet", "pq"]:
+            self.format = "parquet"
+        elif ext in ["h5", "hdf5", "hdf"]:
+            self.format = "hdf5"
+        else:
+            raise ValueError(f"{fp} is not a csv, parquet or hdf5 file")
+        self._columns = {}
+        if self.format == "csv":
+            # text has to be parsed at once; skip unused columns
+            wanted = [NAME_COLUMN] + EPHEM_COLUMNS + OPTIONAL_COLUMNS
+            df = pd.read_csv(fp, usecols=lambda c: c in wanted)
+            self._columns = {c: df[c].values for c in df.columns}
+        names = self._get_column(NAME_COLUMN)
+        self.index = {}
+        self.duplicates = set()
+        for i, name in enumerate(names):
+            name = _normalize_target(name)
+            if name in self.index:
+                self.duplicates.add(name)
+            self.index[name] = i
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, target):
+        return _normalize_target(target) in self.index
+
+    @property
+    def targets(self):
+        return list(self.index.keys())
+
+    def _get_column(self, column):
+        """read column once"""
+        if column not in self._columns:
+            self._columns[column] = self._read_column(column)
+        if self._columns[column] is None:
+            raise KeyError(f"{column} not found in {self.fp}")
+        return self._columns[column]
+
+    def _read_column(self, column):
+        if self.format == "csv":
+            return None
+        elif self.format == "parquet":
+            try:
+                return pd.read_parquet(self.fp, columns=[column])[
+                    column
+                ].values
+            except (KeyError, ValueError):
+                return None
+        h5py = _import_h5py()
+        with h5py.File(self.fp, "r") as f:
+            group = f if self.key is None else f[self.key]
+            if column in group and isinstance(group[column], h5py.Dataset):
+                values = group[column][()]
+                if values.dtype.kind == "S":
+                    values = values.astype(str)
+                return values
+            is_pandas_table = "table" in group
+        if is_pandas_table:
+            # written with DataFrame.to_hdf(format='table')
+            key = "/" if self.key is None else self.key
+            try:
+                return pd.read_hdf(self.fp, key, columns=[column])[
+                    column
+                ].values
+            except KeyError:
+                return None
+        return None
+
+    def get(self, target):
+        """ephemeris of target
+
+        Returns
+        -------
+        row : dict
+            target_name, midtransit, period, duration and site (or None)
+        """
+        name = _normalize_target(target)
+        if name not in self.index:
+            raise ValueError(f"{target} not found in {self.fp}")
+        if name in self.duplicates:
+            raise ValueError(
+                f"multiple entries of {target} found in {self.fp}"
+            )
+        i = self.index[name]
+        row = {NAME_COLUMN: name}
+        for column in EPHEM_COLUMNS:
+            row[column] = float(self._get_column(column)[i])
+        for column in OPTIONAL_COLUMNS:
+            try:
+                row[column] = self._get_column(column)[i]
+            except KeyError:
+                row[column] = None
+        return row
+
+    def get_ephem(self, target):
+        """(t0, per, dur) of target in (BJD, d, d)"""
+        row = self.get(target)
+        return row["midtransit"], row["period"], row["duration"]
+
+    def to_dict(self):
+        """{target: (t0, per, dur)} of all unique targets"""
+        t0 = self._get_column("midtransit")
+        per = self._get_column("period")
+        dur = self._get_column("duration")
+        return {
+            name: (float(t0[i]), float(per[i]), float(dur[i]))
+            for name, i in self.index.items()
+            if name not in self.duplicates
+        }
+
+
+def read_ephem_table(fp, key=None):
+    """EphemerisTable of fp, indexed once per process unless fp changed"""
+    mtime = os.path.getmtime(fp)
+    cache_key = (fp, key)
+    if (cache_key not in _TABLE_CACHE) or (
+        _TABLE_CACHE[cache_key][0] != mtime
+    ):
+        _TABLE_CACHE[cache_key] = (mtime, EphemerisTable(fp, key=key))
+    return _TABLE_CACHE[cache_key][1]
+
+
+def is_tql_h5(fp):
+    """True if fp is a single-target .h5 file from tql"""
+    if fp.split(".")[-1].lower() != "h5":
+        return False
+    h5py = _import_h5py()
+    with h5py.File(fp, "r") as f:
+        keys = set(f.keys()) | set(f.attrs.keys())
+    return {"T0", "period", "duration"}.issubset(keys)
+
+
+def read_tql_h5(fp):
+    """read only T0 [TBJD], period [d] and duration [d] from tql .h5 file
+
+    Returns
+    -------
+    T0, period, duration : tuple
+    """
+    h5py = _import_h5py()
+    values = []
+    with h5py.File(fp, "r") as f:
+        for key in ["T0", "period", "duration"]:
+            # deepdish saves scalars as attributes of the root group
+            if key in f.attrs:
+                values.append(float(np.squeeze(f.attrs[key])))
+            else:
+                values.append(float(np.squeeze(f[key][()])))
+    return tuple(values)
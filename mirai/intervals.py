@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+r"""
+Sorted-endpoint index of predicted transit windows
+
+Events are grouped by site and by duration in bins a factor of 2 wide, and
+sorted by start time within each group. An event of duration <= D overlaps
+[t1, t2) only if it starts in (t1 - D, t2), so each query is a binary search
+per group followed by a check of the few candidates, O(log n + k) for k
+events found. Times are stored as float64 utc JD and converted to iso only
+for the events returned.
+
+>>> index = TransitIndex.from_frame(pd.read_csv("merged.csv"))
+>>> index.query("2026-11-03 22:00", "2026-11-04 02:00", site="SAAO")
+"""
+import numpy as np
+import pandas as pd
+from astropy.time import Time
+
+from mirai.records import from_iso
+
+__all__ = ["TransitIndex"]
+
+# upper edge of the shortest duration bin [d]
+MIN_DURATION = 1 / 24
+
+
+def _to_jd(t):
+    """utc JD of str, float [JD] or Time"""
+    if isinstance(t, (int, float, np.floating)):
+        return float(t)
+    return Time(t).utc.jd
+
+
+class TransitIndex:
+    """Index of events answering overlap and stabbing queries
+
+    Parameters
+    ----------
+    targets, sites, events : array-like
+        target name, site and event type ('full' or 'partial') of each event
+    ingress, egress : array-like
+        utc JD of each event
+    """
+
+    def __init__(self, targets, sites, events, ingress, egress):
+        self.target_codes, self.target_names = pd.factorize(
+            np.asarray(targets)
+        )
+        self.site_codes, self.site_names = pd.factorize(np.asarray(sites))
+        self.event_codes, self.event_names = pd.factorize(np.asarray(events))
+        self.ingress = np.asarray(ingress, dtype=float)
+        self.egress = np.asarray(egress, dtype=float)
+        self._build()
+
+    def __len__(self):
+        return len(self.ingress)
+
+    def _build(self):
+        duration = self.egress - self.ingress
+        assert np.all(duration >= 0), "egress must not be before ingress"
+        bins = np.ceil(np.log2(np.maximum(duration, 1e-9) / MIN_DURATION))
+        bins = np.maximum(bins, 0).astype(int)
+        self.buckets = []
+        # sort once by (site, bin, start) and split into groups
+        order = np.lexsort((self.ingress, bins, self.site_codes))
+        key = np.stack([self.site_codes[order], bins[order]], axis=1)
+        edges = np.flatnonzero(np.any(np.diff(key, axis=0) != 0, axis=1)) + 1
+        for rows in np.split(order, edges):
+            if len(rows) == 0:
+                continue
+            self.buckets.append(
+                dict(
+                    site=self.site_codes[rows[0]],
+                    max_duration=MIN_DURATION * 2.0 ** bins[rows[0]],
+                    start=self.ingress[rows],
+                    end=self.egress[rows],
+                    rows=rows,
+                )
+            )
+
+    @classmethod
+    def from_frame(cls, df):
+        """index of events in predictions; see `results_to_frame`"""
+        df = df[df["event"].notna()]
+        return cls(
+            df["target"].values,
+            df["site"].values,
+            df["event"].values,
+            from_iso(df["ingress"]),
+            from_iso(df["egress"]),
+        )
+
+    def _site_code(self, site):
+        if site is None:
+            return None
+        codes = np.flatnonzero(self.site_names == site)
+        return codes[0] if len(codes) > 0 else -1
+
+    def overlap(self, start, end, site=None, within=False):
+        """rows of events overlapping start-end
+
+        Parameters
+        ----------
+        start, end : str, float [JD] or Time
+            utc query interval
+        site : str
+            only events at site
+        within : bool
+            only events entirely between start and end
+
+        Returns
+        -------
+        rows : numpy.ndarray
+            sorted event indices
+        """
+        t1, t2 = _to_jd(start), _to_jd(end)
+        code = self._site_code(site)
+        found = []
+        for b in self.buckets:
+            if (code is not None) and (b["site"] != code):
+                continue
+            lo = t1 if within else t1 - b["max_duration"]
+            i = np.searchsorted(
+                b["start"], lo, side="left" if within else "right"
+            )
+            j = np.searchsorted(b["start"], t2, side="left")
+            if within:
+                keep = b["end"][i:j] <= t2
+            else:
+                keep = b["end"][i:j] > t1
+            found.append(b["rows"][i:j][keep])
+        return np.sort(np.concatenate(found)) if found else np.array([], int)
+
+    def stab(self, time, site=None):
+        """rows of events in progress at time"""
+        t = _to_jd(time)
+        # ingress <= t < egress
+        rows = self.overlap(t - 1e-9, t + 1e-9, site=site)
+        return rows[(self.ingress[rows] <= t) & (self.egress[rows] > t)]
+
+    def to_frame(self, rows=None):
+        """events as a DataFrame with utc iso times"""
+        rows = np.arange(len(self)) if rows is None else rows
+        ing = Time(self.ingress[rows], format="jd")
+        egr = Time(self.egress[rows], format="jd")
+        mid = Time((self.ingress[rows] + self.egress[rows]) / 2, format="jd")
+        return pd.DataFrame(
+            dict(
+                target=self.target_names[self.target_codes[rows]],
+                site=self.site_names[self.site_codes[rows]],
+                event=self.event_names[self.event_codes[rows]],
+                ingress=ing.iso,
+                midtransit=mid.iso,
+                egress=egr.iso,
+            )
+        )
+
+    def query(self, start, end=None, site=None, within=False):
+        """events overlapping start-end, or in progress at start if no end"""
+        if end is None:
+            rows = self.stab(start, site=site)
+        else:
+            rows = self.overlap(start, end, site=site, within=within)
+        return self.to_frame(rows)
+
+    def save(self, fp):
+        np.savez_compressed(
+            fp,
+            targets=np.asarray(self.target_names, dtype=str),
+            target_codes=self.target_codes,
+            sites=np.asarray(self.site_names, dtype=str),
+            site_codes=self.site_codes,
+            events=np.asarray(self.event_names, dtype=str),
+            event_codes=self.event_codes,
+            ingress=self.ingress,
+            egress=self.egress,
+        )
+
+    @classmethod
+    def load(cls, fp):
+        d = np.load(fp)
+        index = cls.__new__(cls)
+        for key in ["target", "site", "event"]:
+            setattr(index, f"{key}_names", d[f"{key}s"])
+            setattr(index, f"{key}_codes", d[f"{key}_codes"])
+        index.ingress = d["ingress"]
+        index.egress = d["egress"]
+        index._build()
+        return index
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+r"""
+Journal of batch runs for resuming interrupted runs
+
+Each finished target is appended to a JSON lines file as soon as it is
+done, so a run killed halfway (e.g. network failure or out of memory)
+restarts with only the remaining targets. Failed targets are classified as
+
+* transient: network or service errors which may succeed later
+* resource: worker killed or out of memory/disk
+* permanent: anything else e.g. target not found or not observable
+
+and only the classes given by `retry` are run again on resume. The first
+line stores the run settings; resuming with different settings raises an
+error instead of mixing incompatible predictions.
+"""
+import os
+import json
+from os.path import exists
+
+import numpy as np
+
+from mirai.records import EVENT_DTYPE
+
+__all__ = ["Journal", "classify_error", "read_journal_config"]
+
+ERROR_CLASSES = ["transient", "resource", "permanent"]
+TRANSIENT_ERRORS = {
+    "URLError",
+    "HTTPError",
+    "TimeoutError",
+    "timeout",
+    "ConnectionError",
+    "ConnectionResetError",
+    "ConnectionRefusedError",
+    "ConnectionAbortedError",
+    "RemoteDisconnected",
+    "IncompleteRead",
+    "ReadTimeout",
+    "ConnectTimeout",
+    "SSLError",
+    "gaierror",
+    "RemoteServiceError",
+}
+RESOURCE_ERRORS = {"MemoryError", "BrokenProcessPool", "BrokenExecutor"}
+RESOURCE_MESSAGES = [
+    "cannot allocate memory",
+    "no space left",
+    "terminated abruptly",
+    "too many open files",
+]
+TRANSIENT_MESSAGES = [
+    "timed out",
+    "temporarily unavailable",
+    "connection reset",
+    "name or service not known",
+    "service unavailable",
+    # astropy NameResolveError when no Sesame mirror answers
+    "queries failed",
+]
+
+
+def classify_error(error_type, error=""):
+    """'transient', 'resource' or 'permanent' from exception name & message"""
+    message = str(error).lower()
+    if (error_type in RESOURCE_ERRORS) or any(
+        m in message for m in RESOURCE_MESSAGES
+    ):
+        return "resource"
+    if (error_type in TRANSIENT_ERRORS) or any(
+        m in message for m in TRANSIENT_MESSAGES
+    ):
+        return "transient"
+    return "permanent"
+
+
+def read_journal_config(fp):
+    """run settings stored in journal fp or None if there is no journal"""
+    if not exists(fp):
+        return None
+    with open(fp) as f:
+        line = f.readline()
+    return json.loads(line).get("config") if line else None
+
+
+def _to_rows(events):
+    return None if events is None else events.tolist()
+
+
+def _from_rows(rows):
+    if rows is None:
+        return None
+    return np.array([tuple(r) for r in rows], dtype=EVENT_DTYPE)
+
+
+class Journal:
+    """Append-only record of finished targets of a batch run
+
+    Parameters
+    ----------
+    fp : str
+        JSON lines file; created if missing, resumed otherwise
+    config : dict
+        json-serializable run settings e.g. site, window, constraints
+    """
+
+    def __init__(self, fp, config=None):
+        self.fp = fp
+        self.config = {} if config is None else config
+        self.records = {}
+        if exists(fp):
+            self._read()
+        else:
+            self._write(dict(config=self.config))
+
+    def _read(self):
+        with open(self.fp) as f:
+            lines = f.readlines()
+        if (len(lines) > 0) and not lines[-1].endswith("\n"):
+            # last line of a killed run is incomplete; drop it
+            lines = lines[:-1]
+            with open(self.fp, "w") as f:
+                f.writelines(lines)
+        if len(lines) > 0:
+            header = json.loads(lines[0])
+            if header.get("config") != json.loads(json.dumps(self.config)):
+                raise ValueError(
+                    f"{self.fp} was written with different settings: "
+                    f"{header.get('config')}"
+                )
+        for line in lines[1:]:
+            record = json.loads(line)
+            self.records[record["target"]] = record
+
+    def _write(self, record):
+        with open(self.fp, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def add(self, result):
+        """append a result of `mirai.batch.predict_transit`"""
+        record = dict(
+            target=result["target"],
+            site=result.get("site"),
+            status=result["status"],
+            t0=result.get("t0"),
+            per=result.get("per"),
+            dur=result.get("dur"),
+            events=_to_rows(result.get("events")),
+            error_type=result.get("error_type"),
+            error=result.get("error"),
+            error_class=None,
+            attempt=1,
+        )
+        for key in ["t0", "per", "dur"]:
+            if record[key] is not None:
+                record[key] = float(record[key])
+        if record["status"] == "error":
+            record["error_class"] = classify_error(
+                record["error_type"], record["error"]
+            )
+        previous = self.records.get(record["target"])
+        if previous is not None:
+            record["attempt"] = previous["attempt"] + 1
+        self._write(record)
+        self.records[record["target"]] = record
+
+    def is_done(self, target, retry=("transient", "resource")):
+        """True if target finished or failed with an error not in retry"""
+        record = self.records.get(target)
+        if record is None:
+            return False
+        return (record["status"] == "ok") or (
+            record["error_class"] not in retry
+        )
+
+    def get_result(self, target):
+        """result of target as returned by `mirai.batch.predict_transit`"""
+        record = dict(self.records[target])
+        record["events"] = _from_rows(record["events"])
+        for key in ["error_class", "attempt"]:
+            record.pop(key)
+        return record
+
+    def summary(self):
+        """number of targets per status or error class"""
+        counts = dict(ok=0, **{c: 0 for c in ERROR_CLASSES})
+        for record in self.records.values():
+            if record["status"] == "ok":
+                counts["ok"] += 1
+            else:
+                counts[record["error_class"]] += 1
+        return counts
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+r"""
+Runtime metrics of planning runs
+
+Counters, gauges and histograms are collected in a registry per process:
+targets and their status, catalog and remote lookup cache hits, remote call
+latency, retries and failures, per-target and per-constraint evaluation
+times. Worker processes of `predict_transits` send their metrics back with
+each result, so the registry of the parent covers the whole run.
+
+Metrics are exported as a Prometheus text file (e.g. for the node exporter
+textfile collector) or as JSON, at the end of a run or periodically:
+
+>>> metrics = get_metrics()
+>>> results = predict_transits(targets, metrics_fp="run.prom")
+>>> print(metrics.report())
+"""
+import os
+import json
+import time
+import threading
+from copy import deepcopy
+from bisect import bisect_left
+from contextlib import contextmanager
+
+__all__ = ["METRICS", "MetricsRegistry", "get_metrics"]
+
+# type and help of metrics collected by mirai; others can be added
+METRICS = {
+    "mirai_targets_total": (
+        "counter",
+        "targets finished by status (ok, error) and source (computed, "
+        "cached, pruned, journal)",
+    ),
+    "mirai_target_errors_total": (
+        "counter",
+        "failed targets by error class (transient, resource, permanent)",
+    ),
+    "mirai_target_seconds": ("histogram", "prediction time per target"),
+    "mirai_targets_per_second": ("gauge", "targets finished per second"),
+    "mirai_run_seconds": ("gauge", "time since the start of the run"),
+    "mirai_catalog_cache_total": (
+        "counter",
+        "catalog loads by source (csv, shared) and result (hit, miss)",
+    ),
+    "mirai_remote_cache_total": (
+        "counter",
+        "remote lookups by kind and result (hit, miss, coalesced)",
+    ),
+    "mirai_remote_call_seconds": (
+        "histogram",
+        "latency of remote calls by kind and status",
+    ),
+    "mirai_remote_retries_total": ("counter", "retried remote calls"),
+    "mirai_remote_failures_total": ("counter", "failed remote lookups"),
+    "mirai_result_cache_total": (
+        "counter",
+        "result cache lookups by result (hit, partial, miss)",
+    ),
+    "mirai_constraint_seconds": (
+        "histogram",
+        "evaluation time per constraint call",
+    ),
+    "mirai_constraint_times_total": (
+        "counter",
+        "times evaluated per constraint",
+    ),
+}
+# upper bounds of histogram buckets [s]
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+
+
+def _key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels, **extra):
+    labels = list(labels) + list(extra.items())
+    if len(labels) == 0:
+        return ""
+    body = ",".join(f'{k}="{v}"' for k, v in labels)
+    return "{" + body + "}"
+
+
+class MetricsRegistry:
+    """Counters, gauges and histograms with labels
+
+    Parameters
+    ----------
+    buckets : tuple
+        upper bounds of histogram buckets [s]
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.start = time.time()
+        self._lock = threading.Lock()
+        self._values = {}
+        self._last_write = {}
+
+    def _metric(self, name, kind):
+        if name not in self._values:
+            self._values[name] = (METRICS.get(name, (kind,))[0], {})
+        errmsg = f"{name} is a {self._values[name][0]}"
+        assert self._values[name][0] == kind, errmsg
+        return self._values[name][1]
+
+    def inc(self, name, value=1, **labels):
+        """add value to a counter"""
+        with self._lock:
+            series = self._metric(name, "counter")
+            k = _key(labels)
+            series[k] = series.get(k, 0) + value
+
+    def set(self, name, value, **labels):
+        """set a gauge"""
+        with self._lock:
+            self._metric(name, "gauge")[_key(labels)] = value
+
+    def observe(self, name, value, **labels):
+        """add value e.g. a duration [s] to a histogram"""
+        with self._lock:
+            series = self._metric(name, "histogram")
+            k = _key(labels)
+            if k not in series:
+                series[k] = dict(
+                    buckets=[0] * (len(self.buckets) + 1), sum=0.0, count=0
+                )
+            h = series[k]
+            # the last bucket is +Inf
+            h["buckets"][bisect_left(self.buckets, value)] += 1
+            h["sum"] += value
+            h["count"] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """observe the duration of the block in a histogram"""
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t, **labels)
+
+    def get(self, name, **labels):
+        """value of a counter or gauge; count of a histogram (default=0)"""
+        kind, series = self._values.get(name, (None, {}))
+        value = series.get(_key(labels), 0)
+        return value["count"] if kind == "histogram" else value
+
+    def total(self, name, **labels):
+        """sum of a counter (count of a histogram) over series with labels"""
+        kind, series = self._values.get(name, (None, {}))
+        subset = set(_key(labels))
+        values = [v for k, v in series.items() if subset <= set(k)]
+        if kind == "histogram":
+            return sum(h["count"] for h in values)
+        return sum(values)
+
+    def collect(self, reset=False):
+        """picklable copy of all metrics e.g. to send to another process"""
+        with self._lock:
+            values = deepcopy(self._values)
+            if reset:
+                self._values = {}
+        return values
+
+    def merge(self, values):
+        """add metrics of `collect` e.g. from a worker; gauges are replaced"""
+        for name, (kind, series) in values.items():
+            with self._lock:
+                mine = self._metric(name, kind)
+                for k, v in series.items():
+                    if kind == "counter":
+                        mine[k] = mine.get(k, 0) + v
+                    elif kind == "gauge":
+                        mine[k] = v
+                    elif k not in mine:
+                        mine[k] = deepcopy(v)
+                    else:
+                        h = mine[k]
+                        h["buckets"] = [
+                            a + b for a, b in zip(h["buckets"], v["buckets"])
+                        ]
+                        h["sum"] += v["sum"]
+                        h["count"] += v["count"]
+
+    def reset(self):
+        """remove all metrics and restart the run clock"""
+        with self._lock:
+            self._values = {}
+            self.start = time.time()
+
+    def update_rates(self):
+        """set run time and targets per second gauges"""
+        elapsed = time.time() - self.start
+        self.set("mirai_run_seconds", elapsed)
+        n = self.total("mirai_targets_total")
+        rate = n / elapsed if elapsed > 0 else 0
+        self.set("mirai_targets_per_second", rate)
+
+    def _bounds(self):
+        return [str(b) for b in self.buckets] + ["+Inf"]
+
+    def to_prometheus(self):
+        """metrics in the Prometheus text exposition format"""
+        lines = []
+        for name, (kind, series) in sorted(self.collect().items()):
+            doc = METRICS.get(name, (kind, name))[1]
+            lines += [f"# HELP {name} {doc}", f"# TYPE {name} {kind}"]
+            for k, v in sorted(series.items()):
+                if kind != "histogram":
+                    lines.append(f"{name}{_format_labels(k)} {v}")
+                    continue
+                # buckets are cumulative
+                n = 0
+                for le, count in zip(self._bounds(), v["buckets"]):
+                    n += count
+                    labels = _format_labels(k, le=le)
+                    lines.append(f"{name}_bucket{labels} {n}")
+                lines.append(f"{name}_sum{_format_labels(k)} {v['sum']}")
+                lines.append(f"{name}_count{_format_labels(k)} {v['count']}")
+        return "\n".join(lines) + "\n"
+
+    def to_json(self):
+        """metrics as a JSON string; one entry per metric and labels"""
+        metrics = []
+        for name, (kind, series) in sorted(self.collect().items()):
+            for k, v in sorted(series.items()):
+                d = dict(name=name, type=kind, labels=dict(k))
+                if kind == "histogram":
+                    d.update(
+                        buckets=dict(zip(self._bounds(), v["buckets"])),
+                        sum=v["sum"],
+                        count=v["count"],
+                    )
+                else:
+                    d["value"] = v
+                metrics.append(d)
+        return json.dumps(
+            dict(timestamp=time.time(), start=self.start, metrics=metrics),
+            indent=1,
+        )
+
+    def write(self, fp, interval=None):
+        """save metrics; JSON if fp ends with .json else Prometheus text
+
+        Parameters
+        ----------
+        interval : float
+            skip if fp was written less than interval [s] ago e.g. to call
+            after every target of a long run
+
+        Returns
+        -------
+        written : bool
+        """
+        now = time.monotonic()
+        if (interval is not None) and (
+            now - self._last_write.get(fp, -float("inf")) < interval
+        ):
+            return False
+        self._last_write[fp] = now
+        self.update_rates()
+        text = self.to_json() if fp.endswith(".json") else self.to_prometheus()
+        os.makedirs(os.path.dirname(fp) or ".", exist_ok=True)
+        # scrapers never see a partially written file
+        tmp = f"{fp}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, fp)
+        return True
+
+    def report(self):
+        """one-line summary of the run"""
+        self.update_rates()
+        n = self.total("mirai_targets_total")
+        remote = self._values.get("mirai_remote_call_seconds", (None, {}))[1]
+        n_calls = sum(h["count"] for h in remote.values())
+        latency = sum(h["sum"] for h in remote.values()) / max(n_calls, 1)
+        hits = self.total("mirai_remote_cache_total", result="hit")
+        return (
+            f"metrics: {n} targets in {self.get('mirai_run_seconds'):.1f} s "
+            f"({self.get('mirai_targets_per_second'):.2f}/s), "
+            f"{self.total('mirai_remote_failures_total')} failed of "
+            f"{n_calls} remote calls (mean {latency:.2f} s), "
+            f"{hits} remote cache hits"
+        )
+
+
+_METRICS = MetricsRegistry()
+
+
+def get_metrics():
+    """metrics registry of this process"""
+    return _METRICS
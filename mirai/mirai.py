@@ -7,19 +7,53 @@ import numpy as np
 from scipy.stats import norm
 import matplotlib.pyplot as pl
 import pandas as pd
-from astroquery.mast import Catalogs
 from astropy.coordinates import SkyCoord, Distance
 import astropy.units as u
-from astroplan.plots import plot_altitude
+from astropy.time import Time
+from astroplan import (
+    Observer,
+    AtNightConstraint,
+    AltitudeConstraint,
+    MoonSeparationConstraint,
+)
 
 from mirai.config import DATA_PATH
+from mirai.query import resolve
+from mirai.ephem import read_ephem_table, read_tql_h5, is_tql_h5
+from mirai.tracks import get_tracks, plot_tracks
+from mirai.prune import prune_targets
+from mirai.nights import in_windows
+from mirai.records import (
+    EVENT_DTYPE,
+    EVENT_KINDS,
+    FULL,
+    PARTIAL,
+    make_events,
+    events_to_frame,
+)
+from mirai.barycentric import bjd_to_utc
+from mirai.pipeline import evaluate_constraints, observable_months
+from mirai.moon import MoonPhaseConstraint, SkyBrightnessConstraint
+from mirai.catalog import log_catalog_changes
+from mirai.shared import get_catalog_record
+from mirai.metrics import get_metrics
 
 TESS_TIME_OFFSET = 2457000.0  # TBJD = BJD - 2457000.0
 K2_TIME_OFFSET = 2454833  # BKJD
+DEFAULT_BASELINE = 7  # days; when -dt1 is given but -dt2 is not
+NEXT_TRANSIT_BASELINE = 1000  # days; when -n is used
 
 
 __all__ = [
     "SITES",
+    "DEFAULT_BASELINE",
+    "NEXT_TRANSIT_BASELINE",
+    "get_obs_site",
+    "get_constraints",
+    "check_observable",
+    "get_transit_windows",
+    "get_event_windows",
+    "get_event_times",
     "parse_target_coord",
     "get_tois",
     "get_ctois",
@@ -28,6 +62,11 @@ __all__ = [
     "plot_partial_transit",
     "get_ephem_from_file",
     "get_ephem_from_nexsci",
+    "get_nexsci",
+    "get_nexsci_index",
+    "normalize_planet_name",
+    "get_remote_request",
+    "coord_from_record",
     "get_t0_per_dur",
     "format_datetime",
     "parse_ing_egr",
@@ -73,6 +112,313 @@ SITES = {
         "Africa/Johannesburg",
     ),  # South Africa astro obs
 }
+# Observer instances are reused within a process, e.g. per pool worker
+_SITE_CACHE = {}
+# raw catalog tables keyed by file path; reloaded when the file changes
+_CATALOG_CACHE = {}
+# transiting planets in the NASA Exoplanet Archive planetary systems table
+NEXSCI_COLUMNS = [
+    "pl_name",
+    "hostname",
+    "tic_id",
+    "ra",
+    "dec",
+    "sy_dist",
+    "pl_tranmid",
+    "pl_orbper",
+    "pl_trandur",
+    "pl_trandep",
+    "pl_rade",
+    "pl_orbsmax",
+    "st_teff",
+    "st_rad",
+    "sy_vmag",
+    "sy_tmag",
+]
+NEXSCI_URL = (
+    "https://exoplanetarchive.ipac.caltech.edu/TAP/sync?query=select+"
+    + ",".join(NEXSCI_COLUMNS)
+    + "+from+pscomppars+where+tran_flag=1&format=csv"
+)
+# name -> ephemeris lookup tables keyed by file path
+_NEXSCI_INDEX = {}
+
+
+def get_obs_site(site_name="OT", lat=None, lon=None, elev=None, timezone=None):
+    """Get astroplan Observer of a site in SITES or of a custom site
+
+    Parameters
+    ----------
+    site_name : str
+        site name in SITES; ignored if lat, lon, elev and timezone are given
+    lat, lon : float
+        custom site latitude & longitude [deg]
+    elev : float
+        custom site elevation [m]
+    timezone : str
+        custom site time zone
+
+    Returns
+    -------
+    obs_site : astroplan.Observer
+        cached per process
+    """
+    if (
+        (lat is not None)
+        & (lon is not None)
+        & (elev is not None)
+        & (timezone is not None)
+    ):
+        site_name = "custom"
+    else:
+        site_name = "OT" if site_name is None else site_name.upper()
+        all_sites = list(SITES.keys())
+        # TODO: add LCO in sites using EarthLocation
+        assert site_name in all_sites, f"-site={all_sites}"
+        lat, lon, elev, timezone = SITES[site_name]
+    key = (site_name, lat, lon, elev, timezone)
+    if key not in _SITE_CACHE:
+        _SITE_CACHE[key] = Observer(
+            latitude=lat * u.deg,
+            longitude=lon * u.deg,
+            elevation=elev * u.m,
+            name=site_name,
+            timezone=timezone,
+        )
+    return _SITE_CACHE[key]
+
+
+def get_constraints(
+    alt_limit=30,
+    min_moon_sep=10,
+    max_moon_illumination=None,
+    min_sky_brightness=None,
+):
+    """observation constraints used by default in mirai
+
+    see https://astroplan.readthedocs.io/en/latest/tutorials/constraints.html
+
+    Parameters
+    ----------
+    max_moon_illumination : float
+        maximum Moon illumination (0-1) of the night unless the Moon is down;
+        see `mirai.moon.MoonPhaseConstraint`
+    min_sky_brightness : float
+        minimum sky brightness at the target [V mag/arcsec^2];
+        see `mirai.moon.SkyBrightnessConstraint`
+    """
+    constraints = [
+        AtNightConstraint.twilight_civil(),  # between sunset and sunrise
+        AltitudeConstraint(min=alt_limit * u.deg),
+        MoonSeparationConstraint(min=min_moon_sep * u.deg),
+    ]
+    if max_moon_illumination is not None:
+        constraints.append(MoonPhaseConstraint(max=max_moon_illumination))
+    if min_sky_brightness is not None:
+        constraints.append(SkyBrightnessConstraint(min=min_sky_brightness))
+    return constraints
+
+
+def check_observable(
+    target_coord, obs_site, constraints, time_grid_resolution=5 * u.hour
+):
+    """raise ValueError if target is not observable in any month
+
+    Targets which can never clear the altitude limit at night are rejected
+    with a grid lookup (see `mirai.prune`) before running astroplan.
+    """
+    if not prune_targets([target_coord], obs_site, constraints)[0]:
+        errmsg = f"Target is not observable from {obs_site.name}"
+        raise ValueError(errmsg)
+    months = observable_months(
+        constraints,
+        obs_site,
+        target_coord,
+        time_grid_resolution=time_grid_resolution.to(u.hour).value,
+    )
+    if len(months) == 0:
+        errmsg = f"Target is not observable from {obs_site.name}"
+        raise ValueError(errmsg)
+    return months
+
+
+def get_transit_windows(
+    t0,
+    per,
+    dur,
+    target_coord,
+    obs_site,
+    obs_start,
+    obs_end,
+    constraints,
+    name=None,
+    windows=None,
+):
+    """find observable full and partial transits between obs_start & obs_end
+
+    Parameters
+    ----------
+    t0 : float
+        transit midpoint [BJD_TDB]; converted to utc at the Earth with
+        `mirai.barycentric.bjd_to_utc`
+    per : float
+        orbital period [d]
+    dur : float
+        transit duration [d]
+    obs_start, obs_end : astropy.time.Time
+        observation window
+    windows : numpy.ndarray
+        (n_nights, 2) utc JD of nightly local-time windows events must fall
+        in; see `get_local_time_windows`
+
+    Returns
+    -------
+    full : astropy.time.Time
+        (N,2) ingress & egress times of transits observable at both ends
+    partial : astropy.time.Time
+        midtransit times of transits observable at midpoint
+    """
+    events = get_event_windows(
+        t0,
+        per,
+        dur,
+        target_coord,
+        obs_site,
+        obs_start,
+        obs_end,
+        constraints,
+        windows=windows,
+    )
+    full = events[(events["flags"] & FULL) > 0]
+    partial = events[(events["flags"] & PARTIAL) > 0]
+    full = Time(
+        np.c_[full["ingress"], full["egress"]], format="jd", scale="utc"
+    )
+    partial = Time(partial["midtransit"], format="jd", scale="utc")
+    return full, partial
+
+
+def get_event_windows(
+    t0,
+    per,
+    dur,
+    target_coord,
+    obs_site,
+    obs_start,
+    obs_end,
+    constraints,
+    kinds=("transit",),
+    windows=None,
+):
+    """observable transits, secondary eclipses and quadratures in one pass
+
+    Events of all kinds are generated from the same epochs and the
+    constraints are evaluated once at ingress, midpoint and egress of all of
+    them. Orbits are assumed circular, so secondary eclipses last as long as
+    transits, and quadratures are windows of the transit duration centered
+    on phases 0.25 and 0.75 e.g. for phase curves.
+
+    Parameters
+    ----------
+    t0, per, dur : float
+        ephemeris in (BJD_TDB, d, d)
+    kinds : tuple
+        event kinds in `mirai.records.EVENT_KINDS`
+    windows : numpy.ndarray
+        nightly local-time windows; see `get_transit_windows`
+
+    Returns
+    -------
+    events : numpy.ndarray
+        EVENT_DTYPE records sorted by midpoint, with flags FULL if
+        observable at ingress & egress and PARTIAL if observable at midpoint
+        (events which are neither are dropped) plus the kind flag
+    """
+    parts = []
+    for kind in kinds:
+        errmsg = f"kind={kind} not in {list(EVENT_KINDS)}"
+        assert kind in EVENT_KINDS, errmsg
+        flag, phases = EVENT_KINDS[kind]
+        for phase in phases:
+            # epochs at the Earth, corrected for light travel time
+            epochs, mid = get_event_times(
+                t0, per, obs_start, obs_end, target_coord, phase=phase
+            )
+            e = np.zeros(len(mid), dtype=EVENT_DTYPE)
+            e["ingress"], e["midtransit"], e["egress"] = (
+                mid - dur / 2,
+                mid,
+                mid + dur / 2,
+            )
+            e["epoch"], e["flags"], e["score"] = epochs, flag, np.nan
+            parts.append(e)
+    events = np.sort(np.concatenate(parts), order="midtransit")
+    ing, mid, egr = events["ingress"], events["midtransit"], events["egress"]
+    ok_mid = np.ones(len(events), dtype=bool)
+    ok_full = egr < obs_end.utc.jd
+    if windows is not None:
+        # local-time windows are cheap so they are applied first
+        ok_mid &= in_windows(mid, windows)
+        ok_full &= in_windows(ing, windows, egr)
+    # constraints at all ingress, midpoint and egress times in one call
+    times = np.r_[ing[ok_full], mid[ok_mid], egr[ok_full]]
+    ok = _is_observable(
+        constraints,
+        obs_site,
+        target_coord,
+        Time(times, format="jd", scale="utc"),
+    )
+    n = ok_full.sum()
+    ok_full[ok_full] = ok[:n] & ok[len(ok) - n :]
+    ok_mid[ok_mid] = ok[n : len(ok) - n]
+    observable = np.where(ok_full, FULL, 0) | np.where(ok_mid, PARTIAL, 0)
+    events["flags"] |= observable.astype(np.uint8)
+    events = events[ok_full | ok_mid]
+    times = np.r_[ing[ok_full], egr[ok_full], mid[ok_mid]]
+    if len(times) > 0:
+        # make sure observable events happen at night
+        assert np.all(obs_site.is_night(Time(times, format="jd")))
+    return events
+
+
+def _is_observable(constraints, obs_site, target_coord, times):
+    """whether a target is observable at times; see `evaluate_constraints`"""
+    if len(times) == 0:
+        return np.zeros(0, dtype=bool)
+    return evaluate_constraints(constraints, obs_site, target_coord, times)
+
+
+def get_event_times(t0, per, obs_start, obs_end, target_coord, phase=0):
+    """epochs and utc times at the Earth of events between obs_start & obs_end
+
+    Parameters
+    ----------
+    t0 : float
+        transit midpoint [BJD_TDB]
+    per : float
+        orbital period [d]
+    obs_start, obs_end : astropy.time.Time
+        observation window
+    target_coord : SkyCoord
+        target direction for the light travel time correction
+    phase : float
+        orbital phase of the event e.g. 0 for transits
+
+    Returns
+    -------
+    epochs : numpy.ndarray
+        integer epochs since t0
+    jd : numpy.ndarray
+        utc JD of events after obs_start and before obs_end
+    """
+    start, end = obs_start.tdb.jd, obs_end.tdb.jd
+    # light travel time is < 8.4 min so 1 more epoch at each end suffices
+    n1 = np.floor((start - t0) / per - phase) - 1
+    n2 = np.ceil((end - t0) / per - phase) + 1
+    epochs = np.arange(n1, n2 + 1).astype(int)
+    jd = bjd_to_utc(t0 + (epochs + phase) * per, target_coord)
+    idx = (jd > obs_start.utc.jd) & (jd < obs_end.utc.jd)
+    return epochs[idx], jd[idx]
 
 
 def parse_ing_egr(ing_egr):
@@ -87,40 +433,31 @@ def parse_ing_egr(ing_egr):
 
 def parse_ing_egr_list(ing_egr_list, details=None):
     """
-    TODO: make sure tdb iso is precise
+    ingress, midtransit & egress (utc iso) of (N,2) ingress & egress Time
+    with a header row
 
     output will be saved in csv
     """
     errmsg = "must be a pair of astropy Time"
     assert len(ing_egr_list[0]) == 2, errmsg
-    t12 = ["ingress"]
-    tmid = ["midtransit"]
-    t34 = ["egress"]
-    for ing, egr in ing_egr_list:
-        t14 = (egr - ing).value
-        mid = ing + dt.timedelta(days=t14 / 2)
-        t12.append(ing.tdb.iso)
-        tmid.append(mid.tdb.iso)
-        t34.append(egr.tdb.iso)
-    return np.c_[(t12, tmid, t34)]
+    events = make_events(ing_egr_list, None, 0, 1, 0)
+    return _events_table(events)
 
 
 def parse_mid_list(mid_list, transit_duration):
     """
-    TODO: make sure tdb iso is precise
+    ingress, midtransit & egress (utc iso) of midtransit Time with a
+    header row
 
     output will be saved in csv
     """
-    t12 = ["ingress"]
-    tmid = ["midtransit"]
-    t34 = ["egress"]
-    for mid in mid_list:
-        ing = mid - dt.timedelta(days=transit_duration / 2)
-        egr = mid + dt.timedelta(days=transit_duration / 2)
-        t12.append(ing.tdb.iso)
-        tmid.append(mid.tdb.iso)
-        t34.append(egr.tdb.iso)
-    return np.c_[(t12, tmid, t34)]
+    events = make_events(None, mid_list, 0, 1, transit_duration)
+    return _events_table(events)
+
+
+def _events_table(events):
+    df = events_to_frame(events)[["ingress", "midtransit", "egress"]]
+    return np.r_[[df.columns.values], df.values.astype(str)]
 
 
 def format_datetime(datetime, datefmt="%Y%b%d"):
@@ -130,29 +467,41 @@ def format_datetime(datetime, datefmt="%Y%b%d"):
 def get_t0_per_dur(target, fp=None, **kwargs):
     """
     If TIC is given, the TOI table is searched first
-    then CTOI table.
+    then CTOI table. Other names are searched in the
+    local NExSci snapshot (see `get_nexsci`).
     """
     if fp is not None:
-        errmsg = "only h5 from tql is supported"
-        assert fp.split(".")[-1] == "h5", errmsg
-        t0, per, dur = get_ephem_from_file(fp, verbose=True)
+        t0, per, dur = get_ephem_from_file(fp, target=target, verbose=True)
     elif target[:3] == "toi":
         if len(str(target).split(".")) == 2:
-            toi = get_toi(target[3:], **kwargs)
+            toiid = float(target[3:])
+        else:
+            toiid = float(target[3:] + ".01")
+        if _use_shared_catalog("toi", kwargs):
+            toi = get_catalog_record(
+                "toi", toiid, kwargs.get("remove_FP")
+            )
+            t0, per, dur = toi["t0"], toi["per"], toi["dur"]
         else:
-            toi = get_toi(target[3:] + ".01", **kwargs)
-        t0 = toi["Epoch (BJD)"].values[0]
-        per = toi["Period (days)"].values[0]
-        dur = toi["Duration (hours)"].values[0] / 24
+            toi = get_toi(toiid, **kwargs)
+            t0 = toi["Epoch (BJD)"].values[0]
+            per = toi["Period (days)"].values[0]
+            dur = toi["Duration (hours)"].values[0] / 24
     elif target[:4] == "ctoi":
-        ctoiid = float(target[4:])
         if len(str(target).split(".")) == 2:
-            ctoi = get_ctoi(target[4:], **kwargs)
+            ctoiid = target[4:]
         else:
-            ctoi = get_ctoi(target[4:] + ".01", **kwargs)
-        t0 = ctoi["Midpoint (BJD)"].values[0]
-        per = ctoi["Period (days)"].values[0]
-        dur = ctoi["Duration (hrs)"].values[0] / 24
+            ctoiid = target[4:] + ".01"
+        if _use_shared_catalog("ctoi", kwargs):
+            ctoi = get_catalog_record(
+                "ctoi", ctoiid, kwargs.get("remove_FP")
+            )
+            t0, per, dur = ctoi["t0"], ctoi["per"], ctoi["dur"]
+        else:
+            ctoi = get_ctoi(ctoiid, **kwargs)
+            t0 = ctoi["Midpoint (BJD)"].values[0]
+            per = ctoi["Period (days)"].values[0]
+            dur = ctoi["Duration (hrs)"].values[0] / 24
     elif target[:3] == "tic":
         """check TIC if TOI or CTOI else ask ephem"""
         # get toiid from toi table
@@ -192,16 +541,6 @@ def get_t0_per_dur(target, fp=None, **kwargs):
                 )
             else:
                 raise ValueError("Provide t0,per,dur")
-    elif target[:6] == "kepler":
-        raise NotImplementedError("Provide t0,per,dur")
-        # print('Using ephemeris from NExSci')
-        # import k2plr
-        # client = k2plr.API()
-        # kepid = int(target[6:])
-        # planet = client.planet(f"Kepler-{kepid}b")
-        # import pdb; pdb.set_trace()
-        # # planet.period
-
     elif target[:4] == "epic":
         raise NotImplementedError("Provide t0,per,dur")
         # print('Using ephemeris from NExSci')
@@ -209,50 +548,69 @@ def get_t0_per_dur(target, fp=None, **kwargs):
         # client = k2plr.API()
         # epicid = int(target[4:])
         # import pdb; pdb.set_trace()
-
-    # elif (target[:4] in ['wasp','epic','kelt']) | (target[:2]=='k2') | (target[:3]=='hat'):
-    # print('Using ephemeris from NExSci')
-    #    #TODO add more known planet names
-    #    t0,per,dur = get_ephem_from_nexsci(target)
     else:
-        raise ValueError("Provide t0,per,dur")
+        # known planets e.g. wasp, kelt, hat, k2, kepler
+        # raises ValueError if not in the local NExSci snapshot
+        t0, per, dur = get_ephem_from_nexsci(target)
+        print("Using ephemeris from NExSci")
     assert (t0 is not None) & (not np.isnan(t0)) & (t0 != 0), "Error in t0"
     assert (per is not None) & (not np.isnan(per)) & (per != 0), "Error in per"
     assert (dur is not None) & (not np.isnan(dur)) & (dur != 0), "Error in dur"
     return (t0, per, dur)
 
 
-def get_ephem_from_file(fp, verbose=True):
-    """read ephem from .h5 file from tql
-    """
-    try:
-        import deepdish as dd
-    except Exception:
-        raise ModuleNotFoundError("pip install deepdish")
+def get_ephem_from_file(fp, target=None, verbose=True):
+    """read ephem from .h5 file from tql or from a table of many targets
 
+    Parameters
+    ----------
+    fp : str
+        .h5 file from tql, or csv, parquet or hdf5 table with columns
+        target_name, midtransit, period, duration (see `mirai.ephem`)
+    target : str
+        target name; required for tables
+
+    Returns
+    -------
+    t0, per, dur : tuple
+    """
     if verbose:
         print("Loaded: ", fp)
-    d = dd.io.load(fp)
-    per = d["period"]
-    t0 = d["T0"] + TESS_TIME_OFFSET
-    dur = d["duration"]
+    if (target is None) or is_tql_h5(fp):
+        t0, per, dur = read_tql_h5(fp)
+        t0 += TESS_TIME_OFFSET
+    else:
+        # indexed once per process
+        t0, per, dur = read_ephem_table(fp).get_ephem(target)
     return t0, per, dur
 
 
-def get_ephem_from_nexsci(target):
-    try:
-        from astroquery.nasa_exoplanet_archive import NasaExoplanetArchive
-    except Exception:
-        raise ModuleNotFoundError
+def get_ephem_from_nexsci(target, remote=False, **kwargs):
+    """get ephemeris of a known planet from the local NExSci snapshot
 
-    planet_properties = NasaExoplanetArchive.query_planet(
-        target + " b", all_columns=True
-    )
+    Parameters
+    ----------
+    target : str
+        planet or host name e.g. wasp127b or WASP-127 (planet b)
+    remote : bool
+        query the archive by planet name e.g. WASP-127 b if target is not
+        in the snapshot
+    kwargs : dict
+        passed to `get_nexsci`
 
-    t0 = planet_properties["pl_tranmid"][0]
-    per = planet_properties["pl_orbper"].value[0]  # has unit already
-    dur = planet_properties["pl_trandur"][0]
-    return (t0, per, dur)
+    Returns
+    -------
+    t0, per, dur : tuple
+        in (BJD, d, d)
+    """
+    index = get_nexsci_index(**kwargs)
+    key = normalize_planet_name(target)
+    if key in index:
+        return index[key]
+    if remote:
+        d = resolve("nexsci", target)
+        return (d["t0"], d["per"], d["dur"])
+    raise ValueError(f"{target} not found in NExSci. Provide t0,per,dur")
 
 
 def parse_target_coord(target, **kwargs):
@@ -277,27 +635,86 @@ def parse_target_coord(target, **kwargs):
         elif target[:4] == "ctoi":
             ctoiid = float(target[4:])
             coord = get_coord_from_ctoiid(ctoiid, **kwargs)
-        elif target[:3] == "tic":
-            # TODO: requires int for astroquery.mast.Catalogs to work
-            if len(target[3:].split(".")) == 2:
-                ticid = int(target[3:].split(".")[1])
-            else:
-                ticid = int(target[3:])
-            coord = get_coord_from_ticid(ticid)
-        elif target[:4] == "epic":
-            epicid = float(target[4:])
-            coord = get_coord_from_epicid(epicid)
-        elif target[:2] == "k2":
-            k2id = float(target[2:])
-            coord = SkyCoord.from_name("K2-" + str(k2id))
-        elif target[:4] == "gaia":
-            gaiaid = float(target[4:])
-            coord = SkyCoord.from_name("Gaia DR2 " + str(gaiaid))
         else:
-            coord = SkyCoord.from_name(target)
+            # tic, epic, k2, gaia or Simbad name
+            request = get_remote_request(target)
+            coord = coord_from_record(resolve(*request))
     return coord
 
 
+def get_remote_request(target):
+    """remote lookup needed to get coordinates of target
+
+    Returns
+    -------
+    request : tuple
+        (kind, key) for `mirai.query.resolve`; None if coordinates are
+        given or are in the TOI/CTOI tables
+    """
+    if (len(target.split(",")) == 2) | (target[:3] == "toi"):
+        return None
+    elif target[:4] == "ctoi":
+        return None
+    elif target[:3] == "tic":
+        # TODO: requires int for astroquery.mast.Catalogs to work
+        return ("tic", int(target[3:].split(".")[0]))
+    elif target[:4] == "epic":
+        return ("epic", int(float(target[4:])))
+    elif target[:2] == "k2":
+        return ("name", "K2-" + target[2:])
+    elif target[:4] == "gaia":
+        return ("name", "Gaia DR2 " + str(int(target[4:])))
+    else:
+        return ("name", target)
+
+
+def coord_from_record(d):
+    """SkyCoord from ra, dec [deg] and optional plx [mas] of remote query"""
+    plx = d.get("plx")
+    if (plx is not None) and np.isfinite(plx) and (plx > 0):
+        return SkyCoord(
+            ra=d["ra"],
+            dec=d["dec"],
+            distance=Distance(parallax=plx * u.mas).pc,
+            unit=(u.degree, u.degree, u.pc),
+        )
+    return SkyCoord(ra=d["ra"], dec=d["dec"], unit=(u.degree, u.degree))
+
+
+def _use_shared_catalog(kind, kwargs):
+    """whether a lookup can use the shared records (see `mirai.shared`)
+
+    Downloads and verbose output need the full table.
+    """
+    fn = "TOIs.csv" if kind == "toi" else "CTOIs.csv"
+    return (
+        (set(kwargs) <= {"clobber", "remove_FP"})
+        and (not kwargs.get("clobber", False))
+        and exists(join(DATA_PATH, fn))
+    )
+
+
+def _read_catalog(fp):
+    """read catalog csv once per process unless the file has changed"""
+    mtime = os.path.getmtime(fp)
+    hit = (fp in _CATALOG_CACHE) and (_CATALOG_CACHE[fp][0] == mtime)
+    if not hit:
+        _CATALOG_CACHE[fp] = (mtime, pd.read_csv(fp))
+    get_metrics().inc(
+        "mirai_catalog_cache_total",
+        source="csv",
+        result="hit" if hit else "miss",
+    )
+    return _CATALOG_CACHE[fp][1]
+
+
+def _format_changes(diff):
+    n = diff["change"].value_counts()
+    return "{} added, {} removed, {} re-ephemerised\n".format(
+        n.get("added", 0), n.get("removed", 0), n.get("ephemeris", 0)
+    )
+
+
 def get_tois(
     clobber=True,
     outdir=DATA_PATH,
@@ -327,11 +744,16 @@ def get_tois(
         os.makedirs(outdir)
 
     if not exists(fp) or clobber:
-        msg = f"Downloading {dl_link}"
+        msg = f"Downloading {dl_link}\n"
         d = pd.read_csv(dl_link)  # , dtype={'RA': float, 'Dec': float})
+        if exists(fp):
+            diff = log_catalog_changes(
+                _read_catalog(fp), d, "toi", join(outdir, "TOIs_changes.csv")
+            )
+            msg += _format_changes(diff)
         d.to_csv(fp, index=False)
     else:
-        d = pd.read_csv(fp)
+        d = _read_catalog(fp)
         msg = f"Loaded: {fp}\n"
     assert len(d) > 1000, f"{fp} likely has been overwritten!"
 
@@ -371,6 +793,81 @@ def get_tois(
     return d.sort_values("TOI", ascending=True)
 
 
+def get_nexsci(clobber=False, outdir=DATA_PATH, verbose=False):
+    """Download transiting planets from the NASA Exoplanet Archive.
+
+    Parameters
+    ----------
+    clobber : bool
+        re-download table and save as csv file
+    outdir : str
+        download directory location
+    verbose : bool
+        print texts
+
+    Returns
+    -------
+    d : pandas.DataFrame
+        planetary systems composite parameters (pscomppars) of
+        transiting planets; see NEXSCI_COLUMNS
+    """
+    fp = join(outdir, "NExSci.csv")
+    if not exists(outdir):
+        os.makedirs(outdir)
+
+    if not exists(fp) or clobber:
+        msg = f"Downloading {NEXSCI_URL}\n"
+        d = pd.read_csv(NEXSCI_URL)
+        d.to_csv(fp, index=False)
+        msg += f"Saved: {fp}\n"
+    else:
+        d = _read_catalog(fp)
+        msg = f"Loaded: {fp}\n"
+    if verbose:
+        print(msg)
+    return d.sort_values("pl_name", ascending=True)
+
+
+def normalize_planet_name(name):
+    """e.g. 'WASP-127 b' -> 'wasp127b'"""
+    name = str(name).lower()
+    for c in [" ", "-", "_"]:
+        name = name.replace(c, "")
+    return name
+
+
+def get_nexsci_index(outdir=DATA_PATH, **kwargs):
+    """lookup table of ephemerides of transiting planets
+
+    Built once per process from the local snapshot (see `get_nexsci`).
+    Host names map to their first listed planet e.g. wasp127 -> wasp127b.
+
+    Returns
+    -------
+    index : dict
+        {normalized planet or host name: (t0, per, dur)} in (BJD, d, d)
+    """
+    d = get_nexsci(outdir=outdir, **kwargs)
+    fp = join(outdir, "NExSci.csv")
+    mtime = os.path.getmtime(fp)
+    if (fp in _NEXSCI_INDEX) and (_NEXSCI_INDEX[fp][0] == mtime):
+        return _NEXSCI_INDEX[fp][1]
+
+    d = d.dropna(subset=["pl_tranmid", "pl_orbper", "pl_trandur"])
+    ephems = zip(
+        d["pl_tranmid"].values,
+        d["pl_orbper"].values,
+        d["pl_trandur"].values / 24,  # hours to days
+    )
+    index = {}
+    for planet, host, ephem in zip(d["pl_name"], d["hostname"], ephems):
+        index[normalize_planet_name(planet)] = ephem
+        # d is sorted by name so b comes before c
+        index.setdefault(normalize_planet_name(host), ephem)
+    _NEXSCI_INDEX[fp] = (mtime, index)
+    return index
+
+
 def get_toi(toi, verbose=False, remove_FP=True, clobber=False):
     """Query TOI from TOI list
 
@@ -447,10 +944,18 @@ def get_ctois(clobber=True, outdir=DATA_PATH, verbose=False, remove_FP=True):
     if not exists(fp) or clobber:
         d = pd.read_csv(dl_link)  # , dtype={'RA': float, 'Dec': float})
         msg = "Downloading {}\n".format(dl_link)
+        if exists(fp):
+            diff = log_catalog_changes(
+                _read_catalog(fp).drop_duplicates(),
+                d,
+                "ctoi",
+                join(outdir, "CTOIs_changes.csv"),
+            )
+            msg += _format_changes(diff)
+        d.to_csv(fp, index=False)
     else:
-        d = pd.read_csv(fp).drop_duplicates()
+        d = _read_catalog(fp).drop_duplicates()
         msg = "Loaded: {}\n".format(fp)
-    d.to_csv(fp, index=False)
 
     # remove False Positives
     if remove_FP:
@@ -508,58 +1013,61 @@ def get_ctoi(ctoi, verbose=False, remove_FP=False, clobber=False):
 
 
 def get_coord_from_toiid(toiid, **kwargs):
+    if _use_shared_catalog("toi", kwargs):
+        return _coord_from_catalog_record(
+            "toi", toiid, kwargs.get("remove_FP")
+        )
     toi = get_toi(toiid, **kwargs)
-    coord = SkyCoord(
-        ra=toi["RA"].values[0],
-        dec=toi["Dec"].values[0],
-        distance=toi["Stellar Distance (pc)"].values[0],
-        unit=(u.hourangle, u.degree, u.pc),
+    coord = _catalog_coord(
+        toi["RA"].values[0],
+        toi["Dec"].values[0],
+        toi["Stellar Distance (pc)"].values[0],
+        ra_unit=u.hourangle,
     )
     return coord
 
 
 def get_coord_from_ctoiid(ctoiid, **kwargs):
+    if _use_shared_catalog("ctoi", kwargs):
+        return _coord_from_catalog_record(
+            "ctoi", ctoiid, kwargs.get("remove_FP")
+        )
     ctoi = get_ctoi(ctoiid, **kwargs)
-    coord = SkyCoord(
-        ra=ctoi["RA"].values[0],
-        dec=ctoi["Dec"].values[0],
-        distance=ctoi["Stellar Distance (pc)"].values[0],
-        unit=(u.degree, u.degree, u.pc),
+    coord = _catalog_coord(
+        ctoi["RA"].values[0],
+        ctoi["Dec"].values[0],
+        ctoi["Stellar Distance (pc)"].values[0],
     )
     return coord
 
 
-def get_coord_from_ticid(ticid):
-    df = Catalogs.query_criteria(catalog="Tic", ID=ticid).to_pandas()
-    coord = SkyCoord(
-        ra=df.iloc[0]["ra"],
-        dec=df.iloc[0]["dec"],
-        distance=Distance(parallax=df.iloc[0]["plx"] * u.mas).pc,
-        unit=(u.degree, u.degree, u.pc),
-    )
-    return coord
+def _coord_from_catalog_record(kind, catalog_id, remove_FP=None):
+    record = get_catalog_record(kind, catalog_id, remove_FP)
+    return _catalog_coord(record["ra"], record["dec"], record["distance"])
 
 
-def get_coord_from_epicid(epicid):
-    try:
-        import k2plr
+def _catalog_coord(ra, dec, distance, ra_unit=u.degree):
+    """SkyCoord of a catalog row; distance [pc] is dropped if missing
 
-        client = k2plr.API()
-    except Exception:
-        raise ModuleNotFoundError(
-            "pip install git+https://github.com/rodluger/k2plr.git"
+    A nan distance makes altitudes nan, i.e. the target never observable.
+    """
+    if np.isfinite(distance) and (distance > 0):
+        return SkyCoord(
+            ra=ra, dec=dec, distance=distance, unit=(ra_unit, u.degree, u.pc)
         )
-    epicid = int(epicid)
-    star = client.k2_star(epicid)
-    ra = float(star.k2_ra)
-    dec = float(star.k2_dec)
-    coord = SkyCoord(ra=ra, dec=dec, unit="deg")
-    return coord
+    return SkyCoord(ra=ra, dec=dec, unit=(ra_unit, u.degree))
+
+
+def get_coord_from_ticid(ticid):
+    return coord_from_record(resolve("tic", int(ticid)))
+
+
+def get_coord_from_epicid(epicid):
+    return coord_from_record(resolve("epic", int(epicid)))
 
 
 def get_coord_from_gaiaid(gaiaid):
-    coord = SkyCoord.from_name("Gaia DR2 {}".format(gaiaid))
-    return coord
+    return coord_from_record(resolve("name", "Gaia DR2 {}".format(gaiaid)))
 
 
 def plot_full_transit(
@@ -569,8 +1077,15 @@ def plot_full_transit(
     name=None,
     ephem_label=None,
     night_only=True,
+    tracks=None,
+    i_night=0,
 ):
     """
+    tracks : dict
+        precomputed output of `get_tracks` for target_coord;
+        computed for the night of obs_date if None
+    i_night : int
+        index of the night in tracks
     """
     fig, ax = pl.subplots(1, 1, figsize=(10, 6))
     # plot moon
@@ -583,10 +1098,12 @@ def plot_full_transit(
     t14 = (obs_date[1] - obs_date[0]).value
     mid = ing + dt.timedelta(days=t14 / 2)
 
-    _ = plot_altitude(
-        targets=target_coord,
-        observer=obs_site,
-        time=mid.datetime,
+    if tracks is None:
+        tracks = get_tracks(target_coord, obs_site, mid)
+        i_night = 0
+    _ = plot_tracks(
+        tracks,
+        i_night=i_night,
         brightness_shading=True,
         airmass_yaxis=True,
         min_altitude=20,  # deg
@@ -604,9 +1121,10 @@ def plot_full_transit(
         name += f" @ {obs_site.name}, {ephem_label}"
     ax.set_title(name)
     if night_only:
-        sunset = obs_site.sun_set_time(ing)
-        sunrise = obs_site.sun_rise_time(egr)
-        ax.set_xlim(sunset.datetime, sunrise.datetime)
+        ax.set_xlim(
+            tracks["sunset"][i_night].datetime,
+            tracks["sunrise"][i_night].datetime,
+        )
     fig.tight_layout()
     return fig
 
@@ -619,24 +1137,28 @@ def plot_partial_transit(
     name=None,
     ephem_label=None,
     night_only=True,
+    tracks=None,
+    i_night=0,
 ):
     """
     transit_duration : float
         in days
+    tracks : dict
+        precomputed output of `get_tracks` for target_coord;
+        computed for the night of midpoint if None
+    i_night : int
+        index of the night in tracks
     """
     fig, ax = pl.subplots(1, 1, figsize=(10, 6))
     if transit_duration is not None:
         ing = midpoint - dt.timedelta(days=transit_duration / 2)
         egr = midpoint + dt.timedelta(days=transit_duration / 2)
-        sunset = obs_site.sun_set_time(ing)
-        sunrise = obs_site.sun_rise_time(egr)
-    else:
-        sunset = obs_site.sun_set_time(midpoint)
-        sunrise = obs_site.sun_rise_time(midpoint)
-    _ = plot_altitude(
-        targets=target_coord,
-        observer=obs_site,
-        time=midpoint.datetime,
+    if tracks is None:
+        tracks = get_tracks(target_coord, obs_site, midpoint)
+        i_night = 0
+    _ = plot_tracks(
+        tracks,
+        i_night=i_night,
         brightness_shading=True,
         airmass_yaxis=True,
         min_altitude=20,  # deg
@@ -655,7 +1177,10 @@ def plot_partial_transit(
         name += f" @ {obs_site.name}, {ephem_label}"
     ax.set_title(name)
     if night_only:
-        ax.set_xlim(sunset.datetime, sunrise.datetime)
+        ax.set_xlim(
+            tracks["sunset"][i_night].datetime,
+            tracks["sunrise"][i_night].datetime,
+        )
     fig.tight_layout()
     return fig
 
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+r"""
+Moon illumination and sky brightness shared by all targets of a site
+
+The geocentric apparent positions of the Moon and the Sun and the
+illuminated fraction of the Moon are computed once per window on a 12 h
+grid, cached, and interpolated with cubic splines. Altitude and azimuth at
+any time and site then follow from the sidereal time with a few array
+operations, including the topocentric parallax of the Moon (within 0.02 deg
+of astropy), so constraints on lunar geometry cost almost nothing per
+target.
+
+Sky brightness follows Krisciunas & Schaefer (1991, PASP 103, 1033): the
+dark sky plus moonlight scattered towards the target, in V mag/arcsec^2.
+
+>>> constraints = get_constraints(max_moon_illumination=0.5,
+...                               min_sky_brightness=20)
+"""
+import numpy as np
+import astropy.units as u
+from astropy.time import Time
+from astropy.coordinates import get_body, TETE
+from astroplan import Constraint
+from astroplan.constraints import _get_altaz
+from scipy.interpolate import CubicSpline
+
+from mirai.tracks import _angular_separation
+from mirai.shared import shared_array
+
+__all__ = [
+    "MoonPhaseConstraint",
+    "SkyBrightnessConstraint",
+    "get_moon",
+    "get_night_illumination",
+    "get_sun_altitude",
+    "apparent_altaz",
+    "sky_brightness",
+]
+
+# moon and sun ephemeris grid spacing [d]
+GRID_STEP = 0.5
+# splines of moon and sun positions keyed by grid start and end day
+_MOON_CACHE = {}
+EARTH_RADIUS_KM = 6378.1
+
+
+def _splines(start, end):
+    """moon ra, dec [rad], distance [km], illumination, sun ra, dec [rad]"""
+    # any cached grid covering the times is reused since constraints are
+    # evaluated on many different subsets of times
+    for (first, last), spline in _MOON_CACHE.items():
+        if (first <= start) and (end <= last):
+            return spline
+    # whole months so that nearby windows share the grid
+    key = (np.floor(start / 30) * 30 - 1, np.ceil(end / 30) * 30 + 1)
+    if key not in _MOON_CACHE:
+        jd = np.arange(key[0], key[1] + GRID_STEP, GRID_STEP)
+
+        def compute():
+            times = Time(jd, format="jd", scale="utc")
+            moon = get_body("moon", times)
+            sun = get_body("sun", times)
+            # illuminated fraction from the sun-moon elongation
+            illumination = (1 - np.cos(moon.separation(sun).rad)) / 2
+            moon = moon.transform_to(TETE(obstime=times))
+            sun = sun.transform_to(TETE(obstime=times))
+            return np.c_[
+                np.unwrap(moon.ra.rad),
+                moon.dec.rad,
+                moon.distance.to(u.km).value,
+                illumination,
+                np.unwrap(sun.ra.rad),
+                sun.dec.rad,
+            ]
+
+        # grid computed by the first process, memory-mapped by the others;
+        # spline coefficients are small and fitted per process
+        values = shared_array(f"moon_sun_{key[0]:.0f}_{key[1]:.0f}", compute)
+        _MOON_CACHE[key] = CubicSpline(jd, values)
+    return _MOON_CACHE[key]
+
+
+def get_moon(obs_site, jd):
+    """Moon altitude, azimuth [deg] and illuminated fraction at utc JD
+
+    Parameters
+    ----------
+    obs_site : astroplan.Observer
+    jd : numpy.ndarray
+        utc JD, any shape
+
+    Returns
+    -------
+    moon : dict
+        altitude, azimuth, illumination with the shape of jd
+    """
+    jd = np.asarray(jd, dtype=float)
+    if jd.size == 0:
+        return dict(altitude=jd, azimuth=jd, illumination=jd)
+    ra, dec, dist, illumination = np.moveaxis(
+        _splines(jd.min(), jd.max())(jd)[..., :4], -1, 0
+    )
+    alt, az = apparent_altaz(obs_site, jd, ra, dec)
+    # topocentric parallax lowers the moon by up to ~1 deg
+    alt = alt - np.degrees(
+        np.arcsin(EARTH_RADIUS_KM / dist * np.cos(np.radians(alt)))
+    )
+    return dict(
+        altitude=alt,
+        azimuth=az,
+        illumination=np.clip(illumination, 0, 1),
+    )
+
+
+def get_sun_altitude(obs_site, jd):
+    """Sun altitude [deg] at utc JD (any shape)"""
+    jd = np.asarray(jd, dtype=float)
+    if jd.size == 0:
+        return jd
+    ra, dec = np.moveaxis(_splines(jd.min(), jd.max())(jd)[..., 4:], -1, 0)
+    return apparent_altaz(obs_site, jd, ra, dec)[0]
+
+
+def apparent_altaz(obs_site, jd, ra, dec):
+    """geocentric altitude and azimuth [deg] at utc JD
+
+    Parameters
+    ----------
+    obs_site : astroplan.Observer
+    jd : numpy.ndarray
+        utc JD
+    ra, dec : numpy.ndarray
+        apparent (TETE) coordinates [rad] broadcastable with jd
+
+    Returns
+    -------
+    alt, az : numpy.ndarray
+        without refraction as in astroplan
+    """
+    # hour angle from the mean sidereal time (ut1 ~ utc)
+    gmst = np.radians(280.46061837 + 360.98564736629 * (jd - 2451545.0))
+    ha = gmst + obs_site.location.lon.rad - ra
+    lat = obs_site.location.lat.rad
+    alt = np.arcsin(
+        np.sin(lat) * np.sin(dec) + np.cos(lat) * np.cos(dec) * np.cos(ha)
+    )
+    az = np.arctan2(
+        -np.sin(ha) * np.cos(dec),
+        np.sin(dec) * np.cos(lat) - np.cos(dec) * np.sin(lat) * np.cos(ha),
+    )
+    return np.degrees(alt), np.degrees(az) % 360
+
+
+def get_night_illumination(obs_site, jd):
+    """Moon illumination at the local midnight of the night of each time
+
+    All times of the same night get the same value.
+    """
+    jd = np.asarray(jd, dtype=float)
+    # local mean midnight nearest to each time
+    offset = obs_site.location.lon.deg / 360
+    midnight = np.round(jd - 0.5 + offset) + 0.5 - offset
+    return get_moon(obs_site, midnight)["illumination"]
+
+
+def _airmass(zenith_distance):
+    """Krisciunas & Schaefer eq. 3 [deg]"""
+    z = np.radians(np.clip(zenith_distance, 0, 90))
+    return (1 - 0.96 * np.sin(z) ** 2) ** -0.5
+
+
+def sky_brightness(
+    moon_altitude,
+    target_altitude,
+    separation,
+    illumination,
+    extinction=0.172,
+    dark_sky=21.587,
+):
+    """V-band sky brightness at the target [mag/arcsec^2]
+
+    Parameters
+    ----------
+    moon_altitude, target_altitude, separation : numpy.ndarray
+        [deg]
+    illumination : numpy.ndarray
+        illuminated fraction of the Moon
+    extinction : float
+        V-band extinction coefficient [mag/airmass]
+    dark_sky : float
+        zenith brightness of the moonless sky [mag/arcsec^2]
+
+    Returns
+    -------
+    brightness : numpy.ndarray
+        larger is darker
+    """
+    # moon phase angle [deg] from the illuminated fraction
+    alpha = np.degrees(np.arccos(np.clip(2 * illumination - 1, -1, 1)))
+    moon = 10 ** (-0.4 * (3.84 + 0.026 * alpha + 4e-9 * alpha**4))
+    rho = np.clip(separation, 1e-3, 180)
+    scattering = 10**5.36 * (1.06 + np.cos(np.radians(rho)) ** 2) + 10 ** (
+        6.15 - rho / 40
+    )
+    x_moon = _airmass(90 - moon_altitude)
+    x_target = _airmass(90 - target_altitude)
+    b_moon = (
+        scattering
+        * moon
+        * 10 ** (-0.4 * extinction * x_moon)
+        * (1 - 10 ** (-0.4 * extinction * x_target))
+    )
+    b_moon = np.where(moon_altitude > 0, b_moon, 0)
+    # nanoLamberts <-> V mag/arcsec^2
+    b_zenith = 34.08 * np.exp(20.7233 - 0.92104 * dark_sky)
+    b_dark = b_zenith * 10 ** (-0.4 * extinction * (x_target - 1)) * x_target
+    return (20.7233 - np.log((b_dark + b_moon) / 34.08)) / 0.92104
+
+
+class MoonPhaseConstraint(Constraint):
+    """Moon illumination of the night at most max, or Moon below horizon
+
+    Unlike `astroplan.MoonIlluminationConstraint`, the illumination is one
+    value per night taken from the cached Moon ephemeris.
+
+    Parameters
+    ----------
+    max : float
+        maximum illuminated fraction (0-1)
+    """
+
+    def __init__(self, max=0.5):
+        self.max = max
+
+    def compute_constraint(self, times, observer, targets):
+        jd = times.utc.jd
+        moon_down = get_moon(observer, jd)["altitude"] < 0
+        return (get_night_illumination(observer, jd) <= self.max) | moon_down
+
+
+class SkyBrightnessConstraint(Constraint):
+    """sky at the target at least as dark as min [V mag/arcsec^2]
+
+    Parameters
+    ----------
+    min : float
+        e.g. 20 for grey time, 21 for dark time
+    """
+
+    def __init__(self, min=20.0):
+        self.min = min
+
+    def compute_constraint(self, times, observer, targets):
+        jd = times.utc.jd
+        moon = get_moon(observer, jd)
+        # target alt/az shared with the altitude constraints
+        altaz = _get_altaz(times, observer, targets)["altaz"]
+        alt, az = altaz.alt.deg, altaz.az.deg
+        separation = _angular_separation(
+            alt, az, moon["altitude"], moon["azimuth"]
+        )
+        brightness = sky_brightness(
+            moon["altitude"], alt, separation, moon["illumination"]
+        )
+        return brightness >= self.min
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+r"""
+Sunset, sunrise and local-time observing windows of every night in a window
+
+Sun altitudes are sampled once on an hourly grid over the whole observation
+window, horizon crossings are bracketed on the grid and refined with one
+vectorized secant step, so all nights come from two astropy calls instead of
+one astroplan root search per night, and are cached per site and window.
+Local clock times e.g. -lt1 23:59 are converted to utc per night with the
+site time zone, so daylight saving changes during long windows are followed.
+
+>>> windows = get_local_time_windows(obs_site, obs_start, obs_end, "23:59")
+>>> in_windows(midtransit_times.utc.jd, windows)
+"""
+import datetime as dt
+
+import numpy as np
+import pytz
+from astropy.time import Time
+from astropy.coordinates import AltAz, get_sun
+
+from mirai.tracks import _site_key
+
+__all__ = ["get_nights", "get_local_time_windows", "in_windows"]
+
+# sun altitude grid spacing [min]; refined crossings are accurate to ~1 s
+GRID_RESOLUTION = 60
+# nights keyed by site, window and horizon
+_NIGHTS_CACHE = {}
+
+
+def _parse_localtime(localtime):
+    """datetime.time of 'HH:MM' or datetime.time"""
+    if isinstance(localtime, dt.time):
+        return localtime
+    hr, min = localtime.split(":")
+    return dt.time(int(hr), int(min))
+
+
+def _sun_altitude(obs_site, jd):
+    """sun altitude [deg] at utc JD"""
+    times = Time(jd, format="jd", scale="utc")
+    frame = AltAz(obstime=times, location=obs_site.location)
+    return get_sun(times).transform_to(frame).alt.deg
+
+
+def _crossings(obs_site, jd, alt, horizon):
+    """utc JD of downward (set) and upward (rise) crossings of horizon"""
+    above = alt > horizon
+    i = np.flatnonzero(above[:-1] != above[1:])
+    setting = above[i]
+    t1, t2, a1, a2 = jd[i], jd[i + 1], alt[i], alt[i + 1]
+    # linear interpolation within each grid step, then one secant step
+    # from the estimate to the grid sample on the other side
+    t = t1 + (horizon - a1) / (a2 - a1) * (t2 - t1)
+    if len(t) > 0:
+        a = _sun_altitude(obs_site, t)
+        before = (a > horizon) == (a1 > horizon)
+        tb, ab = np.where(before, t2, t1), np.where(before, a2, a1)
+        t = t + (horizon - a) / (ab - a) * (tb - t)
+    return t[setting], t[~setting]
+
+
+def get_nights(obs_site, obs_start, obs_end, horizon=0):
+    """sunset and following sunrise of each night between obs_start & obs_end
+
+    Parameters
+    ----------
+    obs_site : astroplan.Observer
+    obs_start, obs_end : astropy.time.Time
+        observation window
+    horizon : float
+        sun altitude at sunset and sunrise [deg] (default=0)
+
+    Returns
+    -------
+    nights : dict
+        date (local date of the evening), sunset, sunrise (n_nights) utc JD
+        of nights overlapping the window
+    """
+    key = (_site_key(obs_site), obs_start.utc.jd, obs_end.utc.jd, horizon)
+    if key in _NIGHTS_CACHE:
+        return _NIGHTS_CACHE[key]
+    # pad by a day to include the nights around both ends
+    step = GRID_RESOLUTION / 60 / 24
+    jd = np.arange(
+        np.floor(obs_start.utc.jd) - 1,
+        np.ceil(obs_end.utc.jd) + 1 + step,
+        step,
+    )
+    alt = _sun_altitude(obs_site, jd)
+    sets, rises = _crossings(obs_site, jd, alt, horizon)
+    # pair each sunset with the first sunrise after it; nights without
+    # either e.g. polar summer are dropped
+    j = np.searchsorted(rises, sets)
+    ok = j < len(rises)
+    sets, rises = sets[ok], rises[j[ok]]
+    keep = (rises > obs_start.utc.jd) & (sets < obs_end.utc.jd)
+    sets, rises = sets[keep], rises[keep]
+    evenings = Time(sets, format="jd").to_datetime(timezone=obs_site.timezone)
+    dates = np.array([t.date() for t in np.atleast_1d(evenings)])
+    _NIGHTS_CACHE[key] = dict(date=dates, sunset=sets, sunrise=rises)
+    return _NIGHTS_CACHE[key]
+
+
+def _localtime_to_jd(dates, localtime, timezone):
+    """utc JD of localtime on the night of each evening date
+
+    Times from noon fall on the evening date, earlier ones on the next day.
+    """
+    shift = dt.timedelta(days=0 if localtime >= dt.time(12) else 1)
+    utc = [
+        timezone.localize(dt.datetime.combine(d + shift, localtime))
+        .astimezone(pytz.utc)
+        .replace(tzinfo=None)
+        for d in dates
+    ]
+    return Time(utc, scale="utc").jd if len(utc) > 0 else np.array([])
+
+
+def get_local_time_windows(
+    obs_site, obs_start, obs_end, start_localtime=None, end_localtime=None
+):
+    """observing window of each night between local times
+
+    Parameters
+    ----------
+    obs_site : astroplan.Observer
+    obs_start, obs_end : astropy.time.Time
+        observation window
+    start_localtime, end_localtime : str or datetime.time
+        e.g. '19:00' or '23:59'; sunset and sunrise of each night if None
+
+    Returns
+    -------
+    windows : numpy.ndarray
+        (n_nights, 2) utc JD of start and end of each night, sorted
+    """
+    nights = get_nights(obs_site, obs_start, obs_end)
+    start, end = nights["sunset"], nights["sunrise"]
+    if start_localtime is not None:
+        lt = _parse_localtime(start_localtime)
+        start = _localtime_to_jd(nights["date"], lt, obs_site.timezone)
+    if end_localtime is not None:
+        lt = _parse_localtime(end_localtime)
+        end = _localtime_to_jd(nights["date"], lt, obs_site.timezone)
+    windows = np.stack([start, end], axis=1).reshape(-1, 2)
+    # e.g. end before start if both local times are in the evening
+    return windows[windows[:, 1] > windows[:, 0]]
+
+
+def in_windows(start, windows, end=None):
+    """whether times (or start-end intervals) fall within a single window
+
+    Parameters
+    ----------
+    start : numpy.ndarray
+        utc JD of events, or of ingress if end is given
+    windows : numpy.ndarray
+        (n_windows, 2) sorted, non-overlapping utc JD; see
+        `get_local_time_windows`
+    end : numpy.ndarray
+        utc JD of egress
+
+    Returns
+    -------
+    idx : numpy.ndarray
+        boolean mask of events inside a window
+    """
+    start = np.asarray(start, dtype=float)
+    end = start if end is None else np.asarray(end, dtype=float)
+    if len(windows) == 0:
+        return np.zeros(start.shape, dtype=bool)
+    # last window starting at or before each event
+    i = np.searchsorted(windows[:, 0], start, side="right") - 1
+    j = np.clip(i, 0, None)
+    return (i >= 0) & (end <= windows[j, 1])
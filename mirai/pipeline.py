@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+r"""
+Constraint evaluation ordered by cost with short-circuiting
+
+Constraints are evaluated from the cheapest to the most expensive and each
+one only at times which passed all previous ones, e.g. target altitudes are
+computed only at night and Moon positions only when the target is also
+high enough. Results are identical to `astroplan.is_event_observable`.
+
+Costs are relative; unknown constraints are evaluated after the altitude
+constraints.
+"""
+import time
+
+import numpy as np
+from astropy.time import Time
+from astroplan import (
+    LocalTimeConstraint,
+    TimeConstraint,
+    AtNightConstraint,
+    SunSeparationConstraint,
+    AltitudeConstraint,
+    AirmassConstraint,
+    MoonSeparationConstraint,
+    MoonIlluminationConstraint,
+)
+
+from mirai.moon import MoonPhaseConstraint, SkyBrightnessConstraint
+from mirai.metrics import get_metrics
+
+__all__ = [
+    "CONSTRAINT_COSTS",
+    "order_constraints",
+    "evaluate_constraints",
+    "observable_months",
+]
+
+# clock time < sun & cached moon (shared by all targets) < target alt/az
+# < moon
+CONSTRAINT_COSTS = {
+    LocalTimeConstraint: 0,
+    TimeConstraint: 0,
+    AtNightConstraint: 1,
+    MoonPhaseConstraint: 1,
+    SunSeparationConstraint: 2,
+    AltitudeConstraint: 2,
+    AirmassConstraint: 2,
+    MoonIlluminationConstraint: 3,
+    SkyBrightnessConstraint: 3,
+    MoonSeparationConstraint: 4,
+}
+DEFAULT_COST = 2.5
+
+
+def _cost(constraint):
+    for cls in type(constraint).__mro__:
+        if cls in CONSTRAINT_COSTS:
+            return CONSTRAINT_COSTS[cls]
+    return DEFAULT_COST
+
+
+def order_constraints(constraints):
+    """constraints sorted from cheapest to most expensive (stable)"""
+    return sorted(constraints, key=_cost)
+
+
+def evaluate_constraints(constraints, obs_site, target_coord, times):
+    """whether all constraints are met at each time
+
+    Parameters
+    ----------
+    constraints : list
+        astroplan constraints
+    obs_site : astroplan.Observer
+    target_coord : SkyCoord
+        single target
+    times : astropy.time.Time
+        1-d times
+
+    Returns
+    -------
+    ok : numpy.ndarray
+        boolean with the length of times
+    """
+    metrics = get_metrics()
+    ok = np.ones(len(times), dtype=bool)
+    for constraint in order_constraints(constraints):
+        idx = np.flatnonzero(ok)
+        if len(idx) == 0:
+            break
+        t = time.perf_counter()
+        ok[idx] = constraint(
+            obs_site, target_coord, times=times[idx], grid_times_targets=True
+        ).reshape(-1)
+        name = type(constraint).__name__
+        metrics.observe(
+            "mirai_constraint_seconds",
+            time.perf_counter() - t,
+            constraint=name,
+        )
+        metrics.inc("mirai_constraint_times_total", len(idx), constraint=name)
+    return ok
+
+
+def observable_months(
+    constraints,
+    obs_site,
+    target_coord,
+    time_range=None,
+    time_grid_resolution=1,
+):
+    """months (1-12) when the target is observable at any grid time
+
+    Same as `astroplan.months_observable` for one target.
+
+    Parameters
+    ----------
+    time_range : astropy.time.Time
+        start & end of the grid (default=current year)
+    time_grid_resolution : float
+        grid spacing [hr]
+    """
+    if time_range is None:
+        year = Time.now().datetime.year
+        time_range = Time([f"{year}-01-01", f"{year}-12-31"])
+    start, end = time_range.jd
+    times = Time(np.arange(start, end, time_grid_resolution / 24), format="jd")
+    ok = evaluate_constraints(constraints, obs_site, target_coord, times)
+    return set(t.month for t in times[ok].datetime)
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+r"""
+Per-site lookup of observable months and maximum altitude on an RA x Dec grid
+
+Used to discard targets that can never clear the altitude limit at night
+from a site before running astroplan constraints. For each month and RA bin,
+the smallest hour angle reached at night gives the highest altitude of each
+Dec band analytically. Cells are accepted within a margin covering the cell
+size and the time sampling, so a target rejected by the grid is also
+rejected by `astroplan.months_observable`.
+"""
+import os
+from os.path import join, exists
+
+import numpy as np
+import astropy.units as u
+from astropy.time import Time
+from astropy.coordinates import AltAz, get_sun
+from astroplan import AltitudeConstraint, AtNightConstraint
+
+from mirai.config import DATA_PATH
+from mirai.tracks import _directions
+
+__all__ = ["VisibilityGrid", "get_visibility_grid", "prune_targets"]
+
+# grids keyed by site and limits
+_GRID_CACHE = {}
+
+
+class VisibilityGrid:
+    """Observable months and maximum altitude of RA x Dec cells from a site
+
+    Parameters
+    ----------
+    obs_site : astroplan.Observer
+    alt_limit : float
+        target altitude limit [deg]
+    max_solar_altitude : float
+        sun altitude limit [deg] defining night; None for no night limit
+    ra_step, dec_step : float
+        cell size [deg]
+    time_resolution : astropy.units.Quantity
+        sampling of the year
+    year : int
+        year of the time grid (default=current year as in months_observable)
+    """
+
+    def __init__(
+        self,
+        obs_site,
+        alt_limit=30,
+        max_solar_altitude=-6,
+        ra_step=2.0,
+        dec_step=1.0,
+        time_resolution=0.5 * u.hour,
+        year=None,
+    ):
+        self.site = obs_site.name
+        self.alt_limit = alt_limit
+        self.max_solar_altitude = max_solar_altitude
+        self.ra_edges = np.arange(0, 360 + ra_step, ra_step)
+        self.dec_edges = np.arange(-90, 90 + dec_step, dec_step)
+        ra = 0.5 * (self.ra_edges[1:] + self.ra_edges[:-1])
+        dec = 0.5 * (self.dec_edges[1:] + self.dec_edges[:-1])
+        lat = obs_site.location.lat.rad
+
+        year = Time.now().datetime.year if year is None else year
+        start = Time(f"{year}-01-01")
+        dt = time_resolution.to(u.day).value
+        times = start + np.arange(0, Time(f"{year+1}-01-01").jd - start.jd, dt)
+        if max_solar_altitude is not None:
+            frame = AltAz(obstime=times, location=obs_site.location)
+            sun_alt = get_sun(times).transform_to(frame).alt.deg
+            times = times[sun_alt < max_solar_altitude]
+        lst = times.sidereal_time(
+            "mean", longitude=obs_site.location.lon
+        ).deg
+        months = np.array([t.month for t in times.datetime])
+
+        # smallest hour angle [deg] at night in each month and RA bin
+        min_ha = np.full((12, len(ra)), 180.0)
+        for m in range(1, 13):
+            ha = (lst[months == m][:, np.newaxis] - ra + 180) % 360 - 180
+            if len(ha) > 0:
+                min_ha[m - 1] = np.abs(ha).min(axis=0)
+
+        # altitude changes at most 1 deg per deg of position or hour angle;
+        # 0.5 deg covers precession and nutation ignored in mean LST vs J2000
+        self.margin = 0.5 * (ra_step + dec_step) + 0.5 * dt * 360 + 0.5
+        sin_alt = np.sin(lat) * np.sin(np.radians(dec))[
+            np.newaxis, np.newaxis, :
+        ] + np.cos(lat) * np.cos(np.radians(dec))[
+            np.newaxis, np.newaxis, :
+        ] * np.cos(
+            np.radians(min_ha)
+        )[
+            :, :, np.newaxis
+        ]
+        # (12, n_ra, n_dec)
+        self.month_max_altitude = np.degrees(np.arcsin(sin_alt))
+        self.months = self.month_max_altitude >= alt_limit - self.margin
+        # highest altitude at any time, only depends on declination
+        self.max_altitude = 90 - np.abs(np.degrees(lat) - dec)
+
+    def _cells(self, ra, dec):
+        ra = np.atleast_1d(ra) % 360
+        dec = np.atleast_1d(dec)
+        i = np.clip(
+            np.searchsorted(self.ra_edges, ra, side="right") - 1,
+            0,
+            len(self.ra_edges) - 2,
+        )
+        j = np.clip(
+            np.searchsorted(self.dec_edges, dec, side="right") - 1,
+            0,
+            len(self.dec_edges) - 2,
+        )
+        return i, j
+
+    def lookup(self, ra, dec):
+        """observable months and maximum altitude of positions [deg]
+
+        Returns
+        -------
+        months : numpy.ndarray
+            (N, 12) bool; True if possibly observable in that month
+        max_altitude : numpy.ndarray
+            (N,) highest altitude [deg]
+        """
+        i, j = self._cells(ra, dec)
+        return self.months[:, i, j].T, self.max_altitude[j]
+
+    def is_observable(self, coords):
+        """False for targets which can never clear alt_limit at night"""
+        coords = _directions(coords)
+        months, _ = self.lookup(coords.ra.deg, coords.dec.deg)
+        return months.any(axis=1)
+
+    def save(self, fp):
+        np.savez_compressed(
+            fp,
+            site=self.site,
+            alt_limit=self.alt_limit,
+            max_solar_altitude=np.nan
+            if self.max_solar_altitude is None
+            else self.max_solar_altitude,
+            ra_edges=self.ra_edges,
+            dec_edges=self.dec_edges,
+            months=self.months,
+            month_max_altitude=self.month_max_altitude,
+            max_altitude=self.max_altitude,
+            margin=self.margin,
+        )
+
+    @classmethod
+    def load(cls, fp):
+        d = np.load(fp)
+        grid = cls.__new__(cls)
+        grid.site = str(d["site"])
+        grid.alt_limit = float(d["alt_limit"])
+        sun = float(d["max_solar_altitude"])
+        grid.max_solar_altitude = None if np.isnan(sun) else sun
+        grid.margin = float(d["margin"])
+        for key in [
+            "ra_edges",
+            "dec_edges",
+            "months",
+            "month_max_altitude",
+            "max_altitude",
+        ]:
+            setattr(grid, key, d[key])
+        return grid
+
+
+def _get_limits(constraints):
+    """altitude and solar altitude limits [deg] of a constraint list"""
+    alt_limit = None
+    max_solar_altitude = None
+    for c in constraints:
+        if isinstance(c, AltitudeConstraint) and (c.min is not None):
+            alt_limit = c.min.to(u.deg).value
+        elif isinstance(c, AtNightConstraint):
+            max_solar_altitude = c.max_solar_altitude.to(u.deg).value
+    return alt_limit, max_solar_altitude
+
+
+def get_visibility_grid(
+    obs_site,
+    alt_limit=30,
+    max_solar_altitude=-6,
+    outdir=join(DATA_PATH, "grids"),
+    **kwargs,
+):
+    """VisibilityGrid of a site cached in memory and as npz in outdir
+
+    kwargs are passed to VisibilityGrid
+    """
+    year = kwargs.get("year", Time.now().datetime.year)
+    loc = obs_site.location
+    key = (
+        obs_site.name,
+        round(loc.lat.deg, 4),
+        round(loc.lon.deg, 4),
+        alt_limit,
+        max_solar_altitude,
+        year,
+    )
+    if key not in _GRID_CACHE:
+        fp = None
+        if outdir is not None:
+            fn = "visibility_{}_{:.4f}_{:.4f}_alt{}_sun{}_{}.npz".format(*key)
+            fp = join(outdir, fn)
+        if (fp is not None) and exists(fp):
+            grid = VisibilityGrid.load(fp)
+        else:
+            grid = VisibilityGrid(
+                obs_site,
+                alt_limit=alt_limit,
+                max_solar_altitude=max_solar_altitude,
+                **kwargs,
+            )
+            if fp is not None:
+                if not exists(outdir):
+                    os.makedirs(outdir)
+                grid.save(fp)
+        _GRID_CACHE[key] = grid
+    return _GRID_CACHE[key]
+
+
+def prune_targets(coords, obs_site, constraints):
+    """True for targets which may be observable given constraints
+
+    Without an AltitudeConstraint nothing is pruned.
+    """
+    coords = _directions(coords)
+    alt_limit, max_solar_altitude = _get_limits(constraints)
+    if alt_limit is None:
+        return np.ones(len(coords), dtype=bool)
+    grid = get_visibility_grid(
+        obs_site, alt_limit=alt_limit, max_solar_altitude=max_solar_altitude
+    )
+    return grid.is_observable(coords)
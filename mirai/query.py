@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+r"""
+Asynchronous, rate-limited remote lookups (MAST, Simbad/Sesame, NExSci, K2)
+
+Each lookup is identified by a (kind, key) pair e.g. ("tic", 231663901) and
+returns a plain dict so results are cheap to cache and to pickle. Blocking
+astroquery/astropy calls run in threads; coroutine fetchers are awaited
+directly. Fetchers can be replaced per kind, e.g. to test against a local
+mock server:
+
+>>> resolver = RemoteResolver(
+...     fetchers={"tic": json_fetcher("http://127.0.0.1:8000/tic/{key}")}
+... )
+>>> resolver.resolve_sync("tic", 231663901)
+"""
+import json
+import time
+import random
+import asyncio
+from urllib.request import urlopen
+from concurrent.futures import ThreadPoolExecutor
+
+from astropy.coordinates.name_resolve import NameResolveError
+
+from mirai.metrics import get_metrics
+
+__all__ = ["RemoteResolver", "get_resolver", "resolve", "json_fetcher"]
+
+# errors which will not go away by asking again
+NON_RETRYABLE_ERRORS = (
+    ValueError,
+    KeyError,
+    IndexError,
+    TypeError,
+    NotImplementedError,
+    ModuleNotFoundError,
+    # unknown names; failures to reach Sesame are retried (see _is_retryable)
+    NameResolveError,
+)
+# minimum time between the start of two calls of the same kind [s]
+MIN_INTERVALS = {"tic": 0.2, "name": 0.2, "epic": 0.5, "nexsci": 0.5}
+
+
+def _is_retryable(error):
+    if isinstance(error, NameResolveError):
+        return "queries failed" in str(error)
+    return not isinstance(error, NON_RETRYABLE_ERRORS)
+
+
+def _query_tic(ticid):
+    from astroquery.mast import Catalogs
+
+    df = Catalogs.query_criteria(catalog="Tic", ID=int(ticid)).to_pandas()
+    if len(df) == 0:
+        raise ValueError(f"TIC {ticid} not found in MAST")
+    row = df.iloc[0]
+    return dict(
+        ra=float(row["ra"]), dec=float(row["dec"]), plx=float(row["plx"])
+    )
+
+
+def _query_name(name):
+    from astropy.coordinates import SkyCoord
+
+    coord = SkyCoord.from_name(name)
+    return dict(ra=coord.ra.deg, dec=coord.dec.deg)
+
+
+def _query_epic(epicid):
+    try:
+        import k2plr
+
+        client = k2plr.API()
+    except Exception:
+        raise ModuleNotFoundError(
+            "pip install git+https://github.com/rodluger/k2plr.git"
+        )
+    star = client.k2_star(int(epicid))
+    return dict(ra=float(star.k2_ra), dec=float(star.k2_dec))
+
+
+def _query_nexsci(planet_name):
+    try:
+        from astroquery.ipac.nexsci.nasa_exoplanet_archive import (
+            NasaExoplanetArchive,
+        )
+    except Exception:
+        raise ModuleNotFoundError("pip install astroquery")
+
+    tab = NasaExoplanetArchive.query_criteria(
+        table="pscomppars",
+        select="pl_name,pl_tranmid,pl_orbper,pl_trandur",
+        # quotes are doubled in ADQL strings
+        where="pl_name like '{}'".format(planet_name.replace("'", "''")),
+    )
+    if len(tab) == 0:
+        raise ValueError(f"{planet_name} not found in NExSci")
+    return dict(
+        t0=float(tab["pl_tranmid"][0]),
+        per=float(tab["pl_orbper"][0]),
+        dur=float(tab["pl_trandur"][0]) / 24,  # hours to days
+    )
+
+
+def json_fetcher(url_template, timeout=30):
+    """fetcher returning the json response of url_template.format(key=key)"""
+
+    def fetch(key):
+        with urlopen(url_template.format(key=key), timeout=timeout) as r:
+            return json.loads(r.read().decode())
+
+    return fetch
+
+
+DEFAULT_FETCHERS = {
+    "tic": _query_tic,
+    "name": _query_name,
+    "epic": _query_epic,
+    "nexsci": _query_nexsci,
+}
+
+
+class RemoteResolver:
+    """Resolve remote lookups with bounded concurrency, retries with
+    exponential backoff, coalescing of duplicate in-flight requests and a
+    response cache.
+
+    Parameters
+    ----------
+    max_concurrency : int
+        maximum number of simultaneous remote calls
+    min_interval : float or dict
+        minimum time between the start of two calls of the same kind [s];
+        {kind: interval} or the same for all kinds (default=MIN_INTERVALS)
+    retries : int
+        number of retries after the first failed attempt
+    backoff : float
+        initial backoff [s]; doubled after each failed attempt
+    max_backoff : float
+        upper limit of backoff [s]
+    fetchers : dict
+        {kind: callable(key)} overriding DEFAULT_FETCHERS
+    """
+
+    def __init__(
+        self,
+        max_concurrency=8,
+        min_interval=None,
+        retries=3,
+        backoff=1.0,
+        max_backoff=30.0,
+        fetchers=None,
+    ):
+        self.max_concurrency = max_concurrency
+        if min_interval is None:
+            min_interval = MIN_INTERVALS
+        self.min_interval = min_interval
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.fetchers = dict(DEFAULT_FETCHERS)
+        if fetchers is not None:
+            self.fetchers.update(fetchers)
+        self.cache = {}
+        self.stats = dict(
+            hits=0, misses=0, coalesced=0, retries=0, failures=0
+        )
+        self._loop = None
+        self._semaphore = None
+        self._inflight = {}
+        self._next_call = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+    def _bind_loop(self):
+        """asyncio primitives belong to one event loop; rebind if needed"""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._inflight = {}
+            self._next_call = {}
+        return loop
+
+    async def resolve(self, kind, key):
+        """resolve a single (kind, key) lookup"""
+        loop = self._bind_loop()
+        metrics = get_metrics()
+        k = (kind, key)
+        if k in self.cache:
+            self.stats["hits"] += 1
+            metrics.inc("mirai_remote_cache_total", kind=kind, result="hit")
+            return self.cache[k]
+        if k in self._inflight:
+            self.stats["coalesced"] += 1
+            metrics.inc(
+                "mirai_remote_cache_total", kind=kind, result="coalesced"
+            )
+            return await asyncio.shield(self._inflight[k])
+        self.stats["misses"] += 1
+        metrics.inc("mirai_remote_cache_total", kind=kind, result="miss")
+        task = loop.create_task(self._fetch(kind, key))
+        self._inflight[k] = task
+        try:
+            value = await task
+        finally:
+            self._inflight.pop(k, None)
+        self.cache[k] = value
+        return value
+
+    async def resolve_many(self, requests):
+        """resolve many (kind, key) lookups concurrently
+
+        Returns
+        -------
+        results : list
+            value or exception instance, in the same order as requests
+        """
+        return await asyncio.gather(
+            *[self.resolve(kind, key) for kind, key in requests],
+            return_exceptions=True,
+        )
+
+    def resolve_sync(self, kind, key):
+        """blocking version of `resolve`"""
+        return _run(self.resolve(kind, key))
+
+    def resolve_many_sync(self, requests):
+        """blocking version of `resolve_many`"""
+        return _run(self.resolve_many(requests))
+
+    async def _throttle(self, kind):
+        interval = self.min_interval
+        if isinstance(interval, dict):
+            interval = interval.get(kind, 0.0)
+        if interval <= 0:
+            return
+        now = time.monotonic()
+        start = max(now, self._next_call.get(kind, now))
+        self._next_call[kind] = start + interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    async def _fetch(self, kind, key):
+        if kind not in self.fetchers:
+            raise ValueError(f"kind={kind} not in {list(self.fetchers)}")
+        fetcher = self.fetchers[kind]
+        loop = asyncio.get_running_loop()
+        metrics = get_metrics()
+        for attempt in range(self.retries + 1):
+            try:
+                # wait for the rate limit of kind without holding a slot
+                await self._throttle(kind)
+                async with self._semaphore:
+                    # latency of the call only, without throttling
+                    t = time.perf_counter()
+                    status = "error"
+                    try:
+                        if asyncio.iscoroutinefunction(fetcher):
+                            value = await fetcher(key)
+                        else:
+                            value = await loop.run_in_executor(
+                                self._executor, fetcher, key
+                            )
+                        status = "ok"
+                    finally:
+                        metrics.observe(
+                            "mirai_remote_call_seconds",
+                            time.perf_counter() - t,
+                            kind=kind,
+                            status=status,
+                        )
+                    return value
+            except Exception as e:
+                if (not _is_retryable(e)) or (attempt == self.retries):
+                    self.stats["failures"] += 1
+                    metrics.inc("mirai_remote_failures_total", kind=kind)
+                    raise
+                self.stats["retries"] += 1
+                metrics.inc("mirai_remote_retries_total", kind=kind)
+                delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+                # jitter avoids retrying in lockstep with other requests
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+
+
+def _run(coro):
+    """run coroutine to completion even if an event loop is running"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    # e.g. inside jupyter; run in a separate thread with its own loop
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+
+_RESOLVER = None
+
+
+def get_resolver(**kwargs):
+    """shared resolver of this process; kwargs re-create it"""
+    global _RESOLVER
+    if (_RESOLVER is None) or kwargs:
+        _RESOLVER = RemoteResolver(**kwargs)
+    return _RESOLVER
+
+
+def resolve(kind, key):
+    """blocking lookup using the shared resolver"""
+    return get_resolver().resolve_sync(kind, key)
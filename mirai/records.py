@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+r"""
+Compact records of predicted events
+
+Events are kept in a numpy structured array with float64 utc JD times, the
+transit epoch, event flags and a score, so results of many targets are cheap
+to pickle between processes, journal and concatenate. Times are converted to
+iso strings only when shown or saved, with one vectorized `Time` call per
+column instead of one per event.
+
+>>> events = make_events(full, partial, t0, per, dur)
+>>> events_to_frame(events)
+"""
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from astropy.time import Time
+
+__all__ = [
+    "EVENT_DTYPE",
+    "FULL",
+    "PARTIAL",
+    "SECONDARY",
+    "QUADRATURE",
+    "EVENT_KINDS",
+    "make_events",
+    "select_events",
+    "event_names",
+    "events_to_frame",
+    "to_iso",
+    "from_iso",
+]
+
+# ingress, midtransit, egress [utc JD], epoch since t0, flags, score
+EVENT_DTYPE = np.dtype(
+    [
+        ("ingress", "f8"),
+        ("midtransit", "f8"),
+        ("egress", "f8"),
+        ("epoch", "i8"),
+        ("flags", "u1"),
+        ("score", "f4"),
+    ]
+)
+# event flags: observable at ingress & egress and/or at midpoint
+FULL = 1
+PARTIAL = 2
+# kind of event; transits have no kind flag
+SECONDARY = 4
+QUADRATURE = 8
+# kind flag and orbital phases of each event kind
+EVENT_KINDS = {
+    "transit": (0, [0]),
+    "secondary": (SECONDARY, [0.5]),
+    "quadrature": (QUADRATURE, [0.25, 0.75]),
+}
+
+
+def _jd(times):
+    """utc JD of Time or JD array"""
+    if times is None:
+        return np.array([])
+    if isinstance(times, Time):
+        return times.utc.jd
+    return np.asarray(times, dtype=float)
+
+
+def make_events(full, partial, t0, per, dur):
+    """records of full and partial transits
+
+    Parameters
+    ----------
+    full : astropy.time.Time or numpy.ndarray
+        (N,2) ingress & egress times; see `get_transit_windows`
+    partial : astropy.time.Time or numpy.ndarray
+        midtransit times
+    t0, per, dur : float
+        ephemeris in (BJD, d, d)
+
+    Returns
+    -------
+    events : numpy.ndarray
+        EVENT_DTYPE records sorted by midtransit; a transit in both full
+        and partial is one record flagged FULL | PARTIAL as in
+        `get_event_windows`; score is nan
+    """
+    full = _jd(full).reshape(-1, 2)
+    partial = _jd(partial).reshape(-1)
+    events = np.zeros(len(full) + len(partial), dtype=EVENT_DTYPE)
+    n = len(full)
+    events["ingress"][:n] = full[:, 0]
+    events["egress"][:n] = full[:, 1]
+    events["midtransit"][:n] = full.mean(axis=1)
+    events["flags"][:n] = FULL
+    events["ingress"][n:] = partial - dur / 2
+    events["midtransit"][n:] = partial
+    events["egress"][n:] = partial + dur / 2
+    events["flags"][n:] = PARTIAL
+    # utc-tdb offset and light travel time are tiny compared to per
+    events["epoch"] = np.round((events["midtransit"] - t0) / per)
+    events["score"] = np.nan
+    # partial records of full transits are merged into the full record
+    both = np.isin(events["epoch"][n:], events["epoch"][:n])
+    idx = np.isin(events["epoch"][:n], events["epoch"][n:][both])
+    events["flags"][:n][idx] |= PARTIAL
+    events = np.r_[events[:n], events[n:][~both]]
+    return np.sort(events, order="midtransit")
+
+
+def select_events(events):
+    """full events of each kind, or partial ones if a kind has none"""
+    kind = events["flags"] & (SECONDARY | QUADRATURE)
+    full = (events["flags"] & FULL) > 0
+    keep = np.zeros(len(events), dtype=bool)
+    for k in np.unique(kind):
+        idx = kind == k
+        keep |= idx & full if np.any(idx & full) else idx
+    return events[keep]
+
+
+def event_names(flags):
+    """e.g. 'full' and 'partial' for transits, 'secondary_full'"""
+    flags = np.asarray(flags)
+    names = np.where(flags & FULL, "full", "partial").astype(object)
+    for name, (flag, _) in EVENT_KINDS.items():
+        if flag > 0:
+            idx = (flags & flag) > 0
+            names[idx] = name + "_" + names[idx]
+    return names.astype(str)
+
+
+def to_iso(jd, scale="utc"):
+    """iso strings of utc JD in scale"""
+    jd = np.asarray(jd, dtype=float)
+    if len(jd) == 0:
+        return np.array([], dtype=str)
+    return getattr(Time(jd, format="jd", scale="utc"), scale).iso
+
+
+def from_iso(values, scale="utc"):
+    """utc JD of iso strings in scale
+
+    Strings are parsed by pandas and the offset to utc is computed once per
+    day, accurate to a few ms and much faster than parsing with Time.
+    Numbers are taken as utc JD e.g. from `results_to_frame(iso=False)`.
+    """
+    if pd.api.types.is_numeric_dtype(pd.Series(values)):
+        return np.asarray(values, dtype=float)
+    t = pd.to_datetime(pd.Series(values)).values.astype("datetime64[ns]")
+    jd = t.astype("int64") / 86400e9 + 2440587.5
+    days, idx = np.unique(np.floor(jd - 0.5) + 0.5, return_inverse=True)
+    offset = Time(days, format="jd", scale=scale).utc.jd - days
+    return jd + offset[idx]
+
+
+def events_to_frame(events, iso=True, scale="utc"):
+    """events as a DataFrame
+
+    Parameters
+    ----------
+    events : numpy.ndarray
+        EVENT_DTYPE records
+    iso : bool
+        iso strings in scale if True, else utc JD
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        columns: event, ingress, midtransit, egress, epoch
+    """
+    convert = partial(to_iso, scale=scale) if iso else np.asarray
+    return pd.DataFrame(
+        dict(
+            event=event_names(events["flags"]),
+            ingress=convert(events["ingress"]),
+            midtransit=convert(events["midtransit"]),
+            egress=convert(events["egress"]),
+            epoch=events["epoch"],
+        )
+    )
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+r"""
+Select non-overlapping transits per site from predicted windows
+
+Each predicted event is an interval from ingress-padding to egress+padding
+with a priority score. At each site the set of non-overlapping intervals
+with the largest total score is found exactly by weighted interval
+scheduling: intervals are sorted by end time, the last compatible interval
+of each one is found with a binary search, and a single dynamic
+programming pass over the semester picks the best set, O(n log n).
+Nights follow from the selected intervals since one telescope observes one
+target at a time.
+
+Priorities are computed from the TOI/CTOI tables and the predictions:
+
+* depth: transit depth [ppm]
+* tmag: brightness (smaller TESS magnitude first)
+* coverage: full transits before partial ones
+* rarity: targets with fewer events in the predictions first e.g. long
+  periods
+
+and are combined as a weighted sum of percentile ranks,
+e.g. priority={"depth": 1, "rarity": 2}.
+"""
+import pytz
+import numpy as np
+import pandas as pd
+import astropy.units as u
+from astropy.time import Time
+
+from mirai.mirai import SITES, get_tois, get_ctois
+from mirai.catalog import catalog_name
+from mirai.records import from_iso
+
+__all__ = ["get_priorities", "schedule_transits", "PRIORITIES"]
+
+PRIORITIES = ["depth", "tmag", "coverage", "rarity"]
+
+
+def _catalog_info():
+    """depth [ppm] and TESS magnitude of TOIs and CTOIs by catalog_name"""
+    tois = get_tois(clobber=False, remove_FP=False)
+    ctois = get_ctois(clobber=False, remove_FP=False)
+    info = pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "name": [f"toi{x:.2f}" for x in tois["TOI"]],
+                    "depth": tois["Depth (ppm)"].values,
+                    "tmag": tois["TESS Mag"].values,
+                }
+            ),
+            pd.DataFrame(
+                {
+                    "name": [f"ctoi{x:.2f}" for x in ctois["CTOI"]],
+                    "depth": ctois["Depth ppm"].values,
+                    "tmag": ctois["TESS Mag"].values,
+                }
+            ),
+        ]
+    )
+    return info.drop_duplicates(subset="name").set_index("name")
+
+
+def get_priorities(df, priority="depth"):
+    """priority score of each event; higher is observed first
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        predictions with columns target and event; see `results_to_frame`
+    priority : str, dict or callable
+        name in PRIORITIES, {name: weight} or function of df returning
+        scores
+
+    Returns
+    -------
+    score : numpy.ndarray
+        positive scores
+    """
+    if callable(priority):
+        return np.asarray(priority(df), dtype=float)
+    weights = {priority: 1} if isinstance(priority, str) else priority
+    for key in weights:
+        errmsg = f"priority={key} not in {PRIORITIES}"
+        assert key in PRIORITIES, errmsg
+    names = df["target"].map(catalog_name)
+    values = {}
+    if ("depth" in weights) or ("tmag" in weights):
+        info = _catalog_info().reindex(names.values)
+        values["depth"] = info["depth"].values
+        values["tmag"] = -info["tmag"].values
+    values["coverage"] = np.where(df["event"] == "full", 1.0, 0.5)
+    values["rarity"] = 1 / names.map(names.value_counts()).values
+    score = np.zeros(len(df))
+    for key, weight in weights.items():
+        # ranks make different units comparable; unknown values rank last
+        rank = pd.Series(values[key]).rank(pct=True).fillna(0).values
+        score += weight * rank
+    # zero scores would never be selected
+    return score + 1e-6
+
+
+def _weighted_interval_scheduling(start, end, weight):
+    """indices of non-overlapping intervals with the largest total weight"""
+    order = np.argsort(end, kind="stable")
+    start, end, weight = start[order], end[order], weight[order]
+    # number of intervals ending before each one starts
+    p = np.searchsorted(end, start, side="right")
+    n = len(order)
+    best = np.zeros(n + 1)
+    for j in range(1, n + 1):
+        best[j] = max(best[j - 1], weight[j - 1] + best[p[j - 1]])
+    selected = []
+    j = n
+    while j > 0:
+        if weight[j - 1] + best[p[j - 1]] >= best[j - 1]:
+            selected.append(order[j - 1])
+            j = p[j - 1]
+        else:
+            j -= 1
+    return np.array(selected[::-1], dtype=int)
+
+
+def _night(times, site):
+    """local date of the evening of each time"""
+    timezone = pytz.timezone(SITES[site][3] if site in SITES else "UTC")
+    evening = (times - 12 * u.hour).to_datetime(timezone=timezone)
+    return [str(t.date()) for t in evening]
+
+
+def schedule_transits(df, priority="depth", padding=30):
+    """non-overlapping transits with the largest total priority per site
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        predictions of one or more sites; see `results_to_frame`
+    priority : str, dict or callable
+        see `get_priorities`
+    padding : float
+        out-of-transit baseline before ingress and after egress [min]
+
+    Returns
+    -------
+    schedule : pandas.DataFrame
+        selected events with night (local date of the evening), start and
+        end of observation (utc iso) and score, sorted by site and start
+    """
+    df = df[df["event"].notna()].reset_index(drop=True)
+    columns = list(df.columns) + ["night", "start", "end", "score"]
+    if len(df) == 0:
+        return pd.DataFrame(columns=columns)
+    pad = padding / 60 / 24
+    start = from_iso(df["ingress"]) - pad
+    end = from_iso(df["egress"]) + pad
+    score = get_priorities(df, priority=priority)
+    parts = []
+    for site, idx in df.groupby("site").indices.items():
+        keep = idx[
+            _weighted_interval_scheduling(start[idx], end[idx], score[idx])
+        ]
+        d = df.iloc[keep].copy()
+        t1 = Time(start[keep], format="jd")
+        d["night"] = _night(t1, site)
+        d["start"] = t1.iso
+        d["end"] = Time(end[keep], format="jd").iso
+        d["score"] = score[keep]
+        parts.append(d)
+    return pd.concat(parts, ignore_index=True).sort_values(["site", "start"])
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+r"""
+Deterministic, cost-balanced sharding of target lists for multi-node runs
+
+Targets are split into shards of similar estimated run time using the
+longest-processing-time rule with ties broken by name, so the same list,
+window and catalog always give the same shards. Each shard is an ordinary
+target list run independently by `mirai_batch`; a manifest records the
+assignment so that `merge.py -m` can check that the merged outputs contain
+every target exactly once.
+"""
+import json
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from mirai.catalog import CATALOG_COLUMNS, catalog_name
+
+__all__ = [
+    "estimate_costs",
+    "shard_targets",
+    "make_manifest",
+    "merge_shards",
+]
+
+# relative cost of a target (e.g. check_observable) and of each transit
+# evaluated in the window (see `get_transit_windows`)
+TARGET_COST = 1.0
+TRANSIT_COST = 0.05
+
+
+def _catalog_periods():
+    """{catalog_name: period [d]} of the TOI and CTOI tables"""
+    from mirai.mirai import get_tois, get_ctois
+
+    periods = {}
+    for kind, getter in [("toi", get_tois), ("ctoi", get_ctois)]:
+        id_column, columns = CATALOG_COLUMNS[kind]
+        d = getter(clobber=False, remove_FP=False)
+        for i, per in zip(d[id_column].astype(float), d[columns[1]]):
+            periods[f"{kind}{i:.2f}"] = per
+    return periods
+
+
+def estimate_costs(targets, window_days, ephems=None):
+    """relative run time of each target in a window of window_days
+
+    Periods are taken from ephems {target: (t0, per, dur)} or the TOI/CTOI
+    tables; targets with unknown period get the median cost.
+    """
+    ephems = {} if ephems is None else ephems
+    ephems = {catalog_name(k): v for k, v in ephems.items()}
+    periods = None
+    per = np.full(len(targets), np.nan)
+    for i, target in enumerate(targets):
+        name = catalog_name(target)
+        if name in ephems:
+            per[i] = ephems[name][1]
+        elif name.startswith(("toi", "ctoi")):
+            if periods is None:
+                periods = _catalog_periods()
+            per[i] = periods.get(name, np.nan)
+    per = np.where(per > 0, per, np.nan)
+    # epochs in the window whose constraints are evaluated, as in
+    # get_event_times; at least one for periods longer than the window
+    n_transits = np.maximum(window_days / per, 1)
+    costs = TARGET_COST + TRANSIT_COST * n_transits
+    default = np.nanmedian(costs) if np.isfinite(costs).any() else TARGET_COST
+    return np.where(np.isfinite(costs), costs, default)
+
+
+def shard_targets(targets, n_shards, costs=None):
+    """split targets into n_shards lists of similar total cost
+
+    Returns
+    -------
+    shards : list
+        n_shards lists of targets, each in the order of targets
+    loads : numpy.ndarray
+        total cost of each shard
+    """
+    assert n_shards >= 1, "n_shards must be >= 1"
+    costs = np.ones(len(targets)) if costs is None else np.asarray(costs)
+    # most expensive first; ties by name then position for determinism
+    order = sorted(
+        range(len(targets)), key=lambda i: (-costs[i], str(targets[i]), i)
+    )
+    loads = np.zeros(n_shards)
+    members = [[] for _ in range(n_shards)]
+    for i in order:
+        # argmin returns the lowest index among equally loaded shards
+        k = int(np.argmin(loads))
+        loads[k] += costs[i]
+        members[k].append(i)
+    shards = [[targets[i] for i in sorted(m)] for m in members]
+    return shards, loads
+
+
+def _checksum(targets):
+    text = "\n".join(sorted(map(catalog_name, targets)))
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def make_manifest(shards, loads, **kwargs):
+    """json-serializable record of a sharding; kwargs are stored as is"""
+    targets = [t for shard in shards for t in shard]
+    return dict(
+        n_shards=len(shards),
+        n_targets=len(targets),
+        checksum=_checksum(targets),
+        shards=[
+            dict(index=k, cost=float(load), targets=list(shard))
+            for k, (shard, load) in enumerate(zip(shards, loads))
+        ],
+        **kwargs,
+    )
+
+
+def merge_shards(fps, manifest):
+    """merge `mirai_batch` outputs of all shards and check completeness
+
+    Parameters
+    ----------
+    fps : list
+        csv files saved by `mirai_batch -s`, including *_errors.csv
+    manifest : dict or str
+        see `make_manifest`; json file or dict
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        predictions of all shards
+    errors : pandas.DataFrame
+        failed targets of all shards
+    report : dict
+        missing (not in any output), duplicated (in more than one output)
+        and unexpected (not in manifest) targets; empty lists if all is well
+    """
+    if isinstance(manifest, str):
+        with open(manifest) as f:
+            manifest = json.load(f)
+    prefix = manifest.get("target_type", "")
+    expected = set(
+        catalog_name(prefix + str(t))
+        for shard in manifest["shards"]
+        for t in shard["targets"]
+    )
+    ds, es = [], []
+    origin = {}
+    duplicated = set()
+    for fp in sorted(fps):
+        d = pd.read_csv(fp)
+        if "target" not in d.columns:
+            continue
+        for target in set(d["target"].map(catalog_name)):
+            if target in origin:
+                duplicated.add(target)
+            origin[target] = fp
+        (es if fp.endswith("_errors.csv") else ds).append(d)
+    df = pd.concat(ds, ignore_index=True) if ds else pd.DataFrame()
+    errors = pd.concat(es, ignore_index=True) if es else pd.DataFrame()
+    found = set(origin)
+    report = dict(
+        missing=sorted(expected - found),
+        duplicated=sorted(duplicated),
+        unexpected=sorted(found - expected),
+    )
+    return df, errors, report
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+r"""
+Catalog and ephemeris arrays shared read-only by all processes
+
+Numeric columns of the TOI/CTOI tables (id, TIC ID, ephemeris, coordinates,
+distance and false positive flag) and the Earth, Moon and Sun grids are
+written once as .npy files and memory-mapped read-only by every process.
+The OS keeps a single copy in the page cache, so memory stays flat with the
+number of workers of a process pool or of GNU parallel jobs, and workers no
+longer parse the csv tables into their own DataFrames.
+
+Catalog files are keyed by the modification time of the csv so they follow
+`get_tois`/`get_ctois` downloads; grid files are keyed by their window.
+Files are written atomically, so concurrent processes may publish the same
+file safely, and are reused by later runs.
+
+>>> publish_catalogs()  # once, before starting workers
+>>> get_catalog_record("toi", 200.01)
+"""
+import os
+from os.path import join, exists
+from glob import glob
+
+import numpy as np
+import pandas as pd
+from astropy.coordinates import Angle
+
+from mirai.config import DATA_PATH
+from mirai.metrics import get_metrics
+
+__all__ = [
+    "SHARED_PATH",
+    "CATALOG_DTYPE",
+    "shared_array",
+    "publish_catalogs",
+    "get_catalog",
+    "get_catalog_record",
+]
+
+SHARED_PATH = join(DATA_PATH, "shared")
+# one record per candidate; dur [d], ra & dec [deg], distance [pc]
+CATALOG_DTYPE = np.dtype(
+    [
+        ("id", "f8"),
+        ("tic", "i8"),
+        ("t0", "f8"),
+        ("per", "f8"),
+        ("dur", "f8"),
+        ("ra", "f8"),
+        ("dec", "f8"),
+        ("distance", "f8"),
+        ("fp", "?"),
+    ]
+)
+# csv file and columns of the CATALOG_DTYPE fields; fp is a disposition
+_CATALOGS = dict(
+    toi=(
+        "TOIs.csv",
+        [
+            "TOI",
+            "TIC ID",
+            "Epoch (BJD)",
+            "Period (days)",
+            "Duration (hours)",
+            "RA",
+            "Dec",
+            "Stellar Distance (pc)",
+            "TFOPWG Disposition",
+        ],
+    ),
+    ctoi=(
+        "CTOIs.csv",
+        [
+            "CTOI",
+            "TIC ID",
+            "Midpoint (BJD)",
+            "Period (days)",
+            "Duration (hrs)",
+            "RA",
+            "Dec",
+            "Stellar Distance (pc)",
+            "User Disposition",
+        ],
+    ),
+)
+# memory-mapped arrays of this process keyed by file path
+_ARRAYS = {}
+
+
+def shared_array(name, compute, outdir=SHARED_PATH):
+    """read-only memory-mapped array, computed and saved by the first process
+
+    Parameters
+    ----------
+    name : str
+        file name without extension; must identify the content
+    compute : callable
+        returns the numpy array if the file does not exist yet
+
+    Returns
+    -------
+    array : numpy.memmap
+    """
+    fp = join(outdir, name + ".npy")
+    if fp not in _ARRAYS:
+        if not exists(fp):
+            _save_array(fp, compute())
+        try:
+            _ARRAYS[fp] = np.load(fp, mmap_mode="r")
+        except FileNotFoundError:
+            # removed as stale by another process after exists
+            _save_array(fp, compute())
+            _ARRAYS[fp] = np.load(fp, mmap_mode="r")
+    return _ARRAYS[fp]
+
+
+def _save_array(fp, array):
+    os.makedirs(os.path.dirname(fp), exist_ok=True)
+    # readers never see a partially written file
+    tmp = f"{fp}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp, fp)
+    finally:
+        if exists(tmp):
+            os.remove(tmp)
+
+
+def _catalog_records(fp, kind):
+    """CATALOG_DTYPE records of a TOI/CTOI csv sorted by id"""
+    columns = _CATALOGS[kind][1]
+    df = pd.read_csv(fp, usecols=columns)
+    if kind == "ctoi":
+        # as in get_ctois
+        df = df.drop_duplicates()
+    values = {f: df[c].values for f, c in zip(CATALOG_DTYPE.names, columns)}
+    if kind == "toi":
+        # hh:mm:ss and dd:mm:ss
+        values["ra"] = Angle(values["ra"], unit="hourangle").deg
+        values["dec"] = Angle(values["dec"], unit="deg").deg
+    values["dur"] = values["dur"] / 24
+    values["fp"] = values["fp"] == "FP"
+    records = np.zeros(len(df), dtype=CATALOG_DTYPE)
+    for field, value in values.items():
+        records[field] = value
+    # candidates of the same id keep the order of the csv
+    return records[np.argsort(records["id"], kind="stable")]
+
+
+def _catalog_version(kind, datadir):
+    """file name of the records of the current csv"""
+    fp = join(datadir, _CATALOGS[kind][0])
+    return f"{kind}_{os.stat(fp).st_mtime_ns}"
+
+
+def get_catalog(kind, datadir=DATA_PATH, outdir=SHARED_PATH):
+    """shared records of the TOI or CTOI csv in datadir
+
+    Parameters
+    ----------
+    kind : str
+        toi or ctoi
+
+    Returns
+    -------
+    catalog : numpy.memmap
+        CATALOG_DTYPE records sorted by id
+    """
+    errmsg = f"kind={kind} not in {list(_CATALOGS)}"
+    assert kind in _CATALOGS, errmsg
+    fp = join(datadir, _CATALOGS[kind][0])
+    name = _catalog_version(kind, datadir)
+    hit = join(outdir, name + ".npy") in _ARRAYS
+    get_metrics().inc(
+        "mirai_catalog_cache_total",
+        source="shared",
+        result="hit" if hit else "miss",
+    )
+    if hit:
+        return _ARRAYS[join(outdir, name + ".npy")]
+    return shared_array(name, lambda: _catalog_records(fp, kind), outdir)
+
+
+def publish_catalogs(
+    kinds=("toi", "ctoi"), datadir=DATA_PATH, outdir=SHARED_PATH, clean=True
+):
+    """write shared records of catalogs found in datadir; see `get_catalog`
+
+    Parameters
+    ----------
+    clean : bool
+        remove older versions of the records; call once before starting
+        workers, which attach with clean=False
+
+    Returns
+    -------
+    catalogs : dict
+        {kind: records}
+    """
+    catalogs = {
+        kind: get_catalog(kind, datadir=datadir, outdir=outdir)
+        for kind in kinds
+        if exists(join(datadir, _CATALOGS[kind][0]))
+    }
+    if clean:
+        for kind in catalogs:
+            current = join(outdir, _catalog_version(kind, datadir) + ".npy")
+            # processes using an old version keep their map
+            for old in glob(join(outdir, f"{kind}_*.npy")):
+                if old != current:
+                    try:
+                        os.remove(old)
+                    except FileNotFoundError:
+                        pass
+    return catalogs
+
+
+def get_catalog_record(kind, catalog_id, remove_FP=None):
+    """record of a TOI or CTOI id e.g. 200.01 as `get_toi`/`get_ctoi`
+
+    Parameters
+    ----------
+    remove_FP : bool
+        ignore false positives (default: True for TOI, False for CTOI as
+        in `get_toi` and `get_ctoi`)
+    """
+    if remove_FP is None:
+        remove_FP = kind == "toi"
+    catalog_id = float(catalog_id)
+    planet = str(catalog_id).split(".")[1]
+    assert len(planet) == 2, f"use pattern: {kind.upper()}.01"
+    catalog = get_catalog(kind)
+    i1 = np.searchsorted(catalog["id"], catalog_id, side="left")
+    i2 = np.searchsorted(catalog["id"], catalog_id, side="right")
+    rows = catalog[i1:i2]
+    if remove_FP:
+        rows = rows[~rows["fp"]]
+    assert len(rows) > 0, f"{kind.upper()} not found!"
+    if rows["fp"].any():
+        # as printed by get_toi/get_ctoi
+        print("\nTFOPWG/User disposition is a False Positive!\n")
+    return rows[0]
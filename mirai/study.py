@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+r"""
+Observability of many targets from a grid of hypothetical sites
+
+For planning new telescopes, the observable night-time hours and the number
+of observable full and partial transits of every target are computed for
+every site of a latitude x longitude grid. Sun, Moon (see `mirai.moon`) and
+target altitudes follow analytically from the sidereal time for all targets
+of a site at once, and transit times do not depend on the site so they are
+computed once, so hundreds of sites x thousands of targets take minutes
+instead of one astroplan call per site and target.
+
+The constraints are those of `get_constraints`: civil twilight, altitude
+limit and Moon separation. Refraction is ignored as in astroplan.
+
+>>> sites = get_site_grid(np.arange(-60, 61, 10), np.arange(-180, 180, 30))
+>>> df = study_sites(targets, sites, window=("2026-01-01", "2027-01-01"))
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from astropy.time import Time
+from astropy.coordinates import TETE
+
+from mirai.mirai import (
+    get_obs_site,
+    get_t0_per_dur,
+    parse_target_coord,
+    get_event_times,
+)
+from mirai.batch import parse_window, prefetch_coords, _normalize_target
+from mirai.moon import get_moon, get_sun_altitude, apparent_altaz, _splines
+from mirai.tracks import _angular_separation, _directions
+
+__all__ = ["get_site_grid", "study_sites"]
+
+# sun altitude limit of AtNightConstraint.twilight_civil [deg]
+MAX_SOLAR_ALTITUDE = -6
+# targets per vectorized block; bounds memory to ~100 MB per process
+BLOCK_SIZE = 256
+# targets and events of the study shared by the worker processes
+_STUDY = {}
+
+
+def get_site_grid(lats, lons, elev=0):
+    """`get_obs_site` kwargs of every latitude x longitude pair
+
+    Parameters
+    ----------
+    lats, lons : array-like
+        [deg]
+    elev : float
+        elevation of all sites [m]
+
+    Returns
+    -------
+    sites : list
+        dicts with lat, lon, elev and timezone (UTC)
+    """
+    return [
+        dict(lat=float(lat), lon=float(lon), elev=float(elev), timezone="UTC")
+        for lat in lats
+        for lon in lons
+    ]
+
+
+def _init_study(study):
+    """keep targets and events in each worker process"""
+    _STUDY.update(study)
+
+
+def _observable(obs_site, jd, ra, dec, moon, alt_limit, min_moon_sep):
+    """targets above alt_limit and away from the Moon; night not checked"""
+    alt, az = apparent_altaz(obs_site, jd, ra, dec)
+    sep = _angular_separation(alt, az, moon["altitude"], moon["azimuth"])
+    return (alt >= alt_limit) & (sep >= min_moon_sep)
+
+
+def _at_night(obs_site, jd):
+    return get_sun_altitude(obs_site, jd) < MAX_SOLAR_ALTITUDE
+
+
+def _study_site(site):
+    """observable hours, full and partial transits of all targets at site"""
+    obs_site = get_obs_site(**site)
+    ra, dec = _STUDY["ra"], _STUDY["dec"]
+    alt_limit, min_moon_sep = _STUDY["alt_limit"], _STUDY["min_moon_sep"]
+    # night-time grid shared by all targets
+    jd = _STUDY["grid"]
+    jd = jd[_at_night(obs_site, jd)]
+    moon = get_moon(obs_site, jd)
+    hours = np.zeros(len(ra), dtype=np.float32)
+    for i in range(0, len(ra), BLOCK_SIZE):
+        block = slice(i, i + BLOCK_SIZE)
+        ok = _observable(
+            obs_site,
+            jd,
+            ra[block, np.newaxis],
+            dec[block, np.newaxis],
+            moon,
+            alt_limit,
+            min_moon_sep,
+        )
+        hours[block] = ok.sum(axis=1) * _STUDY["step"] * 24
+
+    # events at ingress, midtransit and egress
+    idx, times = _STUDY["event_target"], _STUDY["event_times"]
+    ok = _at_night(obs_site, times) & _observable(
+        obs_site,
+        times,
+        ra[idx, np.newaxis],
+        dec[idx, np.newaxis],
+        get_moon(obs_site, times),
+        alt_limit,
+        min_moon_sep,
+    )
+    full = ok[:, 0] & ok[:, 2] & _STUDY["event_complete"]
+    # as PARTIAL of get_event_windows, full transits included
+    partial = ok[:, 1]
+    n = len(ra)
+    return pd.DataFrame(
+        dict(
+            lat=np.float32(site["lat"]),
+            lon=np.float32(site["lon"]),
+            target=_STUDY["targets"],
+            hours=hours,
+            n_full=np.bincount(idx[full], minlength=n).astype(np.int32),
+            n_partial=np.bincount(idx[partial], minlength=n).astype(np.int32),
+        )
+    )
+
+
+def study_sites(
+    targets,
+    sites,
+    window=None,
+    ephems=None,
+    n_workers=None,
+    alt_limit=30,
+    min_moon_sep=10,
+    resolution=10,
+    clobber=False,
+):
+    """observability summary of every target from every site
+
+    Parameters
+    ----------
+    targets : list
+        target names e.g. toi200.01
+    sites : list
+        kwargs of `get_obs_site` e.g. from `get_site_grid`
+    window : tuple
+        (start, end) of observation; see `parse_window`
+    ephems : dict
+        {target: (t0, per, dur)}; queried from TOI/CTOI if not given
+    n_workers : int
+        number of processes (default=os.cpu_count()); 1 runs serially
+    alt_limit, min_moon_sep : float
+        see `get_constraints` [deg]
+    resolution : float
+        time grid spacing of observable hours [min]
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        one row per site and target: lat, lon, target, hours (observable at
+        night), n_full (observable at ingress and egress) and n_partial
+        (observable at midtransit, including full ones as in
+        `get_event_windows`); targets whose coordinates or ephemeris
+        cannot be found are printed and left out
+    """
+    obs_start, obs_end = parse_window(window)
+    ephems = {_normalize_target(k): v for k, v in (ephems or {}).items()}
+    names = list(dict.fromkeys(_normalize_target(t) for t in targets))
+    coords = prefetch_coords(names)
+    found = {}
+    for name in names:
+        try:
+            coord = coords.get(name)
+            if coord is None:
+                coord = parse_target_coord(name, clobber=clobber)
+            elif isinstance(coord, Exception):
+                raise coord
+            ephem = ephems.get(name)
+            if ephem is None:
+                ephem = get_t0_per_dur(name, clobber=clobber)
+            t0, per, dur = map(float, ephem)
+            # transit times at the Earth are the same for all sites
+            _, mids = get_event_times(t0, per, obs_start, obs_end, coord)
+            found[name] = (coord, mids, dur)
+        except Exception as e:
+            print(f"{name}: {type(e).__name__} {e}")
+    if len(found) == 0:
+        return pd.DataFrame(
+            columns=["lat", "lon", "target", "hours", "n_full", "n_partial"]
+        )
+    names = list(found)
+    coords = _directions([c for c, _, _ in found.values()])
+    # apparent place at the middle of the window; changes by < 0.05 deg/yr
+    mid = Time((obs_start.jd + obs_end.jd) / 2, format="jd")
+    apparent = coords.transform_to(TETE(obstime=mid))
+
+    event_target, event_times, complete = [], [], []
+    for i, (_, mids, dur) in enumerate(found.values()):
+        event_target.append(np.full(len(mids), i))
+        event_times.append(np.c_[mids - dur / 2, mids, mids + dur / 2])
+        complete.append(mids + dur / 2 < obs_end.utc.jd)
+    step = resolution / 1440
+    study = dict(
+        targets=np.array(names),
+        ra=apparent.ra.rad,
+        dec=apparent.dec.rad,
+        alt_limit=alt_limit,
+        min_moon_sep=min_moon_sep,
+        step=step,
+        grid=np.arange(obs_start.utc.jd, obs_end.utc.jd, step),
+        event_target=np.concatenate(event_target),
+        event_times=np.concatenate(event_times),
+        event_complete=np.concatenate(complete),
+    )
+    # moon and sun ephemeris is computed before workers are forked
+    _ = _splines(obs_start.utc.jd, obs_end.utc.jd + 1)
+    if n_workers == 1:
+        _init_study(study)
+        frames = [_study_site(site) for site in sites]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            initializer=_init_study,
+            initargs=(study,),
+        ) as executor:
+            frames = list(executor.map(_study_site, sites, chunksize=4))
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+r"""
+Transit predictions of multi-candidate systems computed once per host star
+
+Candidates sharing a TIC ID (e.g. toi1749.01 and toi1749.02) share their
+coordinates, visibility check and altitude tracks, so these are computed
+once per host and only the ephemerides are evaluated per candidate. The
+result lists the transits of all candidates per night and flags nights
+with more than one candidate transiting.
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import astropy.units as u
+from astropy.time import Time
+
+from mirai.mirai import (
+    get_tois,
+    get_ctois,
+    get_obs_site,
+    get_constraints,
+    check_observable,
+    parse_target_coord,
+)
+from mirai.catalog import CATALOG_COLUMNS, catalog_name
+from mirai.tracks import get_tracks
+from mirai.records import to_iso
+from mirai.batch import (
+    predict_transit,
+    results_to_frame,
+    prefetch_coords,
+    parse_window,
+    _init_worker,
+    _normalize_target,
+    _parse_site,
+)
+
+__all__ = ["get_hosts", "predict_systems"]
+
+
+def get_hosts(targets, clobber=False):
+    """TIC ID of the host of each TOI, CTOI or TIC target
+
+    Returns
+    -------
+    hosts : list
+        TIC ID (int) or None if the host is unknown
+    """
+    index = {}
+    for kind, getter in [("toi", get_tois), ("ctoi", get_ctois)]:
+        id_column, _ = CATALOG_COLUMNS[kind]
+        d = getter(clobber=clobber, remove_FP=False)
+        for i, tic in zip(d[id_column].astype(float), d["TIC ID"]):
+            index[f"{kind}{i:.2f}"] = int(tic)
+    hosts = []
+    for target in targets:
+        name = _normalize_target(target)
+        if name.startswith("tic"):
+            hosts.append(int(name[3:].split(".")[0]))
+        else:
+            hosts.append(index.get(catalog_name(name)))
+    return hosts
+
+
+def _predict_host(
+    host, targets, site, window, coord, ephems, alt_limit, min_moon_sep, kwargs
+):
+    """predictions of all candidates of a host and its altitude tracks"""
+    obs_site = get_obs_site(**site)
+    constraints = get_constraints(
+        alt_limit=alt_limit, min_moon_sep=min_moon_sep
+    )
+    try:
+        if isinstance(coord, Exception):
+            raise coord
+        _ = check_observable(coord, obs_site, constraints)
+    except Exception as e:
+        results = [
+            dict(
+                target=_normalize_target(t),
+                site=obs_site.name,
+                status="error",
+                error_type=type(e).__name__,
+                error=str(e),
+            )
+            for t in targets
+        ]
+        return host, results, None
+    results = [
+        predict_transit(
+            t,
+            site=site,
+            window=window,
+            ephem=ephems.get(_normalize_target(t)),
+            coord=coord,
+            alt_limit=alt_limit,
+            min_moon_sep=min_moon_sep,
+            check=False,
+            **kwargs,
+        )
+        for t in targets
+    ]
+    mids = [
+        r["events"]["midtransit"]
+        for r in results
+        if (r["status"] == "ok") and (r["events"] is not None)
+    ]
+    mids = np.concatenate(mids) if mids else np.array([])
+    if len(mids) == 0:
+        return host, results, None
+    # one track per night shared by all candidates
+    midnights = obs_site.midnight(Time(mids, format="jd"), which="nearest")
+    _, idx = np.unique(np.round(midnights.jd, 1), return_index=True)
+    tracks = get_tracks(coord, obs_site, midnights[idx])
+    return host, results, tracks
+
+
+def _night_table(df, tracks, obs_site):
+    """add host night, altitude at midtransit and multi-transit flags"""
+    ok = df["midtransit"].notna()
+    df["night"] = None
+    df["altitude"] = np.nan
+    if ok.sum() == 0:
+        return df
+    mid = Time(df.loc[ok, "midtransit"].values.astype(float), format="jd")
+    # night is the local date of the evening
+    evening = (mid - 12 * u.hour).to_datetime(timezone=obs_site.timezone)
+    df.loc[ok, "night"] = [str(t.date()) for t in evening]
+    if tracks is not None:
+        times = tracks["times"].jd
+        # index of the track centered closest to each midtransit
+        center = times[:, times.shape[1] // 2]
+        n = np.argmin(np.abs(center - mid.jd[:, np.newaxis]), axis=1)
+        df.loc[ok, "altitude"] = [
+            np.interp(m, times[i], tracks["altitude"][0, i])
+            for m, i in zip(mid.jd, n)
+        ]
+    return df
+
+
+def predict_systems(targets, site="OT", window=None, n_workers=None, **kwargs):
+    """predict transits of candidates grouped by host star
+
+    Parameters
+    ----------
+    targets : list
+        target names e.g. toi1749.01, toi1749.02, tic233602827.03
+    site : str or dict
+        site name in SITES or kwargs of `get_obs_site`
+    window : tuple
+        (start, end) of observation; see `parse_window`
+    n_workers : int
+        number of processes (default=os.cpu_count()); 1 runs serially
+    kwargs : dict
+        ephems, alt_limit, min_moon_sep, clobber; see `predict_transits`
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        one row per event as in `results_to_frame` with host, night (local
+        date of the evening), altitude at midtransit [deg], n_candidates
+        transiting the host that night and multi (n_candidates > 1)
+    """
+    site = _parse_site(site)
+    window = parse_window(window)
+    ephems = kwargs.pop("ephems", None) or {}
+    ephems = {_normalize_target(k): v for k, v in ephems.items()}
+    alt_limit = kwargs.pop("alt_limit", 30)
+    min_moon_sep = kwargs.pop("min_moon_sep", 10)
+    clobber = kwargs.get("clobber", False)
+    obs_site = get_obs_site(**site)
+
+    groups = {}
+    for target, host in zip(targets, get_hosts(targets, clobber=clobber)):
+        key = _normalize_target(target) if host is None else host
+        groups.setdefault(key, []).append(target)
+    # coordinates once per host from its first candidate
+    firsts = {key: _normalize_target(ts[0]) for key, ts in groups.items()}
+    coords = prefetch_coords(list(firsts.values()))
+    for key, first in firsts.items():
+        if first not in coords:
+            try:
+                coords[first] = parse_target_coord(first, clobber=clobber)
+            except Exception as e:
+                coords[first] = e
+    jobs = [
+        (
+            key,
+            ts,
+            site,
+            window,
+            coords[firsts[key]],
+            {
+                _normalize_target(t): ephems.get(_normalize_target(t))
+                for t in ts
+            },
+            alt_limit,
+            min_moon_sep,
+            kwargs,
+        )
+        for key, ts in groups.items()
+    ]
+    if n_workers == 1:
+        _init_worker(site, clobber=clobber)
+        outputs = [_predict_host(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            initializer=_init_worker,
+            initargs=(site, clobber),
+        ) as executor:
+            futures = [executor.submit(_predict_host, *job) for job in jobs]
+            outputs = [f.result() for f in as_completed(futures)]
+
+    frames = []
+    for host, results, tracks in outputs:
+        d = results_to_frame(results, iso=False)
+        d.insert(0, "host", host)
+        frames.append(_night_table(d, tracks, obs_site))
+    df = pd.concat(frames, ignore_index=True)
+    has_night = df["night"].notna()
+    n = df[has_night].groupby(["host", "night"])["target"].transform("nunique")
+    df["n_candidates"] = 0
+    df.loc[has_night, "n_candidates"] = n
+    df["multi"] = df["n_candidates"] > 1
+    df = df.sort_values(["night", "host", "midtransit"], na_position="last")
+    # iso strings only for the output
+    for col in ["ingress", "midtransit", "egress"]:
+        has_time = df[col].notna()
+        df[col] = df[col].astype(object)
+        df.loc[has_time, col] = to_iso(df.loc[has_time, col].astype(float))
+    return df
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+r"""
+Altitude, airmass, Sun and Moon time series of many targets over many nights
+
+All arrays are computed in one vectorized call and can be reused for plots
+(see `plot_tracks`) and downstream tools. Sun and Moon positions depend only
+on site and times, so they are cached and shared by all targets.
+"""
+from collections import OrderedDict
+
+import numpy as np
+import astropy.units as u
+from astropy.time import Time
+from astropy.coordinates import SkyCoord, AltAz, get_body, get_sun
+
+__all__ = ["get_tracks", "get_sun_moon", "plot_tracks"]
+
+# sun and moon alt/az keyed by site and times; least recently used first
+_SUN_MOON_CACHE = OrderedDict()
+# entries kept e.g. a few sites x nights; each host in `systems` adds one
+MAX_SUN_MOON_ENTRIES = 32
+# background is darkened at each sun altitude limit [deg]: sunset, civil,
+# nautical and astronomical twilight
+TWILIGHT_LIMITS = [0, -6, -12, -18]
+
+
+def _site_key(obs_site):
+    loc = obs_site.location
+    return (obs_site.name, loc.lat.deg, loc.lon.deg, loc.height.value)
+
+
+def _directions(coords):
+    """flat ICRS SkyCoord without distances of a SkyCoord or list of them
+
+    Catalog coordinates with and without distance cannot be stacked, and
+    alt/az only needs the direction.
+    """
+    if isinstance(coords, SkyCoord):
+        coords = [coords]
+    icrs = [c.icrs for c in coords]
+    ra = np.concatenate([np.ravel(c.ra.deg) for c in icrs])
+    dec = np.concatenate([np.ravel(c.dec.deg) for c in icrs])
+    return SkyCoord(ra=ra, dec=dec, unit=(u.deg, u.deg))
+
+
+def get_sun_moon(obs_site, times):
+    """Sun and Moon alt/az at times; cached per site and times
+
+    Parameters
+    ----------
+    obs_site : astroplan.Observer
+    times : astropy.time.Time
+        any shape
+
+    Returns
+    -------
+    sun_moon : dict
+        sun_altitude, moon_altitude, moon_azimuth [deg] with shape of times
+    """
+    key = (_site_key(obs_site), times.shape, times.jd.tobytes())
+    if key in _SUN_MOON_CACHE:
+        _SUN_MOON_CACHE.move_to_end(key)
+    else:
+        flat = times.flatten()
+        frame = AltAz(obstime=flat, location=obs_site.location)
+        sun = get_sun(flat).transform_to(frame)
+        moon = get_body("moon", flat, location=obs_site.location)
+        moon = moon.transform_to(frame)
+        _SUN_MOON_CACHE[key] = dict(
+            sun_altitude=sun.alt.deg.reshape(times.shape),
+            moon_altitude=moon.alt.deg.reshape(times.shape),
+            moon_azimuth=moon.az.deg.reshape(times.shape),
+        )
+        while len(_SUN_MOON_CACHE) > MAX_SUN_MOON_ENTRIES:
+            _SUN_MOON_CACHE.popitem(last=False)
+    return _SUN_MOON_CACHE[key]
+
+
+def _angular_separation(alt1, az1, alt2, az2):
+    """separation [deg] between alt/az positions [deg]"""
+    alt1, az1, alt2, az2 = map(np.radians, (alt1, az1, alt2, az2))
+    cos_sep = np.sin(alt1) * np.sin(alt2) + np.cos(alt1) * np.cos(
+        alt2
+    ) * np.cos(az1 - az2)
+    return np.degrees(np.arccos(np.clip(cos_sep, -1, 1)))
+
+
+def get_tracks(target_coords, obs_site, ref_times, n_samples=145):
+    """altitude time series of targets on the nights of ref_times
+
+    Each night is sampled from ref_time-12h to ref_time+12h.
+
+    Parameters
+    ----------
+    target_coords : SkyCoord or list of SkyCoord
+        n_targets coordinates
+    obs_site : astroplan.Observer
+    ref_times : astropy.time.Time
+        n_nights reference times e.g. midtransit or local midnight
+    n_samples : int
+        samples per night (default=145; 10 min)
+
+    Returns
+    -------
+    tracks : dict
+        times (n_nights, n_samples) Time,
+        altitude, airmass, moon_separation (n_targets, n_nights, n_samples),
+        sun_altitude, moon_altitude (n_nights, n_samples),
+        sunset, sunrise (n_nights) Time nearest to ref_times;
+        angles are in deg, airmass is nan below the horizon
+    """
+    target_coords = _directions(target_coords)
+    ref_times = Time(ref_times).reshape(-1)
+    offsets = np.linspace(-12, 12, n_samples) * u.hour
+    times = ref_times[:, np.newaxis] + offsets[np.newaxis, :]
+    flat = times.flatten()
+
+    # targets x times in one transformation
+    frame = AltAz(obstime=flat[np.newaxis, :], location=obs_site.location)
+    altaz = target_coords[:, np.newaxis].transform_to(frame)
+    shape = (len(target_coords),) + times.shape
+    alt = altaz.alt.deg.reshape(shape)
+    az = altaz.az.deg.reshape(shape)
+    airmass = np.where(alt > 0, 1 / np.cos(np.radians(90 - alt)), np.nan)
+
+    sun_moon = get_sun_moon(obs_site, times)
+    moon_sep = _angular_separation(
+        alt, az, sun_moon["moon_altitude"], sun_moon["moon_azimuth"]
+    )
+    tracks = dict(
+        times=times,
+        altitude=alt,
+        airmass=airmass,
+        sun_altitude=sun_moon["sun_altitude"],
+        moon_altitude=sun_moon["moon_altitude"],
+        moon_separation=moon_sep,
+        sunset=obs_site.sun_set_time(ref_times, which="nearest"),
+        sunrise=obs_site.sun_rise_time(ref_times, which="nearest"),
+    )
+    return tracks
+
+
+def plot_tracks(
+    tracks,
+    i_target=0,
+    i_night=0,
+    ax=None,
+    min_altitude=20,
+    brightness_shading=True,
+    airmass_yaxis=True,
+    label=None,
+):
+    """plot altitude of a target on a night from precomputed tracks
+
+    Same layout as astroplan.plots.plot_altitude
+    """
+    import matplotlib.pyplot as pl
+    from matplotlib import dates
+
+    if ax is None:
+        ax = pl.gca()
+    times = tracks["times"][i_night].datetime
+    alt = tracks["altitude"][i_target, i_night]
+    ax.plot(times, np.ma.array(alt, mask=alt < 0), ls="-", lw=1.5, label=label)
+    ax.set_xlim(times[0], times[-1])
+    ax.xaxis.set_major_formatter(dates.DateFormatter("%H:%M"))
+    pl.setp(ax.get_xticklabels(), rotation=30, ha="right")
+
+    if brightness_shading:
+        sun_alt = tracks["sun_altitude"][i_night]
+        for limit in TWILIGHT_LIMITS:
+            ax.fill_between(
+                times,
+                0,
+                1,
+                where=sun_alt < limit,
+                color="grey",
+                alpha=0.1,
+                lw=0,
+                transform=ax.get_xaxis_transform(),
+            )
+    ax.set_ylim(min_altitude, 91)
+    ax.set_ylabel("Altitude")
+    ax.set_xlabel(f"Time from {times[0].date()} [UTC]")
+
+    if airmass_yaxis:
+        airmass_ticks = np.array([1, 2, 3])
+        altitude_ticks = 90 - np.degrees(np.arccos(1 / airmass_ticks))
+        ax2 = ax.twinx()
+        ax2.set_yticks(altitude_ticks)
+        ax2.set_yticklabels(airmass_ticks)
+        ax2.set_ylim(ax.get_ylim())
+        ax2.set_ylabel("Airmass")
+    return ax
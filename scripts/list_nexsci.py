@@ -11,14 +11,13 @@ import argparse
 
 import numpy as np
 import astropy.units as u
-from astroquery.nasa_exoplanet_archive import NasaExoplanetArchive
 from astropy.coordinates import SkyCoord
 import pandas as pd
 
 pd.options.display.float_format = "{:.2f}".format
 
 from mirai.mirai import (
-    get_tois,
+    get_nexsci,
     get_between_limits,
     get_above_lower_limit,
     get_below_upper_limit,
@@ -35,17 +34,20 @@ arg.add_argument(
     action="store_true",
     default=False,
 )
+arg.add_argument(
+    "-c", "--clobber", help="re-download table", action="store_true"
+)
 args = arg.parse_args()
 
-output_colums = ",".split(",")
+output_colums = "pl_name,pl_orbper,pl_rade,sy_vmag".split(",")
 
-# fetch transiting planets from nexsci
-archive = NasaExoplanetArchive.get_confirmed_planets_table(cache=False)
-transit = archive[archive["method"] == "transit"]
+# fetch transiting planets from local nexsci snapshot
+transit = get_nexsci(clobber=args.clobber)
 teff = transit["st_teff"]  # stellar effective temperature
 rstar = transit["st_rad"]  # stellar radius
 a = transit["pl_orbsmax"]  # orbital semimajor axis
-teq = (teff * np.sqrt(rstar / (2 * a))).decompose()
+# plain floats; a unit times a pandas Series raises
+teq = teff * np.sqrt(rstar * u.R_sun.to(u.au) / (2 * a))
 
 # ---define filters---#
 # transit
@@ -53,7 +55,7 @@ Porb = transit["pl_orbper"]
 # multisector = tois['Sectors'].apply(lambda x: True if len(x.split(',')) > 1 else False)
 # site-specific
 # star
-bright = transit["st_Vmag"] < 11
+bright = transit["sy_vmag"] < 11
 # planet
 # size
 # orbit
@@ -108,11 +110,11 @@ idx = (
     # & radius_gap
 )
 
-# filename_header = "all"
-# if args.save:
-#     # just save list of toi
-#     fp = path.join(args.outdir, filename_header + "_tois.txt")
-#     tois.loc[idx, "TOI"].to_csv(fp, index=False, header=None)
-#     print(f"Saved: {fp}")
-# else:
-#     print(tois.loc[idx, output_colums].to_string(index=False))
+filename_header = "all"
+if args.save:
+    # just save list of planet names
+    fp = path.join(args.outdir, filename_header + "_nexsci.txt")
+    transit.loc[idx, "pl_name"].to_csv(fp, index=False, header=None)
+    print(f"Saved: {fp}")
+else:
+    print(transit.loc[idx, output_colums].to_string(index=False))
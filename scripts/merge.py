@@ -1,5 +1,6 @@
 #!/usr/bin/env python
-from os.path import join
+from os.path import join, basename
+import sys
 import argparse
 
 from glob import glob
@@ -22,6 +23,13 @@ if __name__ == "__main__":
     arg.add_argument(
         "-ext", help="file extension to read (default='csv')", default="csv"
     )
+    arg.add_argument(
+        "-m",
+        "--manifest",
+        help="shard manifest from mirai_shard; merge mirai_batch outputs and check that every target is found exactly once",
+        type=str,
+        default=None,
+    )
     args = arg.parse_args()
     indir = args.input_dir
     ext = args.ext
@@ -29,6 +37,29 @@ if __name__ == "__main__":
     filelist = glob(join(indir, f"*.{ext}"))
     assert len(filelist) > 0, f"no {ext} file found"
 
+    if args.manifest is not None:
+        from mirai.shard import merge_shards
+
+        filelist = [f for f in filelist if not basename(f).startswith("merged")]
+        df, errors, report = merge_shards(filelist, args.manifest)
+        print(
+            f"{df.target.nunique() if len(df) else 0} targets with predictions, "
+            f"{len(errors)} errors from {len(filelist)} files"
+        )
+        for key, targets in report.items():
+            if len(targets) > 0:
+                print(f"{len(targets)} {key}: {' '.join(targets[:20])}")
+        if args.save:
+            fp = join(indir, "merged.csv")
+            df.to_csv(fp, index=False)
+            print(f"Saved: {fp}")
+            if len(errors) > 0:
+                fp = join(indir, "merged_errors.csv")
+                errors.to_csv(fp, index=False)
+                print(f"Saved: {fp}")
+        # non-zero exit status if a target was lost or duplicated
+        sys.exit(1 if any(len(v) > 0 for v in report.values()) else 0)
+
     ds = []
     for i in filelist:
         d = pd.read_csv(i)
@@ -18,6 +18,12 @@ setup(
         scripts=[
         "scripts/mirai",
         "scripts/visible_months",
+        "scripts/mirai_batch",
+        "scripts/mirai_shard",
+        "scripts/mirai_schedule",
+        "scripts/mirai_index",
+        "scripts/mirai_study",
+        "scripts/mirai_validate",
         # "scripts/list_toi",
         # "scripts/list_ctoi"
     ],
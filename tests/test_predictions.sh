@@ -53,7 +53,13 @@ $cmd
 echo
 
 echo "TEST: Specified ephemeris"
-cmd="mirai wasp-127 -v -n -per 4.178062 -t0 2457248.74131 -dur 0.1795" #TODO: query ephem from nexsci
+cmd="mirai wasp-127 -v -n -per 4.178062 -t0 2457248.74131 -dur 0.1795"
+echo $cmd
+$cmd
+echo
+
+echo "TEST: Known planet using NExSci ephemeris"
+cmd="mirai wasp-127 -v -n"
 echo $cmd
 $cmd
 echo
@@ -82,3 +88,9 @@ cmd="mirai toi837.01 -site AAO -v -n -p -s"
 echo $cmd
 $cmd
 echo
+
+echo "TEST: fast paths agree with astroplan (exits with 1 otherwise)"
+cmd="mirai_validate -n 8"
+echo $cmd
+$cmd
+echo